@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Cumulative + selective ACKs (server and client side).
+#
+# Instead of one ACK per DATA the server can send one MSG_SACK per device,
+# every ACK_EVERY packets or ACK_DELAY seconds:
+#   13 byte ITP header, msgtype MSG_SACK, seq = cumulative ack (16 bits)
+#   !Q  bitmap, bit i set means reading id (cum + 1 + i) was received
+# "cumulative ack" is the highest reading id such that every id up to it has
+# arrived. Ids are the reading ids of the batches, so a DATA packet with seq s
+# and a batch of n readings covers s .. s+n-1.
+#
+# An id that never arrives would hold the cumulative ack back for good, so the
+# server gives up on it (skip_to) once the reorder buffer has, and the tracker
+# does on its own for ids more than `size` behind the newest one. The
+# cumulative ack then means "received or given up on".
+
+import struct
+from seq_window import seq_delta
+
+MSG_SACK = 5
+
+SACK_BITS = 64
+SACK_PAYLOAD = struct.Struct("!Q")
+SACK_MASK = (1 << SACK_BITS) - 1
+
+# how far past the cumulative ack we remember received ids
+DEFAULT_TRACK = 1024
+
+
+class AckTracker:
+    __slots__ = ("size", "cum", "bits")
+
+    def __init__(self, size=DEFAULT_TRACK):
+        self.size = size
+        self.reset()
+
+    def reset(self, cum=0):
+        self.cum = cum
+        self.bits = 0   # bit i -> id cum+1+i received
+
+    def add(self, first_id, count):
+        # mark first_id .. first_id+count-1 received, advance the cumulative ack
+        offset = first_id - (self.cum + 1)
+        end = offset + count
+        if end <= 0:
+            return
+        if offset < 0:
+            offset = 0
+        if end > self.size:
+            # too far ahead to remember: slide the window up, the oldest
+            # missing ids fall out of it and count as given up
+            slide = end - self.size
+            self.bits >>= slide
+            self.cum += slide
+            offset = max(0, offset - slide)
+            end = self.size
+        self.bits |= ((1 << (end - offset)) - 1) << offset
+        self._advance()
+
+    def skip_to(self, first_id):
+        # everything before first_id is given up on (lost for good), move the
+        # cumulative ack to first_id - 1 and on over what arrived after it
+        shift = first_id - 1 - self.cum
+        if shift <= 0:
+            return
+        self.bits >>= shift
+        self.cum += shift
+        self._advance()
+
+    def _advance(self):
+        if self.bits & 1:
+            # number of trailing ones = how far the cumulative ack moves
+            run = (~self.bits & (self.bits + 1)).bit_length() - 1
+            self.cum += run
+            self.bits >>= run
+
+    def sack_bitmap(self):
+        return self.bits & SACK_MASK
+
+
+def unwrap_seq(seq16, ref):
+    # 16-bit seq from the wire -> full seq closest to `ref`
+    return ref + seq_delta(seq16, ref)
+
+
+def sack_covers(cum, bitmap, first_id):
+    # True if a batch starting at first_id is acked by (cum, bitmap). A batch is
+    # always added in one go so its first id tells for the whole batch.
+    if first_id <= cum:
+        return True
+    offset = first_id - cum - 1
+    return offset < SACK_BITS and bool(bitmap >> offset & 1)
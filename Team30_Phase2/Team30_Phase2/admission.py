@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+# Admission control in front of the server's packet handlers.
+#
+# Two token buckets decide whether a datagram gets the full treatment:
+#   global   every datagram the process receives, whatever device it claims
+#            (a junk flood runs this one dry, not the sessions table)
+#   device   DATA per session, so one chatty device can't eat the global budget
+# Both refill continuously at `rate` tokens/s up to `burst`, a packet takes one.
+# The check is a few float ops right after the header unpack, nothing about
+# the payload has been looked at yet.
+#
+# DATA over budget is shed according to the policy:
+#   drop      nothing happens, a reliable client retransmits later
+#   ack-only  ACKed without decoding or logging it, the client moves on and
+#             the readings are lost on purpose (shows up as a gap)
+#   sample    one in `sample_every` shed packets is processed anyway, so a
+#             throttled device still shows up in the logs and the store
+# Anything else over the global budget (INIT, HEARTBEAT, END, junk) is dropped.
+
+POLICIES = ("drop", "ack-only", "sample")
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "last")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = now
+
+    def take(self, now):
+        tokens = self.tokens + (now - self.last) * self.rate
+        self.last = now
+        if tokens > self.burst:
+            tokens = self.burst
+        if tokens >= 1.0:
+            self.tokens = tokens - 1.0
+            return True
+        self.tokens = tokens
+        return False
+
+
+class Admission:
+    def __init__(self, device_rate=0.0, device_burst=None, global_rate=0.0, global_burst=None,
+                 policy="drop", sample_every=10, now=0.0):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown shed policy {policy!r}, expected one of {POLICIES}")
+        # a burst of one second's worth unless told otherwise
+        self.device_rate = device_rate
+        self.device_burst = device_burst or max(device_rate, 1.0)
+        self.global_bucket = TokenBucket(global_rate, global_burst or max(global_rate, 1.0), now) \
+            if global_rate > 0 else None
+        self.policy = policy
+        self.sample_every = max(1, sample_every)
+        self.stats = {"shed_global": 0, "shed_device": 0, "shed_other": 0, "acked_only": 0, "sampled": 0}
+
+    def device_bucket(self, now):
+        # a new session's bucket, None when there's no per-device limit
+        return TokenBucket(self.device_rate, self.device_burst, now) if self.device_rate > 0 else None
+
+    def admit(self, now):
+        # global budget, for every datagram
+        bucket = self.global_bucket
+        return bucket is None or bucket.take(now)
+
+    def shed(self, session, over_global):
+        # DATA of session that didn't get a token. Returns True if the sample
+        # policy lets it through anyway.
+        self.stats["shed_global" if over_global else "shed_device"] += 1
+        session["shed"] += 1
+        if self.policy == "sample" and session["shed"] % self.sample_every == 0:
+            self.stats["sampled"] += 1
+            return True
+        return False
@@ -1,58 +1,141 @@
 import pandas as pd
+import numpy as np
 import os
+import re
 import glob
-from collections import defaultdict
+import json
+import math
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 # --- CONFIGURATION ---
-# IMPORTANT: This must match the total number of unique packets your client sent per run.
-# We are assuming the recommended value of 200 messages (NUM_MESSAGES = 200, BATCH_SIZE = 1).
-TOTAL_SENT_PACKETS = 250
+# Sent counts come from the run itself (see sent_packets()), this only overrides them.
+TOTAL_SENT_PACKETS = None
+RAW_DATA_DIR = "raw_data"
+# Per-run metrics are cached here, keyed by path + size + mtime of the run's files,
+# so re-running the analysis only reads the runs that are new or changed.
+CACHE_FILE = os.path.join(RAW_DATA_DIR, ".analysis_cache.json")
+CACHE_VERSION = 3
 # ---------------------
 
+SCENARIO_ORDER = ['baseline', 'loss', 'delay']
+PACKET_COLUMNS = {'device_id': 'uint16', 'seq': 'int64', 'duplicate_flag': 'uint8',
+                  'gap_flag': 'uint8', 'network_delay_s': 'float64', 'corrected_delay_s': 'float64'}
+
+# two sided 95% t quantiles for 1..30 degrees of freedom, normal after that
+T95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+       2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+       2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def run_files(file_path):
+    """The packets log plus the manifests run_expirments.py writes next to it."""
+    prefix = file_path[:-len("packets_log.csv")]
+    return [file_path, prefix + "client_log.txt", prefix + "cell.json"]
+
+
+def run_signature(file_path):
+    sig = []
+    for path in run_files(file_path):
+        try:
+            st = os.stat(path)
+            sig.append([os.path.basename(path), st.st_size, st.st_mtime_ns])
+        except FileNotFoundError:
+            pass
+    return sig
+
+
+def sent_packets(file_path, df_unique):
+    """
+    How many DATA packets the sender sent, best source first:
+    1. the client log ("ACK SUMMARY ... DATA SENT n" per device, or the load generator's "LOAD SUMMARY")
+    2. the matrix cell manifest (single device: messages / batch size)
+    3. the data: per device, highest seq over the seq step (batch size), tail losses can't be seen
+    """
+    client_log, cell_json = run_files(file_path)[1:]
+    if os.path.exists(client_log):
+        with open(client_log, errors="replace") as f:
+            text = f.read()
+        counts = [int(n) for n in re.findall(r"(?:ACK|LOAD) SUMMARY ::.*?DATA SENT (\d+)", text)]
+        if counts:
+            return sum(counts), "client_log"
+    if os.path.exists(cell_json):
+        with open(cell_json) as f:
+            cell = json.load(f)
+        if cell.get("devices") == 1 and cell.get("messages"):
+            return math.ceil(cell["messages"] / max(cell.get("batch_size", 1), 1)), "cell"
+    if df_unique.empty:
+        return 0, "data"
+    total = 0
+    for _, seqs in df_unique.groupby('device_id')['seq']:
+        seqs = np.unique(seqs.to_numpy())
+        steps = np.diff(seqs)
+        step = int(steps[steps > 0].min()) if len(steps) else 1
+        total += (int(seqs[-1]) - 1) // step + 1
+    return total, "data"
+
+
 def analyze_single_run(file_path):
     """Reads one sorted CSV and calculates all required metrics."""
     try:
-        df = pd.read_csv(file_path)
+        # corrected_delay_s (clock offset taken out) is only in logs of servers with clock_sync
+        df = pd.read_csv(file_path, usecols=lambda c: c in PACKET_COLUMNS, dtype=PACKET_COLUMNS)
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
         return None
 
     # --- 1. Total Counts ---
     total_received = len(df)
-    
+
     # Unique packets are those that are NOT duplicates (duplicate_flag == 0)
     df_unique = df[df['duplicate_flag'] == 0]
     total_unique_received = len(df_unique)
-    
+
     # Duplicates are those with duplicate_flag == 1
-    total_duplicates = df['duplicate_flag'].sum()
-    
+    total_duplicates = int(df['duplicate_flag'].sum())
+
     # Gaps are those with gap_flag == 1
-    total_gaps = df['gap_flag'].sum()
-    
+    total_gaps = int(df['gap_flag'].sum())
+
     # --- 2. Rate Calculations ---
+    if TOTAL_SENT_PACKETS:
+        total_sent, sent_source = TOTAL_SENT_PACKETS, "config"
+    else:
+        total_sent, sent_source = sent_packets(file_path, df_unique)
+
     # Loss Rate: Packets Sent - Unique Packets Received
-    total_lost = TOTAL_SENT_PACKETS - total_unique_received
-    loss_rate = (total_lost / TOTAL_SENT_PACKETS) * 100
-    
+    total_lost = max(total_sent - total_unique_received, 0)
+    loss_rate = (total_lost / total_sent) * 100 if total_sent else 0.0
+
     # Duplicate Rate: Duplicates Received / Total Packets Sent
-    duplicate_rate = (total_duplicates / TOTAL_SENT_PACKETS) * 100
-    
+    duplicate_rate = (total_duplicates / total_sent) * 100 if total_sent else 0.0
+
     # Gap Rate: Gaps Detected / Total Unique Packets Received (to account for packets that never arrived)
     # Note: If no packets arrived, total_unique_received is 0, so avoid division by zero
     gap_rate = (total_gaps / total_unique_received) * 100 if total_unique_received > 0 else 0.0
 
     # --- 3. Latency Metrics (using the 'network_delay_s' column) ---
+    delay = df_unique['network_delay_s']
     delay_stats = {
-        'min': df_unique['network_delay_s'].min() * 1000,   # convert to ms
-        'median': df_unique['network_delay_s'].median() * 1000, # convert to ms
-        'max': df_unique['network_delay_s'].max() * 1000    # convert to ms
+        'min': float(delay.min()) * 1000 if total_unique_received else float('nan'),   # convert to ms
+        'median': float(delay.median()) * 1000 if total_unique_received else float('nan'),
+        'max': float(delay.max()) * 1000 if total_unique_received else float('nan')
     }
-    
+
+    # Same with the clock offset corrected delay, where the server had an estimate
+    corrected = df_unique['corrected_delay_s'].dropna() if 'corrected_delay_s' in df_unique else delay.iloc[:0]
+    corrected_stats = {
+        'min': float(corrected.min()) * 1000 if len(corrected) else float('nan'),
+        'median': float(corrected.median()) * 1000 if len(corrected) else float('nan'),
+        'max': float(corrected.max()) * 1000 if len(corrected) else float('nan')
+    }
+
     return {
-        'total_sent': TOTAL_SENT_PACKETS,
-        'total_unique_recv': total_unique_received,
-        'total_lost': total_lost,
+        'total_sent': int(total_sent),
+        'sent_source': sent_source,
+        'total_received': int(total_received),
+        'total_unique_recv': int(total_unique_received),
+        'total_lost': int(total_lost),
         'total_duplicates': total_duplicates,
         'total_gaps': total_gaps,
         'loss_rate': loss_rate,
@@ -60,101 +143,183 @@ def analyze_single_run(file_path):
         'gap_rate': gap_rate,
         'delay_min_ms': delay_stats['min'],
         'delay_median_ms': delay_stats['median'],
-        'delay_max_ms': delay_stats['max']
+        'delay_max_ms': delay_stats['max'],
+        'corrected_delay_min_ms': corrected_stats['min'],
+        'corrected_delay_median_ms': corrected_stats['median'],
+        'corrected_delay_max_ms': corrected_stats['max']
     }
 
-def aggregate_and_print_results(all_results):
-    """Aggregates the results by scenario and prints a summary table."""
-    
-    scenario_metrics = defaultdict(lambda: defaultdict(list))
-    
-    for scenario, results in all_results.items():
-        for result in results:
-            if result:
-                for key, value in result.items():
-                    scenario_metrics[scenario][key].append(value)
-
-    # Prepare final summary table data
+
+def load_cache(path):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION:
+            return cache["runs"]
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    return {}
+
+
+def save_cache(path, runs):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": CACHE_VERSION, "runs": runs}, f)
+    os.replace(path + ".tmp", path)
+
+
+def collect_results(csv_files, jobs=None, use_cache=True):
+    """Per-run metrics for every file, from the cache where the files didn't change, the rest in a process pool."""
+    cache = load_cache(CACHE_FILE) if use_cache else {}
+    results = {}
+    todo = []
+    for file_path in csv_files:
+        sig = run_signature(file_path)
+        hit = cache.get(file_path)
+        if hit is not None and hit["sig"] == sig and not TOTAL_SENT_PACKETS:
+            results[file_path] = hit["result"]
+        else:
+            todo.append((file_path, sig))
+
+    print(f"{len(csv_files)} runs: {len(csv_files) - len(todo)} cached, {len(todo)} to analyze")
+    if todo:
+        paths = [p for p, _ in todo]
+        if jobs == 1 or len(todo) == 1:
+            fresh = map(analyze_single_run, paths)
+        else:
+            pool = ProcessPoolExecutor(max_workers=jobs)
+            fresh = pool.map(analyze_single_run, paths, chunksize=max(1, len(paths) // (4 * (jobs or os.cpu_count() or 1))))
+        for (file_path, sig), result in zip(todo, fresh):
+            print(f"Analyzing: {file_path}")
+            results[file_path] = result
+            # --sent overrides what the run itself says, that isn't the run's result
+            if result is not None and not TOTAL_SENT_PACKETS:
+                cache[file_path] = {"sig": sig, "result": result}
+        if jobs != 1 and len(todo) > 1:
+            pool.shutdown()
+        if use_cache:
+            # forget runs that are gone
+            save_cache(CACHE_FILE, {p: c for p, c in cache.items() if os.path.exists(p)})
+    return results
+
+
+def run_group(file_path):
+    """'raw_data/loss/loss_b4_d20_run3_packets_log.csv' -> 'loss_b4_d20', old runs ('loss_run3') -> 'loss'"""
+    label = os.path.basename(file_path)[:-len("_packets_log.csv")]
+    return re.sub(r"_run\d+$", "", label)
+
+
+def confidence_interval(values):
+    """Mean and half width of the 95% confidence interval (t distribution)."""
+    values = values.dropna()
+    n = len(values)
+    if n == 0:
+        return float('nan'), float('nan')
+    mean = values.mean()
+    if n == 1:
+        return mean, float('nan')
+    t = T95[n - 2] if n - 1 <= len(T95) else 1.96
+    return mean, t * values.std(ddof=1) / math.sqrt(n)
+
+
+def results_frame(results):
+    """All per-run results in one frame, scenario/group as categoricals."""
+    rows = []
+    for file_path, result in results.items():
+        if result:
+            rows.append(dict(result, file=file_path,
+                             scenario=os.path.basename(os.path.dirname(file_path)),
+                             group=run_group(file_path)))
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return df
+    scenarios = [s for s in SCENARIO_ORDER if s in set(df['scenario'])]
+    scenarios += sorted(set(df['scenario']) - set(scenarios))
+    df['scenario'] = pd.Categorical(df['scenario'], categories=scenarios)
+    df['group'] = pd.Categorical(df['group'], categories=sorted(set(df['group']),
+                                 key=lambda g: (scenarios.index(g.split('_')[0]) if g.split('_')[0] in scenarios else len(scenarios), g)))
+    df['sent_source'] = df['sent_source'].astype('category')
+    return df.sort_values(['scenario', 'group', 'file']).reset_index(drop=True)
+
+
+def aggregate_and_print_results(df):
+    """Aggregates the results by scenario (and matrix cell) and prints a summary table."""
     summary_data = []
-    
-    for scenario in ['baseline', 'loss', 'delay']:
-        metrics = scenario_metrics[scenario]
-        if not metrics:
-            summary_data.append({
-                'Scenario': scenario.upper(),
-                'Loss Rate (%)': 'N/A',
-                'Duplicate Rate (%)': 'N/A',
-                'Gap Rate (%)': 'N/A',
-                'Latency (min/median/max) (ms)': 'N/A'
-            })
-            continue
-
-        # Calculate averages for the rates
-        avg_loss = pd.Series(metrics['loss_rate']).median() # Using median of the runs
-        avg_dup = pd.Series(metrics['duplicate_rate']).median()
-        avg_gap = pd.Series(metrics['gap_rate']).median()
-
-        # Calculate min/median/max of the Latency (across all 5 runs combined)
-        # Note: Combining all 5 runs for a single min/median/max of latency is often preferred
-        # but here we use the median of the 5 median latencies as the central tendency for the report
-        median_latencies = metrics['delay_median_ms']
-        min_latencies = metrics['delay_min_ms']
-        max_latencies = metrics['delay_max_ms']
-        
-        final_min_lat = pd.Series(min_latencies).min()
-        final_median_lat = pd.Series(median_latencies).median()
-        final_max_lat = pd.Series(max_latencies).max()
+
+    for group, runs in df.groupby('group', observed=True):
+        # Median rates over the runs, plus mean +- 95% CI of the loss rate
+        loss_mean, loss_ci = confidence_interval(runs['loss_rate'])
+        gap_mean, gap_ci = confidence_interval(runs['gap_rate'])
+        lat_mean, lat_ci = confidence_interval(runs['delay_median_ms'])
+
+        # min of the min latencies, median of the medians and max of the maxes over the runs
+        final_min_lat = runs['delay_min_ms'].min()
+        final_median_lat = runs['delay_median_ms'].median()
+        final_max_lat = runs['delay_max_ms'].max()
 
         summary_data.append({
-            'Scenario': scenario.upper(),
-            'Loss Rate (%)': f"{avg_loss:.2f}",
-            'Duplicate Rate (%)': f"{avg_dup:.2f}",
-            'Gap Rate (%)': f"{avg_gap:.2f}",
-            'Latency (min/median/max) (ms)': f"{final_min_lat:.2f} / {final_median_lat:.2f} / {final_max_lat:.2f}"
+            'Scenario': str(group).upper(),
+            'Runs': len(runs),
+            'Loss Rate (%)': f"{runs['loss_rate'].median():.2f}",
+            'Loss Rate 95% CI (%)': f"{loss_mean:.2f} +- {loss_ci:.2f}",
+            'Duplicate Rate (%)': f"{runs['duplicate_rate'].median():.2f}",
+            'Gap Rate (%)': f"{runs['gap_rate'].median():.2f}",
+            'Gap Rate 95% CI (%)': f"{gap_mean:.2f} +- {gap_ci:.2f}",
+            'Latency (min/median/max) (ms)': f"{final_min_lat:.2f} / {final_median_lat:.2f} / {final_max_lat:.2f}",
+            'Median Latency 95% CI (ms)': f"{lat_mean:.2f} +- {lat_ci:.2f}",
         })
-        
+        # raw latency includes the client/server clock offset, the corrected one doesn't
+        if runs['corrected_delay_median_ms'].notna().any():
+            summary_data[-1]['Corrected Latency (min/median/max) (ms)'] = (
+                f"{runs['corrected_delay_min_ms'].min():.2f} / {runs['corrected_delay_median_ms'].median():.2f} / "
+                f"{runs['corrected_delay_max_ms'].max():.2f}")
+
     df_summary = pd.DataFrame(summary_data)
-    
+
     print("\n" + "="*80)
-    print("FINAL EXPERIMENT SUMMARY (Median Rates, Min/Median/Max Latency)")
+    print("FINAL EXPERIMENT SUMMARY (Median Rates, Mean +- 95% CI, Min/Median/Max Latency)")
     print("="*80)
     print(df_summary.to_string(index=False))
     print("="*80)
-    print(f"\nDetailed per-run CSV saved to final_analysis_summary.csv")
     df_summary.to_csv("final_analysis_summary.csv", index=False)
+    df.to_csv("final_analysis_runs.csv", index=False)
+    print(f"\nSummary saved to final_analysis_summary.csv, per-run metrics to final_analysis_runs.csv")
 
 
-def main():
+def main(jobs=None, use_cache=True):
     """Main function to find files and run analysis."""
     print("Starting network experiment data analysis...")
-    
+
     # Search for CSVs in the raw_data directory and its subdirectories
-    search_pattern = "raw_data/**/*_packets_log.csv"
-    csv_files = glob.glob(search_pattern, recursive=True)
-    
+    search_pattern = f"{RAW_DATA_DIR}/**/*_packets_log.csv"
+    csv_files = sorted(glob.glob(search_pattern, recursive=True))
+
     if not csv_files:
-        print("Error: No CSV files found matching the pattern 'raw_data/**/*_packets_log.csv'.")
+        print(f"Error: No CSV files found matching the pattern '{search_pattern}'.")
         print("Please ensure your 'raw_data' directory and files are correctly named.")
         return
 
-    all_results = defaultdict(list)
+    results = collect_results(csv_files, jobs, use_cache)
+    df = results_frame(results)
+    if df.empty:
+        print("Error: none of the runs could be analyzed.")
+        return
 
-    for file_path in sorted(csv_files):
-        # Extract scenario name from the file path (e.g., 'raw_data/baseline/...')
-        scenario = os.path.basename(os.path.dirname(file_path))
-        print(f"Analyzing: {file_path}")
-        
-        result = analyze_single_run(file_path)
-        all_results[scenario].append(result)
-        
     # Aggregate and print the final results
-    aggregate_and_print_results(all_results)
-    
+    aggregate_and_print_results(df)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze the raw_data/ experiment runs")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--no-cache", action="store_true", help="re-analyze every run, ignore and don't write the cache")
+    parser.add_argument("--sent", type=int, default=None,
+                        help="override the sent packet count of every run (default: from the client log/manifest/data)")
+    args = parser.parse_args()
+    TOTAL_SENT_PACKETS = args.sent
     try:
-        main()
+        main(args.jobs, not args.no_cache)
     except ImportError:
         print("\nCRITICAL ERROR: pandas library not found.")
         print("Please install it on your Linux VM to run the analysis: 'pip install pandas' or 'pip3 install pandas'")
     except Exception as e:
-        print(f"\nAn unexpected error occurred: {e}")
\ No newline at end of file
+        print(f"\nAn unexpected error occurred: {e}")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Adaptive batching for the client.
+#
+# Readings are collected as the sensor produces them and a DATA packet goes out
+# when the batch hits the target count, when it would no longer fit the byte
+# budget (path MTU minus IP/UDP/ITP headers), or when the oldest reading has
+# waited max_delay. The ids stay contiguous: a batch is always readings
+# first_id .. first_id+n-1 and the next one starts at first_id+n, which is what
+# the server's batch gap check and seq arithmetic expect.
+#
+# The target count adapts from the client's SendWindow:
+#   - loss (timeouts, or later packets ACKed before this one) -> halve it
+#   - ACK RTT well above the lowest seen (queue building)    -> shrink by a quarter
+#     (at least QUEUE_DELAY above it, sub-ms jitter on a LAN is not a queue)
+#   - otherwise every round of ACKs                           -> grow by one
+
+from payload_codec import CODEC_JSON, encode_batch
+
+PATH_MTU = 1500
+IP_UDP_OVERHEAD = 28
+ITP_HDR_LEN = 13
+RTT_INFLATION = 2.0
+QUEUE_DELAY = 0.005
+MAX_PACKED_COUNT = 0xFFFF   # count is a !H in the packed codecs
+
+
+def max_payload(mtu=PATH_MTU):
+    return mtu - IP_UDP_OVERHEAD - ITP_HDR_LEN
+
+
+def reading_cost(codec, unit="C"):
+    # (fixed bytes, bytes per reading) of a batch, json is sized for big ids/values
+    one = len(encode_batch(codec, 10 ** 8, [-1234.56], unit))
+    two = len(encode_batch(codec, 10 ** 8, [-1234.56, -1234.56], unit))
+    return one - (two - one), two - one
+
+
+def max_batch(codec, unit="C", max_bytes=None, min_batch=1):
+    # most readings a DATA payload of max_bytes can hold
+    base, per = reading_cost(codec, unit)
+    budget = max_bytes if max_bytes is not None else max_payload()
+    return max(min_batch, min(MAX_PACKED_COUNT, (budget - base) // per))
+
+
+class AdaptiveBatcher:
+    def __init__(self, codec=CODEC_JSON, unit="C", max_bytes=None, max_delay=0.5, start=8, min_batch=1):
+        self.codec = codec
+        self.unit = unit
+        self.max_delay = max_delay
+        self.min_batch = min_batch
+        self.max_count = max_batch(codec, unit, max_bytes, min_batch)
+        self.target = max(min_batch, min(start, self.max_count))
+        self.values = []
+        self.first_time = None
+        self.min_rtt = None
+        self._acked = 0
+        self._loss = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, t):
+        if not self.values:
+            self.first_time = t
+        self.values.append(value)
+
+    def ready(self, now):
+        n = len(self.values)
+        return n >= self.target or (n > 0 and now - self.first_time >= self.max_delay)
+
+    def deadline(self):
+        return self.first_time + self.max_delay if self.values else None
+
+    def take(self):
+        values, self.values = self.values, []
+        self.first_time = None
+        return values
+
+    def adapt(self, window):
+        # called after ACKs were read, looks at what changed in the window's stats
+        st = window.stats
+        acked = st["acked"] - self._acked
+        loss = st["loss_hints"] - self._loss
+        self._acked = st["acked"]
+        self._loss = st["loss_hints"]
+        if loss:
+            self.target = max(self.min_batch, self.target // 2)
+            return
+        if not acked:
+            return
+        srtt = window.rto.srtt
+        if srtt is not None:
+            if self.min_rtt is None or srtt < self.min_rtt:
+                self.min_rtt = srtt
+            if srtt > RTT_INFLATION * self.min_rtt and srtt - self.min_rtt > QUEUE_DELAY:
+                self.target = max(self.min_batch, self.target - max(1, self.target // 4))
+                return
+        self.target = min(self.max_count, self.target + 1)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# NTP-style client/server clock offset estimate, so the one-way delay of DATA
+# (server arrival - client timestamp) isn't mostly clock skew.
+#
+# The INIT and HEARTBEAT exchanges give the four NTP timestamps:
+#   t1 client sends (INIT/HEARTBEAT header ts)     t2 server receives
+#   t3 server sends (ACK header ts)                t4 client receives the ACK
+# The server echoes (t1, t2) with the ACK (CLOCK_ECHO payload on heartbeat
+# ACKs, "clock": [t1, t2] in the INIT ACK json), the client sends the finished
+# (t1, t2, t3, t4) in the payload of its next HEARTBEAT (CLOCK_SAMPLE) and the
+# server's per-session ClockEstimator turns them into
+#   offset = ((t2 - t1) + (t3 - t4)) / 2    server clock - client clock
+#   delay  = (t4 - t1) - (t3 - t2)          round trip without the server's turnaround
+# A sample is off by at most delay/2 (all of it queueing in one direction), so
+# like NTP's clock filter the offset is taken from the lowest-delay sample of
+# the last FILTER_SAMPLES, and drift (ppm, the clocks running at different
+# rates) is a least squares fit of offset over time of the recent samples whose
+# delay isn't much above the lowest. Between samples the offset is projected
+# along the drift. One exchange can be off by half its round trip (on loopback
+# a late read of the ACK is ~1 ms against a ~0.05 ms real delay), so no offset
+# is given out before the filter had MIN_SAMPLES to pick from. Clients send
+# their first heartbeats STARTUP_INTERVAL apart to get there quickly, and an
+# offset smaller than its error is taken as 0. Old peers just don't
+# send/understand the payloads.
+
+import struct
+from collections import deque
+
+CLOCK_ECHO = struct.Struct("!d d")        # t1, t2 (heartbeat ACK payload)
+CLOCK_SAMPLE = struct.Struct("!d d d d")  # t1, t2, t3, t4 (HEARTBEAT payload)
+
+FILTER_SAMPLES = 8
+MIN_SAMPLES = 4
+STARTUP_INTERVAL = 0.05
+HISTORY = 32
+# samples with a delay above min delay * DELAY_FACTOR + DELAY_MARGIN are
+# queueing outliers and are left out of the drift fit
+DELAY_FACTOR = 2.0
+DELAY_MARGIN = 0.002
+# drift needs a few samples over some time, and is clamped like NTP's 500 ppm
+MIN_DRIFT_SAMPLES = 3
+MIN_DRIFT_SPAN = 10.0
+MAX_DRIFT = 500e-6
+
+
+def ntp_sample(t1, t2, t3, t4):
+    # (offset, round trip delay) of one exchange
+    return ((t2 - t1) + (t3 - t4)) / 2, max(0.0, (t4 - t1) - (t3 - t2))
+
+
+def heartbeat_interval(samples_sent, interval):
+    # client side: quick heartbeats until the server has enough samples
+    return STARTUP_INTERVAL if samples_sent < MIN_SAMPLES else interval
+
+
+class ClockEstimator:
+    __slots__ = ("history", "offset", "drift", "ref_time", "error", "count", "rejected")
+
+    def __init__(self):
+        self.history = deque(maxlen=HISTORY)   # (t2, offset, delay)
+        self.offset = None
+        self.drift = 0.0
+        self.ref_time = 0.0
+        self.error = None
+        self.count = 0
+        self.rejected = 0
+
+    def add(self, t1, t2, t3, t4):
+        offset, delay = ntp_sample(t1, t2, t3, t4)
+        if not t1 <= t4 or not t2 <= t3:
+            # garbage or replayed timestamps
+            self.rejected += 1
+            return False
+        if self.history and self.history[-1][0] == t2:
+            # the same sample again, its heartbeat ACK got lost
+            return False
+        self.count += 1
+        self.history.append((t2, offset, delay))
+
+        # clock filter: lowest delay of the last few samples
+        recent = list(self.history)[-FILTER_SAMPLES:]
+        t_best, off_best, d_best = min(recent, key=lambda s: s[2])
+
+        # drift: offset vs time over the good samples
+        limit = min(s[2] for s in self.history) * DELAY_FACTOR + DELAY_MARGIN
+        good = [s for s in self.history if s[2] <= limit]
+        if len(good) >= MIN_DRIFT_SAMPLES and good[-1][0] - good[0][0] >= MIN_DRIFT_SPAN:
+            n = len(good)
+            mt = sum(s[0] for s in good) / n
+            mo = sum(s[1] for s in good) / n
+            var = sum((s[0] - mt) ** 2 for s in good)
+            if var > 0:
+                slope = sum((s[0] - mt) * (s[1] - mo) for s in good) / var
+                self.drift = max(-MAX_DRIFT, min(MAX_DRIFT, slope))
+
+        # an offset inside its own error bound is noise (clocks already in sync,
+        # loopback), correcting by it would only add that noise to every delay
+        self.offset = off_best if abs(off_best) > d_best / 2 else 0.0
+        self.ref_time = t_best
+        self.error = d_best / 2
+        return True
+
+    def at(self, t):
+        # server - client offset at server time t, None until MIN_SAMPLES
+        if self.count < MIN_SAMPLES:
+            return None
+        return self.offset + self.drift * (t - self.ref_time)
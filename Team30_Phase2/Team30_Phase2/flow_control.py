@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Server-driven backpressure.
+#
+# Every DATA ACK (and cumulative SACK) ends with one load byte, 0..100:
+#   MSG_ACK    header | load
+#   MSG_SACK   header | bitmap | load
+# The INIT ACK's json has it as "load". A server that doesn't send it is never
+# slowed down for, and clients that don't know about it ignore the extra byte.
+#
+# Server side, LoadGauge: the load is the larger of
+#   busy    share of the wall time the handlers spent handling datagrams
+#   queue   how full the receive queue was when it was drained (socket batch
+#           of RECV_BATCH, or the processor's backlog in the ring)
+# both smoothed with a half life of HALF_LIFE seconds. A device whose DATA is
+# being shed by admission control gets FLOW_SHED in its next ACK instead.
+#
+# Client side, RateControl: AIMD on the DATA packet rate, capped at the rate
+# the client was configured for.
+#   load >= FLOW_HIGH   halve the rate, then ignore high loads for DECREASE_HOLD
+#                       (the gauge needs that long to show the effect)
+#   load <  FLOW_LOW    add INCREASE of the max rate per second
+#   in between          keep the rate
+# A slowed down client puts more readings in each packet so its readings/s
+# stays the same as long as they fit the MTU. The server's cost is mostly per
+# packet, so fewer, bigger packets is what actually takes load off it.
+
+import math, struct
+
+FLOW = struct.Struct("!B")
+FLOW_HIGH = 85
+FLOW_LOW = 60
+FLOW_SHED = 100
+HALF_LIFE = 0.25
+DECREASE = 0.5
+DECREASE_HOLD = 0.5
+INCREASE = 0.05
+MIN_RATE_DIV = 64     # never below max rate / this
+
+
+class LoadGauge:
+    # server side, one per process
+    def __init__(self, now=0.0, half_life=HALF_LIFE):
+        self.half_life = half_life
+        self.level = 0
+        self.busy = 0.0
+        self.queue = 0.0
+        self.peak_depth = 0.0   # fullest queue since the last update
+        self.last = now
+        self.last_busy = 0.0
+        self.stats = {"peak": 0, "marked": 0}
+
+    def depth(self, fill):
+        # engines report how full their queue was (0..1) every time they drain it
+        if fill > self.peak_depth:
+            self.peak_depth = fill
+
+    def update(self, now, busy_s):
+        # busy_s: the handlers' cumulative busy time
+        dt = now - self.last
+        if dt <= 0:
+            return self.level
+        a = 1.0 - 0.5 ** (dt / self.half_life)
+        self.busy += a * (min(1.0, (busy_s - self.last_busy) / dt) - self.busy)
+        self.queue += a * (min(1.0, self.peak_depth) - self.queue)
+        self.peak_depth = 0.0
+        self.last = now
+        self.last_busy = busy_s
+        self.level = int(100 * max(self.busy, self.queue) + 0.5)
+        if self.level > self.stats["peak"]:
+            self.stats["peak"] = self.level
+        return self.level
+
+
+class RateControl:
+    # client side, one per device
+    def __init__(self, max_rate, now=0.0):
+        self.max_rate = max_rate
+        self.min_rate = max_rate / MIN_RATE_DIV
+        self.rate = max_rate
+        self.next_send = now
+        self.last_ack = now
+        self.hold_until = 0.0
+        self.stats = {"acks": 0, "decreases": 0, "peak_load": 0}
+
+    def on_load(self, level, now):
+        self.stats["acks"] += 1
+        if level > self.stats["peak_load"]:
+            self.stats["peak_load"] = level
+        dt = now - self.last_ack
+        self.last_ack = now
+        if level >= FLOW_HIGH:
+            if now >= self.hold_until:
+                self.rate = max(self.min_rate, self.rate * DECREASE)
+                self.hold_until = now + DECREASE_HOLD
+                self.stats["decreases"] += 1
+        elif level < FLOW_LOW:
+            self.rate = min(self.max_rate, self.rate + INCREASE * self.max_rate * dt)
+
+    def interval(self):
+        return 1.0 / self.rate
+
+    def ready(self, now):
+        # a µs of slack for schedules that land exactly on next_send
+        return now + 1e-6 >= self.next_send
+
+    def sent(self, now):
+        self.next_send = now + 1.0 / self.rate
+
+    def batch_size(self, base, max_count):
+        # readings per packet that keep base * max_rate readings/s at the current rate
+        return max(base, min(max_count, math.ceil(base * self.max_rate / self.rate - 1e-9)))
+
+
+def ack_load(data, payload_len):
+    # the load byte after an ACK's payload_len bytes (header included), None if
+    # the datagram is some other size (old server, INIT/heartbeat ACK)
+    return data[payload_len] if len(data) == payload_len + FLOW.size else None
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+# UDP impairment proxy, replaces Clumsy/netem for the loss/delay scenarios.
+#
+#   client --> proxy (--listen, default 5006) --> server (--upstream, default 127.0.0.1:5005)
+#
+# Every client address gets its own upstream socket (like a NAT), so the
+# server still sees one address per client and can send the ACKs back through
+# us. Per direction (up = client->server, down = server->client) packets can be
+#   - lost: Bernoulli (--loss) or Gilbert-Elliott (--ge p_gb,p_bg --ge-loss good,bad)
+#   - delayed: --delay + uniform(-jitter, +jitter), jitter alone already reorders
+#   - reordered: --reorder fraction held --reorder-gap extra seconds
+#   - duplicated: --duplicate fraction sent twice (each copy has its own delay)
+#   - rate limited: --rate bytes/s link with a --queue bytes tail-drop queue
+# Packets wait in one timer heap ordered by release time, the loop sleeps on
+# epoll until the next release or the next packet, and drains the sockets in
+# batches like the server does.
+#
+# Ground truth: every packet that comes in (and every duplicate copy) gets one
+# record when it leaves the proxy, sent or dropped, with the ITP header fields,
+# its arrival/send time and what was done to it. Records are packed binary
+# while running and written out as CSV (--trace) on Ctrl+C.
+
+import socket, selectors, struct, time, heapq, random, argparse, csv, os
+
+HDR = struct.Struct("!B H H d")
+
+UP = 0
+DOWN = 1
+DIRECTIONS = {"up": (UP,), "down": (DOWN,), "both": (UP, DOWN)}
+
+# what happened to a packet
+SENT = 0
+LOST = 1            # random / Gilbert-Elliott loss
+QUEUE_DROP = 2      # rate limit queue full
+ACTION_NAMES = {SENT: "sent", LOST: "lost", QUEUE_DROP: "queue_drop"}
+# flags
+F_DUPLICATE = 1     # this record is the extra copy
+F_REORDERED = 2     # got the reorder extra delay
+F_BAD_STATE = 4     # Gilbert-Elliott was in the bad state
+
+# pkt_id, dir, first 5 bytes of the ITP header (type byte, device_id, seq, parsed
+# when the CSV is written), size, arrival, sent (0 if dropped), delay, action, flags
+TRACE = struct.Struct("<Q B 5s H d d d B B")
+HDR_HEAD = struct.Struct("!B H H")
+TRACE_FLUSH = 1 << 20
+
+RECV_BATCH = 256
+UPSTREAM_IDLE = 60.0
+MAX_WAIT = 0.5
+
+
+class Impairment:
+    # One direction's settings and its Gilbert-Elliott state
+    def __init__(self, loss=0.0, ge=None, ge_loss=(0.0, 1.0), delay=0.0, jitter=0.0,
+                 reorder=0.0, reorder_gap=0.01, duplicate=0.0, rate=0.0, queue=64 * 1024, rng=None):
+        self.loss = loss
+        self.ge = ge                  # (p good->bad, p bad->good) or None
+        self.ge_loss = ge_loss        # loss prob in (good, bad)
+        self.bad = False
+        self.delay = delay
+        self.jitter = jitter
+        self.reorder = reorder
+        self.reorder_gap = reorder_gap
+        self.duplicate = duplicate
+        self.rate = rate              # bytes/s, 0 = unlimited
+        self.queue = queue
+        self.link_free = 0.0          # when the rate limited link is idle again
+        self.rng = rng or random.Random()
+        self.lossy = loss > 0 or ge is not None
+
+    def lose(self):
+        # -> (lost, in bad state)
+        if not self.lossy:
+            return False, False
+        r = self.rng.random
+        if self.ge is not None:
+            if self.bad:
+                if r() < self.ge[1]:
+                    self.bad = False
+            elif r() < self.ge[0]:
+                self.bad = True
+            return r() < self.ge_loss[self.bad], self.bad
+        return self.loss > 0 and r() < self.loss, False
+
+    def schedule(self, now, size):
+        # -> (release time, flags) or None if the rate limit queue is full
+        flags = 0
+        d = self.delay
+        if self.jitter:
+            d += self.rng.uniform(-self.jitter, self.jitter)
+        if self.reorder and self.rng.random() < self.reorder:
+            d += self.reorder_gap
+            flags |= F_REORDERED
+        t = now + max(d, 0.0)
+        if self.rate:
+            start = max(now, self.link_free)
+            if (start - now) * self.rate > self.queue:
+                return None
+            self.link_free = start + size / self.rate
+            t += self.link_free - now
+        return t, flags
+
+
+class ImpairProxy:
+    def __init__(self, listen, upstream, up, down, trace_path=None):
+        self.upstream = upstream
+        self.imp = {UP: up, DOWN: down}
+        self.sel = selectors.DefaultSelector()
+        self.listen = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listen.bind(listen)
+        self.listen.setblocking(False)
+        self.sel.register(self.listen, selectors.EVENT_READ, None)
+        self.clients = {}      # client addr -> [upstream socket, last used]
+        self.heap = []         # (release, pkt_id, sock, data, addr, direction, arrival, flags)
+        self.next_id = 0
+        self.trace_path = trace_path
+        self.trace_bin = trace_path + ".bin" if trace_path else None
+        self.trace_buf = bytearray()
+        self.trace_file = open(self.trace_bin, "wb") if trace_path else None
+        self.stats = {d: {"in": 0, "sent": 0, "lost": 0, "queue_drop": 0, "duplicated": 0, "reordered": 0}
+                      for d in (UP, DOWN)}
+
+    def upstream_sock(self, addr, now):
+        entry = self.clients.get(addr)
+        if entry is None:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.setblocking(False)
+            s.connect(self.upstream)
+            self.sel.register(s, selectors.EVENT_READ, addr)
+            entry = self.clients[addr] = [s, now]
+        else:
+            entry[1] = now
+        return entry[0]
+
+    def record(self, pkt_id, direction, data, arrival, sent, delay, action, flags):
+        if self.trace_file is None:
+            return
+        # header fields are only parsed when the CSV gets written
+        self.trace_buf += TRACE.pack(pkt_id, direction, data[:5], min(len(data), 0xFFFF),
+                                     arrival, sent, delay, action, flags)
+        if len(self.trace_buf) >= TRACE_FLUSH:
+            self.trace_file.write(self.trace_buf)
+            self.trace_buf = bytearray()
+
+    def on_packet(self, direction, data, out_sock, out_addr, now):
+        imp = self.imp[direction]
+        st = self.stats[direction]
+        st["in"] += 1
+        copies = 2 if imp.duplicate and imp.rng.random() < imp.duplicate else 1
+        for copy in range(copies):
+            pkt_id = self.next_id
+            self.next_id += 1
+            flags = F_DUPLICATE if copy else 0
+            if copy:
+                st["duplicated"] += 1
+            lost, bad = imp.lose()
+            if bad:
+                flags |= F_BAD_STATE
+            if lost:
+                st["lost"] += 1
+                self.record(pkt_id, direction, data, now, 0.0, 0.0, LOST, flags)
+                continue
+            sched = imp.schedule(now, len(data))
+            if sched is None:
+                st["queue_drop"] += 1
+                self.record(pkt_id, direction, data, now, 0.0, 0.0, QUEUE_DROP, flags)
+                continue
+            release, sflags = sched
+            flags |= sflags
+            if sflags & F_REORDERED:
+                st["reordered"] += 1
+            if release <= now and (not self.heap or self.heap[0][0] > now):
+                # no delay and nothing due before it: skip the heap
+                self.send(out_sock, data, out_addr, direction, pkt_id, now, flags, now)
+            else:
+                heapq.heappush(self.heap, (release, pkt_id, out_sock, data, out_addr, direction, now, flags))
+
+    def send(self, sock, data, addr, direction, pkt_id, arrival, flags, now):
+        try:
+            if addr is None:
+                sock.send(data)
+            else:
+                sock.sendto(data, addr)
+        except OSError:
+            # e.g. ICMP unreachable from an earlier send, count it as a drop
+            self.stats[direction]["queue_drop"] += 1
+            self.record(pkt_id, direction, data, arrival, 0.0, 0.0, QUEUE_DROP, flags)
+            return
+        self.stats[direction]["sent"] += 1
+        self.record(pkt_id, direction, data, arrival, now, now - arrival, SENT, flags)
+
+    def release_due(self, now):
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            _, pkt_id, sock, data, addr, direction, arrival, flags = heapq.heappop(heap)
+            self.send(sock, data, addr, direction, pkt_id, arrival, flags, now)
+
+    def drain(self, sock, client_addr, now):
+        # client_addr None = the listen socket (packets going up)
+        for _ in range(RECV_BATCH):
+            try:
+                data, addr = sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # ICMP port unreachable from the server side, nothing to forward
+                continue
+            if client_addr is None:
+                self.on_packet(UP, data, self.upstream_sock(addr, now), None, now)
+            else:
+                self.on_packet(DOWN, data, self.listen, client_addr, now)
+
+    def expire_clients(self, now):
+        for addr in [a for a, e in self.clients.items() if now - e[1] > UPSTREAM_IDLE]:
+            s = self.clients.pop(addr)[0]
+            self.sel.unregister(s)
+            s.close()
+
+    def serve_forever(self):
+        next_expire = time.time() + UPSTREAM_IDLE
+        while True:
+            now = time.time()
+            timeout = MAX_WAIT if not self.heap else max(0.0, min(MAX_WAIT, self.heap[0][0] - now))
+            for key, _ in self.sel.select(timeout):
+                self.drain(key.fileobj, key.data, time.time())
+            now = time.time()
+            self.release_due(now)
+            if now >= next_expire:
+                self.expire_clients(now)
+                next_expire = now + UPSTREAM_IDLE
+
+    def close(self):
+        # whatever is still in the heap never made it out
+        for release, pkt_id, sock, data, addr, direction, arrival, flags in sorted(self.heap):
+            self.stats[direction]["queue_drop"] += 1
+            self.record(pkt_id, direction, data, arrival, 0.0, 0.0, QUEUE_DROP, flags)
+        self.heap = []
+        if self.trace_file is not None:
+            self.trace_file.write(self.trace_buf)
+            self.trace_file.close()
+            write_trace_csv(self.trace_bin, self.trace_path)
+            os.remove(self.trace_bin)
+        for s, _ in self.clients.values():
+            s.close()
+        self.listen.close()
+
+
+def write_trace_csv(bin_path, csv_path):
+    with open(bin_path, "rb") as f:
+        data = f.read()
+    rows = sorted(TRACE.iter_unpack(data))
+    with open(csv_path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["pkt_id", "direction", "msgtype", "device_id", "seq", "size", "arrival_time",
+                    "sent_time", "delay_s", "action", "duplicate", "reordered", "ge_bad"])
+        for pkt_id, d, head, size, arrival, sent, delay, action, flags in rows:
+            if size >= HDR.size:
+                hb, device_id, seq = HDR_HEAD.unpack(head)
+                msgtype = hb & 0xF
+            else:
+                msgtype, device_id, seq = "", "", ""
+            w.writerow([pkt_id, "up" if d == UP else "down", msgtype, device_id, seq, size, f"{arrival:.6f}",
+                        f"{sent:.6f}" if action == SENT else "", f"{delay:.6f}" if action == SENT else "",
+                        ACTION_NAMES[action], flags & F_DUPLICATE and 1, flags & F_REORDERED and 1,
+                        flags & F_BAD_STATE and 1])
+
+
+def parse_pair(text):
+    a, b = text.split(",")
+    return float(a), float(b)
+
+
+def parse_addr(text):
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UDP impairment proxy for the ITP experiments")
+    parser.add_argument("--listen", type=int, default=5006, help="port the clients send to (default 5006)")
+    parser.add_argument("--upstream", type=parse_addr, default=("127.0.0.1", 5005),
+                        help="server address (default 127.0.0.1:5005)")
+    parser.add_argument("--direction", choices=sorted(DIRECTIONS), default="up",
+                        help="which direction gets impaired (default up = client->server)")
+    parser.add_argument("--loss", type=float, default=0.0, help="Bernoulli loss probability")
+    parser.add_argument("--ge", type=parse_pair, default=None, metavar="P_GB,P_BG",
+                        help="Gilbert-Elliott loss: good->bad and bad->good transition probabilities")
+    parser.add_argument("--ge-loss", type=parse_pair, default=(0.0, 1.0), metavar="GOOD,BAD",
+                        help="Gilbert-Elliott loss probability in the good and bad state (default 0,1)")
+    parser.add_argument("--delay", type=float, default=0.0, help="fixed delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="delay varies uniformly by +- this many seconds")
+    parser.add_argument("--reorder", type=float, default=0.0, help="fraction of packets held back by --reorder-gap")
+    parser.add_argument("--reorder-gap", type=float, default=0.01, help="extra delay for reordered packets (default 0.01)")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="fraction of packets sent twice")
+    parser.add_argument("--rate", type=float, default=0.0, help="link rate in bytes/s (default unlimited)")
+    parser.add_argument("--queue", type=int, default=64 * 1024, help="rate limit queue in bytes (default 64K)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed, for reproducible runs")
+    parser.add_argument("--trace", default="impairment_trace.csv",
+                        help="ground truth CSV written on exit, '' to disable (default impairment_trace.csv)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    settings = dict(loss=args.loss, ge=args.ge, ge_loss=args.ge_loss, delay=args.delay, jitter=args.jitter,
+                    reorder=args.reorder, reorder_gap=args.reorder_gap, duplicate=args.duplicate,
+                    rate=args.rate, queue=args.queue, rng=rng)
+    impaired = DIRECTIONS[args.direction]
+    up = Impairment(**settings) if UP in impaired else Impairment(rng=rng)
+    down = Impairment(**settings) if DOWN in impaired else Impairment(rng=rng)
+
+    proxy = ImpairProxy(("0.0.0.0", args.listen), args.upstream, up, down, args.trace or None)
+    print(f"IMPAIR PROXY :: 0.0.0.0:{args.listen} -> {args.upstream[0]}:{args.upstream[1]} :: IMPAIRING {args.direction.upper()}")
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.close()
+        for d, name in ((UP, "UP"), (DOWN, "DOWN")):
+            st = proxy.stats[d]
+            print(f"{name} :: IN {st['in']} :: SENT {st['sent']} :: LOST {st['lost']} :: QUEUE DROP {st['queue_drop']} "
+                  f":: DUPLICATED {st['duplicated']} :: REORDERED {st['reordered']}")
+        if args.trace:
+            print(f"Ground truth written to {args.trace}")
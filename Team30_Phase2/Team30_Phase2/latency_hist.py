@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Log-bucketed (HDR-style) histograms for the server's live latency percentiles.
+#
+# Values are recorded in microseconds. Below 2^SUB_BITS every microsecond has its
+# own bucket, above that every power of two is split into 2^(SUB_BITS-1) linear
+# buckets, so a bucket is at most 1/64 (~1.6%) of its value wide whatever the
+# magnitude. Finding the bucket is a bit_length and a shift, O(1) per sample,
+# and only buckets that were hit are stored (a dict), so a histogram of a
+# device that sees 1-3 ms is a few hundred ints however many packets it gets.
+#
+# One-way delay can be negative (client and server clocks aren't synced), a
+# negative value goes to bucket -(index of |v|) - 1, so sorting the bucket
+# indexes still sorts the values.
+#
+# Histograms merge by adding the counts, the worker pool writes each worker's
+# as JSON (to_dict) and the parent adds them up (from_dict + merge).
+
+SUB_BITS = 7
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(us):
+    # us: non-negative int
+    if us < SUB_COUNT:
+        return us
+    shift = us.bit_length() - SUB_BITS
+    return SUB_COUNT + (shift - 1) * HALF_COUNT + (us >> shift) - HALF_COUNT
+
+
+def bucket_range(index):
+    # [low, high) in microseconds of a non-negative bucket
+    if index < SUB_COUNT:
+        return index, index + 1
+    shift = (index - SUB_COUNT) // HALF_COUNT + 1
+    top = (index - SUB_COUNT) % HALF_COUNT + HALF_COUNT
+    return top << shift, (top + 1) << shift
+
+
+def bucket_value(key):
+    # middle of the bucket in seconds, keys < 0 are the negative values
+    if key < 0:
+        low, high = bucket_range(-key - 1)
+        return -(low + high) / 2e6
+    low, high = bucket_range(key)
+    return (low + high) / 2e6
+
+
+class LogHistogram:
+    __slots__ = ("counts", "total", "min", "max", "sum")
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+
+    def __len__(self):
+        return self.total
+
+    def record(self, seconds):
+        us = int(seconds * 1e6)
+        key = bucket_index(us) if us >= 0 else -bucket_index(-us) - 1
+        counts = self.counts
+        counts[key] = counts.get(key, 0) + 1
+        self.total += 1
+        self.sum += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        counts = self.counts
+        for key, n in other.counts.items():
+            counts[key] = counts.get(key, 0) + n
+        if other.total:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.total += other.total
+        self.sum += other.sum
+        return self
+
+    def percentiles(self, ps=PERCENTILES):
+        # value (seconds) at each percentile in ps (ascending), one pass over the buckets.
+        # Exact min/max are kept, so the ends are exact and nothing is reported outside them.
+        if not self.total:
+            return [float("nan")] * len(ps)
+        out = []
+        keys = sorted(self.counts)
+        i = 0
+        seen = self.counts[keys[0]]
+        for p in ps:
+            rank = max(1, -(-p * self.total // 100))   # ceil, nearest rank
+            while seen < rank:
+                i += 1
+                seen += self.counts[keys[i]]
+            out.append(min(self.max, max(self.min, bucket_value(keys[i]))))
+        return out
+
+    def percentile(self, p):
+        return self.percentiles((p,))[0]
+
+    def mean(self):
+        return self.sum / self.total if self.total else float("nan")
+
+    def to_dict(self):
+        return {"counts": {str(k): n for k, n in self.counts.items()}, "total": self.total,
+                "min": self.min, "max": self.max, "sum": self.sum}
+
+    @classmethod
+    def from_dict(cls, d):
+        h = cls()
+        h.counts = {int(k): n for k, n in d["counts"].items()}
+        h.total = d["total"]
+        h.min = d["min"]
+        h.max = d["max"]
+        h.sum = d["sum"]
+        return h
+
+
+def format_ms(hist, ps=PERCENTILES):
+    # "p50 1.234 :: p90 ... :: max 9.876" in ms
+    parts = [f"p{p:g} {v * 1e3:.3f}" for p, v in zip(ps, hist.percentiles(ps))]
+    parts.append(f"max {hist.max * 1e3:.3f}" if hist.total else "max nan")
+    return " :: ".join(parts)
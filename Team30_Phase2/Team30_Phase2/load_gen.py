@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+# Load generator: many simulated devices from one machine.
+#
+# Every process runs an asyncio loop with ONE UDP socket shared by all of its
+# devices (the server keys sessions on device_id, so that's fine) and ACKs are
+# routed back to the device by the device_id in the header. Each device does
+# its own INIT handshake, has its own heartbeat timer and its own seq space.
+# The aggregate DATA rate is split evenly over the processes and the devices
+# take turns (round robin) on the process' send schedule:
+#   constant  fixed gap of 1/rate
+#   poisson   exponential gaps with mean 1/rate
+#   bursty    `burst` packets back to back, then a pause so the mean is still rate
+#
+# With backpressure every device runs its own RateControl (flow_control.py) on
+# the load byte of its ACKs, starting from its share of the rate. A device that
+# isn't due yet gives up its turn on the schedule, and packs the readings it
+# owes into its next, bigger, batch.
+#
+# At the end every process reports what it sent and the RTT of every ACKed DATA
+# packet, the parent merges that into achieved rate, RTT percentiles and ACK loss.
+#
+#   python3 udp_client.py --server 127.0.0.1 --devices 2000 --rate 5000 --pattern poisson
+
+import asyncio, heapq, json, multiprocessing, random, time
+
+import udp_client
+from udp_client import (pack_header, unpack_header, MSG_INIT, MSG_DATA, MSG_ACK, MSG_END, MSG_HEARTBEAT,
+                        HDR_LEN, HEARTBEAT_INTERVAL)
+from payload_codec import CODEC_JSON, encode_batch
+from ack_tracker import MSG_SACK, SACK_PAYLOAD, unwrap_seq, sack_covers
+from clock_sync import CLOCK_ECHO, CLOCK_SAMPLE, heartbeat_interval
+from msg_auth import KeyRing, ClientAuth
+from flow_control import RateControl, ack_load
+from batcher import max_batch
+
+PATTERNS = ("constant", "poisson", "bursty")
+
+INIT_TIMEOUT = 1.0
+INIT_RETRIES = 3
+# INITs are paced too, a few thousand at once would just overflow the socket buffers
+INIT_RATE = 2000.0
+DRAIN_TIME = 1.0
+
+
+class SimDevice:
+    __slots__ = ("device_id", "codec", "ready", "next_seq", "sent_at", "next_hb", "clock", "clock_new", "clock_sent",
+                 "auth", "flow")
+
+    def __init__(self, device_id, keys=None):
+        self.device_id = device_id
+        self.codec = CODEC_JSON
+        self.ready = False
+        self.next_seq = 1
+        self.sent_at = {}   # seq -> send time of DATA not acked yet
+        self.next_hb = 0.0
+        self.clock = b""    # clock offset sample for the next heartbeat (clock_sync.py)
+        self.clock_new = False
+        self.clock_sent = 0  # different samples sent, the first few go out quickly
+        self.auth = ClientAuth(keys, device_id) if keys is not None else None
+        self.flow = None    # RateControl in backpressure mode
+
+
+class LoadProtocol(asyncio.DatagramProtocol):
+    def __init__(self, gen):
+        self.gen = gen
+
+    def datagram_received(self, data, addr):
+        self.gen.on_datagram(data, time.time())
+
+    def error_received(self, exc):
+        # ICMP port unreachable etc., the missing ACKs show up as ACK loss
+        self.gen.stats["socket_errors"] += 1
+
+
+class LoadGen:
+    def __init__(self, device_ids, rate, pattern="constant", burst=10, codec=CODEC_JSON, batch_size=1, keys=None,
+                 backpressure=False):
+        self.devices = {d: SimDevice(d, keys) for d in device_ids}
+        self.rate = rate
+        self.pattern = pattern
+        self.burst = burst
+        self.codec = codec
+        self.batch_size = batch_size
+        self.backpressure = backpressure
+        self.transport = None
+        self.rtts = []
+        self.stats = {"devices": len(self.devices), "init_ok": 0, "init_fail": 0, "data_sent": 0,
+                      "data_acked": 0, "hb_sent": 0, "ack_packets": 0, "socket_errors": 0, "auth_fail": 0,
+                      "send_time": 0.0, "readings": 0, "paced": 0, "decreases": 0}
+
+    def send(self, packet, dev):
+        # authenticated mode: the INIT goes out tagged by handshake(), the rest with the session key
+        if dev.auth is not None and dev.ready:
+            packet = dev.auth.sign(packet)
+        self.transport.sendto(packet)
+
+    def on_datagram(self, data, now):
+        if len(data) < HDR_LEN:
+            return
+        v, t, did, seq_r, ts = unpack_header(data)
+        dev = self.devices.get(did)
+        if dev is None:
+            return
+        self.stats["ack_packets"] += 1
+        if dev.auth is not None:
+            data = dev.auth.check(data) if dev.ready else \
+                dev.auth.accept_init_ack(data, HDR_LEN, lambda b: json.loads(b.decode()))
+            if data is None:
+                self.stats["auth_fail"] += 1
+                return
+        if not dev.ready:
+            if t == MSG_ACK and seq_r == 0:
+                try:
+                    payload = json.loads(data[HDR_LEN:].decode()) if len(data) > HDR_LEN else {}
+                except ValueError:
+                    payload = {}
+                dev.codec = payload.get("codec", CODEC_JSON) if isinstance(payload, dict) else CODEC_JSON
+                echo = payload.get("clock") if isinstance(payload, dict) else None
+                if isinstance(echo, list) and len(echo) == 2:
+                    dev.clock = CLOCK_SAMPLE.pack(echo[0], echo[1], ts, now)
+                    dev.clock_new = True
+                dev.ready = True
+            return
+        if t == MSG_ACK and seq_r == 0 and len(data) >= HDR_LEN + CLOCK_ECHO.size:
+            t1, t2 = CLOCK_ECHO.unpack_from(data, HDR_LEN)
+            dev.clock = CLOCK_SAMPLE.pack(t1, t2, ts, now)
+            dev.clock_new = True
+        elif t == MSG_ACK:
+            # heartbeat ACKs (seq 0) don't match anything we sent
+            self._acked(dev, unwrap_seq(seq_r, dev.next_seq), now)
+            self._load(dev, ack_load(data, HDR_LEN), now)
+        elif t == MSG_SACK and len(data) >= HDR_LEN + SACK_PAYLOAD.size:
+            cum = unwrap_seq(seq_r, dev.next_seq)
+            bitmap = SACK_PAYLOAD.unpack_from(data, HDR_LEN)[0]
+            for s in [s for s in dev.sent_at if sack_covers(cum, bitmap, s)]:
+                self._acked(dev, s, now)
+            self._load(dev, ack_load(data, HDR_LEN + SACK_PAYLOAD.size), now)
+
+    def _load(self, dev, level, now):
+        if dev.flow is not None and level is not None:
+            dev.flow.on_load(level, now)
+
+    def _acked(self, dev, seq, now):
+        sent = dev.sent_at.pop(seq, None)
+        if sent is not None:
+            self.rtts.append(now - sent)
+            self.stats["data_acked"] += 1
+
+    def next_gap(self, i):
+        # seconds until the send after send number i
+        if self.pattern == "poisson":
+            return random.expovariate(self.rate)
+        if self.pattern == "bursty":
+            return self.burst / self.rate if i % self.burst == self.burst - 1 else 0.0
+        return 1.0 / self.rate
+
+    async def handshake(self):
+        for _ in range(INIT_RETRIES + 1):
+            pending = [d for d in self.devices.values() if not d.ready]
+            if not pending:
+                break
+            next_send = time.time()
+            for dev in pending:
+                delay = next_send - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_send += 1.0 / INIT_RATE
+                init_obj = {"proto": "AUDP-X", "version": 1, "info": "init", "codecs": [self.codec, CODEC_JSON]}
+                if dev.auth is not None:
+                    init_obj["auth"] = dev.auth.nonce.hex()
+                packet = pack_header(1, MSG_INIT, dev.device_id, 0, time.time()) + json.dumps(init_obj).encode()
+                self.send(dev.auth.sign_init(packet) if dev.auth is not None else packet, dev)
+            await asyncio.sleep(INIT_TIMEOUT)
+        ready = [d for d in self.devices.values() if d.ready]
+        self.stats["init_ok"] = len(ready)
+        self.stats["init_fail"] = len(self.devices) - len(ready)
+        return ready
+
+    async def run(self, duration):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: LoadProtocol(self), remote_addr=(udp_client.SERVER_IP, udp_client.SERVER_PORT))
+        try:
+            ready = await self.handshake()
+            if ready:
+                await self.send_loop(ready, duration)
+                await asyncio.sleep(DRAIN_TIME)
+            for dev in ready:
+                self.send(pack_header(1, MSG_END, dev.device_id, 0, time.time()), dev)
+        finally:
+            self.transport.close()
+        self.stats["data_lost"] = sum(len(d.sent_at) for d in self.devices.values())
+        return self.stats, self.rtts
+
+    async def send_loop(self, devices, duration):
+        # heartbeats staggered over the interval so they don't all go out at once
+        start = time.time()
+        for i, dev in enumerate(devices):
+            dev.next_hb = start + HEARTBEAT_INTERVAL * (i + 1) / len(devices)
+        # devices still gathering clock samples beat faster, so a heap and not a round robin
+        hb_queue = [(dev.next_hb, dev.device_id, dev) for dev in devices]
+        heapq.heapify(hb_queue)
+        if self.backpressure:
+            for dev in devices:
+                dev.flow = RateControl(self.rate / len(devices), start)
+            most = max_batch(self.codec)
+        rr = 0
+        i = 0
+        next_send = start
+        end = start + duration
+        values = [25.0] * self.batch_size
+        while True:
+            now = time.time()
+            if now >= end:
+                break
+            # catch up on everything due, asyncio.sleep can't do sub-ms gaps
+            while next_send <= now and next_send < end:
+                dev = devices[rr]
+                rr = (rr + 1) % len(devices)
+                slot = next_send
+                next_send += self.next_gap(i)
+                i += 1
+                flow = dev.flow
+                if flow is not None:
+                    # paced on the schedule's times, at full rate every turn is due
+                    if not flow.ready(slot):
+                        self.stats["paced"] += 1
+                        continue
+                    values = [25.0] * flow.batch_size(self.batch_size, most)
+                    flow.sent(slot)
+                seq = dev.next_seq
+                payload = encode_batch(dev.codec, seq, values, "C")
+                dev.sent_at[seq] = time.time()
+                self.send(pack_header(1, MSG_DATA, dev.device_id, seq, dev.sent_at[seq]) + payload, dev)
+                dev.next_seq += len(values)
+                self.stats["data_sent"] += 1
+                self.stats["readings"] += len(values)
+            while hb_queue[0][0] <= now:
+                dev = hb_queue[0][2]
+                self.send(pack_header(1, MSG_HEARTBEAT, dev.device_id, 0, now) + dev.clock, dev)
+                self.stats["hb_sent"] += 1
+                if dev.clock_new:
+                    dev.clock_sent += 1
+                    dev.clock_new = False
+                dev.next_hb += heartbeat_interval(dev.clock_sent, HEARTBEAT_INTERVAL) if dev.clock else HEARTBEAT_INTERVAL
+                heapq.heapreplace(hb_queue, (dev.next_hb, dev.device_id, dev))
+            await asyncio.sleep(max(0.0, min(next_send, hb_queue[0][0], end) - time.time()))
+        self.stats["send_time"] = time.time() - start
+        if self.backpressure:
+            self.stats["decreases"] = sum(d.flow.stats["decreases"] for d in devices)
+
+
+def run_process(args):
+    device_ids, rate, pattern, burst, codec, batch_size, duration, server_ip, server_port, auth_key_file, backpressure = args
+    udp_client.SERVER_IP = server_ip
+    udp_client.SERVER_PORT = server_port
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    keys = KeyRing.from_file(auth_key_file) if auth_key_file else None
+    gen = LoadGen(device_ids, rate, pattern, burst, codec, batch_size, keys, backpressure)
+    return asyncio.run(gen.run(duration))
+
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return float("nan")
+    return sorted_vals[min(len(sorted_vals) - 1, int(p / 100.0 * len(sorted_vals)))]
+
+
+def run_load(num_devices, rate, duration, pattern="constant", procs=1, first_device=1000, burst=10,
+             codec=CODEC_JSON, batch_size=1, server_ip=None, server_port=None, auth_key_file=None,
+             backpressure=False):
+    # server_ip/port are passed in because udp_client run as a script is
+    # __main__, not the udp_client module imported here
+    server_ip = server_ip or udp_client.SERVER_IP
+    server_port = server_port or udp_client.SERVER_PORT
+    if pattern not in PATTERNS:
+        raise ValueError(f"unknown send pattern {pattern!r}, expected one of {PATTERNS}")
+    if first_device + num_devices > 0x10000:
+        raise ValueError("device ids are 16 bits, first_device + devices must be <= 65536")
+    procs = max(1, min(procs, num_devices))
+    ids = list(range(first_device, first_device + num_devices))
+    jobs = [(ids[p::procs], rate / procs, pattern, burst, codec, batch_size, duration, server_ip, server_port,
+             auth_key_file, backpressure)
+            for p in range(procs)]
+    print(f"LOAD :: {num_devices} DEVICES :: {procs} PROCESSES :: {rate:.0f} MSG/S {pattern.upper()} :: "
+          f"{duration:.0f}s -> {server_ip}:{server_port}")
+    if procs == 1:
+        results = [run_process(jobs[0])]
+    else:
+        with multiprocessing.get_context("fork").Pool(procs) as pool:
+            results = pool.map(run_process, jobs)
+
+    total = {}
+    rtts = []
+    for stats, proc_rtts in results:
+        for k, v in stats.items():
+            total[k] = max(total.get(k, 0), v) if k == "send_time" else total.get(k, 0) + v
+        rtts.extend(proc_rtts)
+    rtts.sort()
+    sent = total["data_sent"]
+    send_time = total["send_time"] or float("nan")
+    ack_loss = 100.0 * total["data_lost"] / sent if sent else 0.0
+    print(f"LOAD SUMMARY :: INIT OK {total['init_ok']}/{total['devices']} :: DATA SENT {sent} :: "
+          f"ACHIEVED {sent / send_time:.1f} MSG/S (TARGET {rate:.1f}) :: HEARTBEATS {total['hb_sent']}")
+    print(f"ACK RTT ms :: p50 {percentile(rtts, 50) * 1e3:.3f} :: p90 {percentile(rtts, 90) * 1e3:.3f} :: "
+          f"p99 {percentile(rtts, 99) * 1e3:.3f} :: max {(rtts[-1] if rtts else float('nan')) * 1e3:.3f}")
+    print(f"ACK LOSS :: {total['data_lost']}/{sent} ({ack_loss:.2f}%) :: ACK PACKETS {total['ack_packets']}"
+          + (f" :: BAD AUTH TAGS {total['auth_fail']}" if total["auth_fail"] else ""))
+    if backpressure:
+        print(f"BACKPRESSURE :: READINGS {total['readings']} ({total['readings'] / send_time:.1f}/s) :: "
+              f"AVG BATCH {total['readings'] / max(sent, 1):.1f} :: TURNS PACED {total['paced']} :: DECREASES {total['decreases']}")
+    return total, rtts
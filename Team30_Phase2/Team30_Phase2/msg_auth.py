@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# Optional message authentication (udp_server.py / udp_client.py --auth-key-file).
+#
+# Server and devices share a master secret (a key file with the key in hex).
+# Every device has its own key derived from it, and every session its own key
+# derived from the device key and a nonce from each side:
+#   device key   = HMAC-SHA256(master, "itp-device" | device_id)
+#   session key  = HMAC-SHA256(device key, "itp-session" | client nonce | server nonce)
+# The INIT carries the client nonce ("auth" in its json) and is tagged with the
+# device key, the INIT ACK carries the server nonce and is tagged with the new
+# session key, everything after that in both directions is tagged with the
+# session key. A tag is the first TAG_LEN bytes of HMAC-SHA256 over the whole
+# datagram (header + payload), appended at the end.
+#
+# The server checks the tag right after unpacking the header, before any
+# payload decoding, and drops the datagram if it doesn't match. A new INIT
+# means new nonces, so packets of an old session can't be replayed into a new
+# one; within a session a replayed DATA is just a duplicate seq. The INIT
+# itself is only tagged with the long-lived device key, so the server also
+# wants it fresh: its header timestamp has to be newer than the device's last
+# accepted INIT and close to the server clock (udp_server.py --init-window),
+# and it can't take over a still active session from another address.
+#
+# HMAC-SHA256 is SHA-256(key ^ opad | SHA-256(key ^ ipad | message)). The
+# padded key blocks only depend on the key, so every session keeps the two
+# SHA-256 states that have already absorbed them and a tag is two copy() +
+# update() + digest(). That is what hmac.HMAC.copy() does too, minus its
+# wrapper object, and takes about 2/3 of its time. See `python3 msg_auth.py
+# bench` for the numbers against the alternatives.
+#
+#   python3 msg_auth.py genkey itp.key
+#   python3 msg_auth.py bench
+
+import os, hmac, hashlib, struct, time, argparse
+
+TAG_LEN = 8        # 64 bit tags, a forgery has to hit 1 in 2^64 per try
+NONCE_LEN = 16
+DIGEST = "sha256"
+BLOCK = 64         # SHA-256 block size
+IPAD = bytes(x ^ 0x36 for x in range(256))
+OPAD = bytes(x ^ 0x5C for x in range(256))
+
+
+def load_key(path):
+    with open(path) as f:
+        key = bytes.fromhex(f.read().strip())
+    if len(key) < 16:
+        raise ValueError(f"{path}: key is {len(key)} bytes, want at least 16")
+    return key
+
+
+def session_key(device_key, client_nonce, server_nonce):
+    return hmac.digest(device_key, b"itp-session" + client_nonce + server_nonce, DIGEST)
+
+
+class Authenticator:
+    # one key, HMAC-SHA256 with the key pads already hashed
+    __slots__ = ("key", "inner", "outer")
+
+    def __init__(self, key):
+        self.key = key
+        block = (hashlib.sha256(key).digest() if len(key) > BLOCK else key).ljust(BLOCK, b"\0")
+        self.inner = hashlib.sha256(block.translate(IPAD))
+        self.outer = hashlib.sha256(block.translate(OPAD))
+
+    def tag(self, data):
+        h = self.inner.copy()
+        h.update(data)
+        o = self.outer.copy()
+        o.update(h.digest())
+        return o.digest()[:TAG_LEN]
+
+    def sign(self, pkt):
+        return b"".join((pkt, self.tag(pkt)))
+
+    def check(self, pkt):
+        # pkt without its tag, None if it's too short or the tag is wrong
+        n = len(pkt) - TAG_LEN
+        if n <= 0:
+            return None
+        if not hmac.compare_digest(self.tag(pkt[:n]), pkt[n:]):
+            return None
+        return pkt[:n]
+
+
+class KeyRing:
+    # the master key and a cached Authenticator per device key
+    def __init__(self, master):
+        self.master = master
+        self.devices = {}
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_key(path))
+
+    def device(self, device_id):
+        auth = self.devices.get(device_id)
+        if auth is None:
+            key = hmac.digest(self.master, b"itp-device" + struct.pack("!H", device_id & 0xFFFF), DIGEST)
+            auth = self.devices[device_id] = Authenticator(key)
+        return auth
+
+    def new_session(self, device_id, client_nonce):
+        # server side: -> (server nonce, session Authenticator)
+        server_nonce = os.urandom(NONCE_LEN)
+        return server_nonce, Authenticator(session_key(self.device(device_id).key, client_nonce, server_nonce))
+
+
+class ClientAuth:
+    # client side of one device's session
+    def __init__(self, keys, device_id):
+        self.device = keys.device(device_id)
+        self.nonce = os.urandom(NONCE_LEN)
+        self.session = None
+
+    def sign_init(self, pkt):
+        return self.device.sign(pkt)
+
+    def accept_init_ack(self, data, hdr_len, parse):
+        # the server nonce is in the ACK's json, only with it the tag can be
+        # checked. parse(payload) -> the json object. Returns data without the
+        # tag (and keeps the session key), None if it's not from the server.
+        try:
+            server_nonce = bytes.fromhex(parse(data[hdr_len:len(data) - TAG_LEN])["auth"])
+        except (ValueError, TypeError, KeyError):
+            return None
+        auth = Authenticator(session_key(self.device.key, self.nonce, server_nonce))
+        data = auth.check(data)
+        if data is not None:
+            self.session = auth
+        return data
+
+    def sign(self, pkt):
+        return self.session.sign(pkt)
+
+    def check(self, data):
+        return self.session.check(data) if self.session is not None else None
+
+
+def bench(packets, sizes, rates):
+    # per datagram cost of checking a tag, the ways it could be done
+    key = os.urandom(32)
+    auth = Authenticator(key)
+    cached_hmac = hmac.new(key, digestmod=DIGEST)
+    print(f"TAG CHECK us/packet (HMAC-SHA256, {TAG_LEN} byte tag, {packets} packets)")
+    for size in sizes:
+        pkts = [auth.sign(os.urandom(size - TAG_LEN)) for _ in range(256)]
+        views = [memoryview(p) for p in pkts]
+
+        def cached():
+            for i in range(packets):
+                auth.check(views[i & 255])
+
+        def hmac_copy():
+            for i in range(packets):
+                p = views[i & 255]
+                n = len(p) - TAG_LEN
+                h = cached_hmac.copy()
+                h.update(p[:n])
+                hmac.compare_digest(h.digest()[:TAG_LEN], p[n:])
+
+        def new_hmac():
+            for i in range(packets):
+                p = views[i & 255]
+                n = len(p) - TAG_LEN
+                hmac.compare_digest(hmac.new(key, p[:n], DIGEST).digest()[:TAG_LEN], p[n:])
+
+        def one_shot():
+            for i in range(packets):
+                p = views[i & 255]
+                n = len(p) - TAG_LEN
+                hmac.compare_digest(hmac.digest(key, p[:n], DIGEST)[:TAG_LEN], p[n:])
+
+        results = []
+        for name, fn in (("cached pads", cached), ("cached hmac.copy", hmac_copy), ("hmac.new", new_hmac),
+                         ("hmac.digest", one_shot)):
+            t0 = time.perf_counter()
+            fn()
+            results.append((name, (time.perf_counter() - t0) / packets * 1e6))
+        print(f"  {size:5d} B :: " + " :: ".join(f"{name} {us:.2f}" for name, us in results))
+        us = results[0][1]
+        print("          CPU share of one core at " +
+              " :: ".join(f"{r:.0f} pkt/s {us * r / 1e4:.1f}%" for r in rates))
+
+
+def bench_server(packets, rounds=3):
+    # the server's whole per DATA packet path (tag check on the DATA, tag on the
+    # ACK), with and without auth. Rounds alternate, the best of each counts.
+    import tempfile, json, udp_server as srv
+    from server_log import ERROR
+    from payload_codec import encode_batch
+    srv.LOG_LEVEL = ERROR
+    srv.REORDER_BUFFER_SECONDS = 0
+    srv.TS_RETENTION = 0
+    keys = KeyRing(os.urandom(32))
+    send = lambda pkt, addr: None
+    srv.start_process_state(tempfile.mkdtemp(prefix="auth_bench"), "bench")
+    best = {"off": float("inf"), "on": float("inf")}
+    try:
+        for r in range(rounds):
+            for mode in ("off", "on"):
+                srv.KEYS = keys if mode == "on" else None
+                device_id = 100 + 2 * r + (mode == "on")
+                addr = ("127.0.0.1", 40000 + device_id)
+                client = ClientAuth(keys, device_id)
+                init = srv.HDR.pack(0x10, device_id, 0, time.time()) + json.dumps({"auth": client.nonce.hex()}).encode()
+                reply = []
+                srv.handle_datagram(lambda pkt, a: reply.append(bytes(pkt)), client.sign_init(init) if srv.KEYS else init,
+                                    addr, time.time())
+                if srv.KEYS and client.accept_init_ack(reply[0], srv.HDR_LEN, lambda b: json.loads(b.decode())) is None:
+                    raise RuntimeError("INIT ACK tag did not check out")
+                pkts = []
+                for seq in range(1, packets + 1):
+                    pkt = srv.HDR.pack(0x11, device_id, seq & 0xFFFF, time.time()) + encode_batch("json", seq, [21.5])
+                    pkts.append(client.sign(pkt) if srv.KEYS else pkt)
+                t0 = time.perf_counter()
+                for pkt in pkts:
+                    srv.handle_datagram(send, pkt, addr, time.time())
+                best[mode] = min(best[mode], (time.perf_counter() - t0) / packets * 1e6)
+                srv.close_session(device_id, "bench", time.time())
+    finally:
+        srv.KEYS = None
+        srv.stop_process_state()
+    off, on = best["off"], best["on"]
+    print(f"SERVER DATA PATH us/packet (json, 1 reading, best of {rounds}) :: AUTH OFF {off:.2f} :: AUTH ON {on:.2f} :: "
+          f"+{(on / off - 1) * 100:.1f}% :: MAX RATE {1e6 / off:.0f} -> {1e6 / on:.0f} pkt/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ITP message authentication keys and benchmark")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    gen = sub.add_parser("genkey", help="write a new random master key")
+    gen.add_argument("path")
+    gen.add_argument("--bytes", type=int, default=32)
+    b = sub.add_parser("bench", help="tag check cost per packet")
+    b.add_argument("--packets", type=int, default=100000)
+    b.add_argument("--sizes", type=int, nargs="+", default=[64, 200, 1400], help="datagram sizes incl. the tag")
+    b.add_argument("--rates", type=float, nargs="+", default=[1000, 5000, 20000], help="packet rates to show the CPU share at")
+    b.add_argument("--no-server", action="store_true", help="skip the udp_server.py DATA path comparison")
+    args = parser.parse_args()
+    if args.cmd == "genkey":
+        fd = os.open(args.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(os.urandom(args.bytes).hex() + "\n")
+        print(f"wrote a {args.bytes} byte key to {args.path}")
+    else:
+        bench(args.packets, args.sizes, args.rates)
+        if not args.no_server:
+            bench_server(args.packets)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# Streaming packet log for the server.
+#
+# The server hands every row to a PacketLogWriter. A background thread collects
+# the rows and every CHUNK_ROWS rows (or FLUSH_INTERVAL seconds, whichever is
+# first) sorts them by client timestamp and writes them as one fixed-size
+# binary chunk file. Timestamps stay floats, nothing gets strftime'd on the hot
+# path. If the server is SIGKILLed we lose at most the last unflushed chunk.
+#
+# At shutdown (or offline, after a crash) merge_chunk_dir() does a k-way merge
+# of the sorted chunks into the same sorted CSV the old pandas step produced:
+#   python3 packet_log.py packet_log_chunks/server1234 packets_log_sorted_by_timestamp.csv
+
+import os, sys, glob, struct, heapq, threading, queue, datetime, csv, time
+
+PACKET_LOG_DIR = "packet_log_chunks"
+
+CHUNK_ROWS = 4096
+FLUSH_INTERVAL = 0.5
+
+# device_id, seq, timestamp, arrival_time, duplicate_flag, gap_flag, payload_len,
+# clock_offset (server - client, NaN until the client sent a clock sample)
+ROW = struct.Struct("<I q d d B B I d")
+
+CSV_COLUMNS = ['device_id', 'seq', 'timestamp', 'arrival_time', 'duplicate_flag', 'gap_flag', 'payload_len', 'network_delay_s',
+               'corrected_delay_s']
+TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# rows read per file access while merging
+READ_ROWS = 1024
+
+
+def run_chunk_dir(server_pid):
+    return os.path.join(PACKET_LOG_DIR, f"server{server_pid}")
+
+
+class PacketLogWriter:
+    def __init__(self, chunk_dir, prefix="w0"):
+        self.chunk_dir = chunk_dir
+        self.prefix = prefix
+        self.chunks_written = 0
+        self.rows_written = 0
+        os.makedirs(chunk_dir, exist_ok=True)
+        self._q = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="packet-log-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, row):
+        self._q.put(row)
+
+    def close(self):
+        self._q.put(None)
+        self._thread.join()
+
+    def _run(self):
+        buf = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                row = self._q.get(timeout=timeout)
+            except queue.Empty:
+                self._flush(buf)
+                buf = []
+                deadline = None
+                continue
+            if row is None:
+                self._flush(buf)
+                return
+            if not buf:
+                deadline = time.monotonic() + FLUSH_INTERVAL
+            buf.append(row)
+            if len(buf) >= CHUNK_ROWS:
+                self._flush(buf)
+                buf = []
+                deadline = None
+
+    def _flush(self, rows):
+        if not rows:
+            return
+        rows.sort(key=lambda r: r[2])
+        data = b"".join([ROW.pack(*r) for r in rows])
+        path = os.path.join(self.chunk_dir, f"{self.prefix}-{self.chunks_written:06d}.bin")
+        # write + rename so a half written chunk is never picked up by the merge
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+        self.chunks_written += 1
+        self.rows_written += len(rows)
+
+
+def iter_chunk(path):
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(ROW.size * READ_ROWS)
+            if not data:
+                return
+            usable = len(data) - len(data) % ROW.size
+            yield from ROW.iter_unpack(data[:usable])
+
+
+def get_detailed_ts(t):
+    return datetime.datetime.fromtimestamp(t).strftime(TS_FORMAT)
+
+
+def merge_chunk_dir(chunk_dir, out_path, remove=True):
+    # k-way merge of the sorted chunks -> one CSV sorted by client timestamp.
+    # Returns the number of rows written.
+    paths = sorted(glob.glob(os.path.join(chunk_dir, "*.bin")))
+    if not paths:
+        return 0
+
+    count = 0
+    merged = heapq.merge(*[iter_chunk(p) for p in paths], key=lambda r: r[2])
+    with open(out_path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_COLUMNS)
+        for device_id, seq, ts, arrival, dup, gap, plen, offset in merged:
+            # network_delay_s is raw (includes the clock offset), corrected_delay_s has it taken out
+            w.writerow([device_id, seq, get_detailed_ts(ts), get_detailed_ts(arrival),
+                        dup, gap, plen, round(arrival - ts, 6),
+                        round(arrival - ts - offset, 6) if offset == offset else ""])
+            count += 1
+
+    if remove:
+        for p in paths:
+            os.remove(p)
+        try:
+            os.rmdir(chunk_dir)
+        except OSError:
+            pass
+    return count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python3 packet_log.py <chunk_dir> <out.csv>")
+        sys.exit(1)
+    n = merge_chunk_dir(sys.argv[1], sys.argv[2], remove=False)
+    print(f"Merged {n} rows into {sys.argv[2]}")
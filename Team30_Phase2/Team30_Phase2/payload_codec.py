@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# DATA payload codecs, shared by udp_client.py and udp_server.py.
+#
+# "json"   : the original {"batch": [{"reading_id":.., "value":.., "unit":"C"}, ...]}
+# "f32"    : packed binary, float32 values
+# "f16"    : packed binary, float16 values (half the bytes, ~3 significant digits)
+#
+# Packed layout (after the 13 byte ITP header):
+#   !I  base reading_id   (readings are always base, base+1, ..., base+count-1)
+#   !H  count
+#   !B  unit code         (see UNIT_CODES)
+#   !B  value type        (VT_F32 / VT_F16)
+#   count values, little-endian, so they load straight into an array on x86/arm
+#
+# The client asks for a codec in the INIT payload ("codecs": [...] in order of
+# preference) and the server answers with the one it picked in the INIT ACK
+# payload ("codec": ...). Anything that doesn't ask gets "json".
+#
+# Compressed DATA ("zdelta") is separate from the codec: a DATA packet with
+# FLAG_COMPRESSED set in the header byte (top bit of the version nibble) carries
+#   !I  first reading_id  !H count  !B unit code  !B decimals (| ZDELTA_STORED)
+# followed by a raw deflate stream (preset dictionary ZDICT), or the plain bytes
+# when ZDELTA_STORED is set because deflate didn't make them smaller, of
+#   count zigzag varints: reading_id deltas (first one relative to first_id)
+#   count zigzag varints: value deltas, values as ints scaled by 10**decimals
+# Values are rounded to `decimals`, the client's readings have 2 decimals so it
+# is lossless there. It's negotiated like the codec: INIT "compress": ["zdelta"],
+# INIT ACK "compress": "zdelta" if the server takes it.
+
+import json, struct, sys, zlib
+from array import array
+
+CODEC_JSON = "json"
+CODEC_F32 = "f32"
+CODEC_F16 = "f16"
+SUPPORTED_CODECS = (CODEC_F32, CODEC_F16, CODEC_JSON)
+
+VT_F32 = 0
+VT_F16 = 1
+CODEC_VALUE_TYPES = {CODEC_F32: VT_F32, CODEC_F16: VT_F16}
+
+UNIT_CODES = {"C": 0, "F": 1, "K": 2, "%": 3, "Pa": 4, "V": 5}
+UNIT_NAMES = {code: unit for unit, code in UNIT_CODES.items()}
+
+PACKED_HDR = struct.Struct("!I H B B")
+
+FLAG_COMPRESSED = 0x80
+COMPRESS_ZDELTA = "zdelta"
+SUPPORTED_COMPRESS = (COMPRESS_ZDELTA,)
+ZDELTA_HDR = struct.Struct("!I H B B")
+ZDELTA_STORED = 0x80
+ZDELTA_LEVEL = 6
+# payloads fit in one MTU, a 1 KB window and a small memLevel compress them
+# about as well and make setting up the compressor several times cheaper
+ZDELTA_WBITS = 10
+ZDELTA_MEMLEVEL = 2
+# an inflated body can't be bigger than two 64 bit zigzag varints (10 bytes
+# each) per reading, anything that inflates past that is rejected mid-way
+ZDELTA_MAX_READING = 20
+
+_SWAP = sys.byteorder != "little"
+
+# value type -> (array/memoryview format, bytes per value)
+VALUE_FORMATS = {VT_F32: ("f", 4), VT_F16: ("e", 2)}
+
+# array has no half floats. memoryview can cast to them on newer Pythons,
+# otherwise a Struct per count, made once and reused
+try:
+    memoryview(bytes(2)).cast("e")
+    _HALF_CAST = not _SWAP
+except (ValueError, TypeError):
+    _HALF_CAST = False
+_HALF_STRUCTS = {}
+_HALF_CACHE_MAX = 1024   # an MTU holds ~700 half floats, bigger counts aren't kept
+
+
+def _half_struct(count):
+    st = _HALF_STRUCTS.get(count)
+    if st is None:
+        st = struct.Struct(f"<{count}e")
+        if count <= _HALF_CACHE_MAX:
+            _HALF_STRUCTS[count] = st
+    return st
+
+
+def _unpack_values(fmt, body, count):
+    # little-endian values -> a copy the caller owns (body may be a ring slot)
+    if fmt == "e":
+        return body.cast("e").tolist() if _HALF_CAST else _half_struct(count).unpack_from(body)
+    values = array(fmt)
+    values.frombytes(body)
+    if _SWAP:
+        values.byteswap()
+    return values
+
+
+def choose_codec(requested):
+    # first codec in the client's preference list that we also speak
+    if isinstance(requested, list):
+        for codec in requested:
+            if codec in SUPPORTED_CODECS:
+                return codec
+    return CODEC_JSON
+
+
+def encode_batch(codec, first_id, values, unit="C"):
+    if codec == CODEC_JSON:
+        readings = [{"reading_id": first_id + i, "value": v, "unit": unit} for i, v in enumerate(values)]
+        return json.dumps({"batch": readings}).encode()
+
+    vt = CODEC_VALUE_TYPES[codec]
+    hdr = PACKED_HDR.pack(first_id & 0xFFFFFFFF, len(values), UNIT_CODES[unit], vt)
+    if vt == VT_F32:
+        arr = array("f", values)
+        if _SWAP:
+            arr.byteswap()
+        return hdr + arr.tobytes()
+    return hdr + _half_struct(len(values)).pack(*values)
+
+
+def decode_packed(payload):
+    # -> (first_id, count, values, unit). Raises ValueError on a malformed payload.
+    mv = memoryview(payload)
+    if len(mv) < PACKED_HDR.size:
+        raise ValueError("packed payload too short")
+    first_id, count, unit_code, vt = PACKED_HDR.unpack_from(mv)
+    body = mv[PACKED_HDR.size:]
+
+    fmt = VALUE_FORMATS.get(vt)
+    if fmt is None:
+        raise ValueError(f"unknown value type {vt}")
+    if len(body) != fmt[1] * count:
+        raise ValueError("packed payload length does not match count")
+    return first_id, count, _unpack_values(fmt[0], body, count), UNIT_NAMES.get(unit_code, "?")
+
+
+def choose_compress(requested):
+    if isinstance(requested, list):
+        for name in requested:
+            if name in SUPPORTED_COMPRESS:
+                return name
+    return None
+
+
+def _zigzag_varints(out, deltas):
+    for d in deltas:
+        z = (d << 1) ^ (d >> 63)
+        while z >= 0x80:
+            out.append((z & 0x7F) | 0x80)
+            z >>= 7
+        out.append(z)
+
+
+def _read_varints(buf, pos, count):
+    out = []
+    for _ in range(count):
+        z = 0
+        shift = 0
+        while True:
+            if pos >= len(buf):
+                raise ValueError("zdelta body truncated")
+            b = buf[pos]
+            pos += 1
+            z |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        out.append((z >> 1) ^ -(z & 1))
+    return out, pos
+
+
+def _zdelta_body(first_id, ids, scaled):
+    # ids None = contiguous from first_id (the usual batch): deltas 0, 1, 1, ...
+    if ids is None:
+        body = bytearray(b"\x00" + b"\x02" * (len(scaled) - 1)) if scaled else bytearray()
+    else:
+        body = bytearray()
+        _zigzag_varints(body, [b - a for a, b in zip([first_id] + ids, ids)])
+    _zigzag_varints(body, [b - a for a, b in zip([0] + scaled, scaled)])
+    return bytes(body)
+
+
+def _make_zdict():
+    # What a typical batch body looks like: runs of id delta 1 (0x02 zigzagged)
+    # and small value deltas around a ~25.00 C reading. Client and server
+    # build the same bytes.
+    scaled = [2500 + (i * 37) % 200 - 100 for i in range(64)]
+    return b"\x02" * 128 + _zdelta_body(0, None, scaled)
+
+
+ZDICT = _make_zdict()
+
+
+def encode_zdelta(first_id, values, unit="C", ids=None, decimals=2):
+    scale = 10 ** decimals
+    scaled = [int(round(v * scale)) for v in values]
+    raw = _zdelta_body(first_id, ids, scaled)
+    comp = zlib.compressobj(ZDELTA_LEVEL, zlib.DEFLATED, -ZDELTA_WBITS, ZDELTA_MEMLEVEL, zdict=ZDICT)
+    body = comp.compress(raw) + comp.flush()
+    if len(body) >= len(raw):
+        body = raw
+        decimals |= ZDELTA_STORED
+    return ZDELTA_HDR.pack(first_id & 0xFFFFFFFF, len(values), UNIT_CODES[unit], decimals) + body
+
+
+def decode_zdelta(payload):
+    # -> (first_id, count, values, unit, ids, inflated_len). Raises ValueError on a malformed payload.
+    if len(payload) < ZDELTA_HDR.size:
+        raise ValueError("zdelta payload too short")
+    first_id, count, unit_code, decimals = ZDELTA_HDR.unpack_from(payload)
+    if decimals & ZDELTA_STORED:
+        decimals &= ~ZDELTA_STORED
+        body = bytes(payload[ZDELTA_HDR.size:])
+    else:
+        try:
+            decomp = zlib.decompressobj(-ZDELTA_WBITS, zdict=ZDICT)
+            # max_length 0 means no limit, a count 0 body gets one byte
+            body = decomp.decompress(payload[ZDELTA_HDR.size:], max(1, count * ZDELTA_MAX_READING))
+        except zlib.error as e:
+            raise ValueError(f"zdelta inflate failed: {e}")
+        if decomp.unconsumed_tail or not decomp.eof:
+            # hit the limit (or a cut off stream): not what the header says
+            raise ValueError(f"zdelta body inflates past {count} readings")
+    id_deltas, pos = _read_varints(body, 0, count)
+    value_deltas, pos = _read_varints(body, pos, count)
+    ids = []
+    cur = first_id
+    for d in id_deltas:
+        cur += d
+        ids.append(cur)
+    values = []
+    cur = 0
+    scale = 10 ** decimals
+    for d in value_deltas:
+        cur += d
+        values.append(cur / scale)
+    return first_id, count, values, UNIT_NAMES.get(unit_code, "?"), ids, len(body)
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+# Wire-level analysis of the *_trace.pcap captures.
+#
+# The capture is mmap'ed and the record headers are walked in place with
+# struct.unpack_from, nothing is copied and nothing is kept per packet, so a
+# multi-GB capture runs in constant memory (a few small counters per device).
+# Per record: link layer (Ethernet incl. VLAN, Linux cooked v1/v2, BSD loopback,
+# raw IP) -> IPv4 -> UDP to/from the server port -> the 13 byte ITP header.
+#
+# Per device, from the client->server DATA:
+#   - unique / duplicate / reordered (new seq below the highest seen) packets,
+#     using the server's SeqWindow so the 16-bit seq wrap works the same way
+#   - expected packets from the highest seq and the seq step (batch size), so
+#     loss at the capture point; losses after the last packet can't be seen
+# and from the server->client ACK/SACKs:
+#   - DATA -> ACK time at the capture point (at the server that's the server's
+#     turnaround, at the client the full RTT). Seqs that were seen more than
+#     once give no sample, like Karn, it's unknown which copy was ACKed.
+#
+# With the server's packets log next to it (raw_data/<scenario>/<label>_packets_log.csv)
+# the unique DATA on the wire is compared with the unique DATA the server
+# logged: wire loss is the network, wire minus logged is what the host/server
+# dropped (socket buffer overflow and such).
+#
+# Matrix cells (run_expirments.py --matrix) each have their own server port,
+# it's read from the <label>_cell.json next to the pcap, --port is for the rest.
+#
+#   python3 pcap_analysis.py raw_data/loss/loss_run1_trace.pcap
+#   python3 pcap_analysis.py raw_data/*/*_trace.pcap --out pcap_summary.csv
+
+import mmap, struct, argparse, csv, json, os, random
+
+from seq_window import SeqWindow, seq_delta, SEQ_NEW, SEQ_DUPLICATE
+from ack_tracker import MSG_SACK, SACK_PAYLOAD, SACK_BITS
+from payload_codec import FLAG_COMPRESSED
+
+SERVER_PORT = 5005
+
+HDR = struct.Struct("!B H H d")
+HDR_LEN = HDR.size
+MSG_INIT = 0
+MSG_DATA = 1
+MSG_ACK = 2
+MSG_END = 3
+MSG_HEARTBEAT = 4
+
+# pcap file header and record header, '<' or '>' from the magic
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+PCAPNG_MAGIC = 0x0A0D0D0A
+PCAP_HDR_LEN = 24
+REC_HDR_LEN = 16
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = (12, 101, 228)
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETH_IPV4 = 0x0800
+ETH_VLAN = (0x8100, 0x88A8)
+U16 = struct.Struct("!H")
+IPV4_FIXED = struct.Struct("!B x H H H x B")   # ver/ihl, total len, id, frag, proto
+UDP_HDR = struct.Struct("!H H H x x")
+
+# DATA waiting for their ACK, per device; older ones are given up on past this
+MAX_PENDING = 4096
+# RTT samples kept for the percentiles (reservoir, all devices together)
+RTT_RESERVOIR = 8192
+
+
+class PcapError(ValueError):
+    pass
+
+
+def read_pcap(buf, port=SERVER_PORT, stats=None):
+    # Yields (capture time, to_server, header byte, device_id, seq, ITP timestamp, sack bitmap or None)
+    # for every ITP packet to/from `port` in the pcap in buf (an mmap or bytes).
+    if len(buf) < PCAP_HDR_LEN:
+        raise PcapError("file too short for a pcap header")
+    magic = struct.unpack_from("<I", buf)[0]
+    if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        endian = "<"
+    else:
+        magic = struct.unpack_from(">I", buf)[0]
+        if magic not in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+            if magic == PCAPNG_MAGIC:
+                raise PcapError("pcapng is not supported, convert it: editcap -F pcap in.pcapng out.pcap")
+            raise PcapError("not a pcap file (magic %08x)" % magic)
+        endian = ">"
+    frac = 1e-9 if magic == PCAP_MAGIC_NS else 1e-6
+    linktype = struct.unpack_from(endian + "I", buf, 20)[0] & 0x0FFFFFFF
+    rec = struct.Struct(endian + "I I I I")
+    null_family = struct.Struct(endian + "I")
+    if stats is None:
+        stats = {}
+    for k in ("records", "itp", "not_ipv4", "not_itp", "fragments", "truncated"):
+        stats.setdefault(k, 0)
+
+    size = len(buf)
+    off = PCAP_HDR_LEN
+    while off + REC_HDR_LEN <= size:
+        ts_sec, ts_frac, caplen, _ = rec.unpack_from(buf, off)
+        off += REC_HDR_LEN
+        end = off + caplen
+        if end > size:
+            # capture cut off mid record (tcpdump killed)
+            stats["truncated"] += 1
+            break
+        pkt = off
+        off = end
+        stats["records"] += 1
+
+        # link layer -> start of the IPv4 header
+        if linktype == LINKTYPE_ETHERNET:
+            if caplen < 14:
+                continue
+            ethertype = U16.unpack_from(buf, pkt + 12)[0]
+            ip = pkt + 14
+            while ethertype in ETH_VLAN and ip + 4 <= end:
+                ethertype = U16.unpack_from(buf, ip + 2)[0]
+                ip += 4
+        elif linktype == LINKTYPE_LINUX_SLL:
+            if caplen < 16:
+                continue
+            ethertype = U16.unpack_from(buf, pkt + 14)[0]
+            ip = pkt + 16
+        elif linktype == LINKTYPE_LINUX_SLL2:
+            if caplen < 20:
+                continue
+            ethertype = U16.unpack_from(buf, pkt)[0]
+            ip = pkt + 20
+        elif linktype == LINKTYPE_NULL:
+            if caplen < 4:
+                continue
+            ethertype = ETH_IPV4 if null_family.unpack_from(buf, pkt)[0] == 2 else 0
+            ip = pkt + 4
+        elif linktype in LINKTYPE_RAW:
+            ethertype = ETH_IPV4 if caplen and buf[pkt] >> 4 == 4 else 0
+            ip = pkt
+        else:
+            raise PcapError("unsupported link type %d" % linktype)
+
+        if ethertype != ETH_IPV4 or ip + 20 > end:
+            stats["not_ipv4"] += 1
+            continue
+        vihl, _, _, frag, proto = IPV4_FIXED.unpack_from(buf, ip)
+        if vihl >> 4 != 4 or proto != 17:
+            stats["not_itp"] += 1
+            continue
+        if frag & 0x1FFF:
+            # later fragments have no UDP header, the first one has the ITP header
+            stats["fragments"] += 1
+            continue
+        udp = ip + (vihl & 0xF) * 4
+        itp = udp + 8
+        if itp + HDR_LEN > end:
+            stats["not_itp"] += 1
+            continue
+        sport, dport, _ = UDP_HDR.unpack_from(buf, udp)
+        if dport == port:
+            to_server = True
+        elif sport == port:
+            to_server = False
+        else:
+            stats["not_itp"] += 1
+            continue
+        hb, device_id, seq, sent_ts = HDR.unpack_from(buf, itp)
+        bitmap = None
+        if hb & 0xF == MSG_SACK and itp + HDR_LEN + SACK_PAYLOAD.size <= end:
+            bitmap = SACK_PAYLOAD.unpack_from(buf, itp + HDR_LEN)[0]
+        stats["itp"] += 1
+        yield ts_sec + ts_frac * frac, to_server, hb, device_id, seq, sent_ts, bitmap
+
+
+class DeviceTrace:
+    __slots__ = ("window", "step", "data", "unique", "duplicates", "stale", "reordered", "compressed",
+                 "acks", "sacks", "pending", "retransmitted", "rtt_n", "rtt_sum", "rtt_min", "rtt_max",
+                 "given_up", "first_time", "last_time", "session_unique", "prev_expected")
+
+    def __init__(self):
+        self.window = SeqWindow()
+        self.step = None
+        self.data = self.unique = self.duplicates = self.stale = self.reordered = self.compressed = 0
+        self.session_unique = 0    # unique DATA since the last INIT, `unique` is all sessions
+        self.prev_expected = 0     # expected() of the sessions before the last INIT
+        self.acks = self.sacks = self.given_up = 0
+        self.pending = {}          # ext seq -> capture time of the DATA, insertion order = send order
+        self.retransmitted = set() # pending seqs seen more than once, no RTT sample for them
+        self.rtt_n = 0
+        self.rtt_sum = 0.0
+        self.rtt_min = float("inf")
+        self.rtt_max = 0.0
+        self.first_time = None
+        self.last_time = None
+
+    def expected(self):
+        # DATA packets the sender must have sent to reach the highest seq, ids start at 1,
+        # summed over the device's sessions
+        if not self.session_unique:
+            return self.prev_expected
+        return self.prev_expected + (self.window.highest - 1) // (self.step or 1) + 1
+
+    def restart(self):
+        # INIT: the seq space starts over. What the old session expected is kept,
+        # its DATA that's still waiting will never be ACKed.
+        self.prev_expected = self.expected()
+        self.session_unique = 0
+        self.step = None
+        self.window.reset()
+        self.given_up += len(self.pending)
+        self.pending.clear()
+        self.retransmitted.clear()
+
+
+class PcapAnalysis:
+    def __init__(self, port=SERVER_PORT, seed=None):
+        self.port = port
+        self.devices = {}
+        self.stats = {}
+        self.rtts = []
+        self.rtt_seen = 0
+        self.rng = random.Random(seed)
+
+    def device(self, device_id):
+        dev = self.devices.get(device_id)
+        if dev is None:
+            dev = self.devices[device_id] = DeviceTrace()
+        return dev
+
+    def run(self, path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise PcapError("empty file")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                for pkt in read_pcap(buf, self.port, self.stats):
+                    self.add(*pkt)
+        return self
+
+    def add(self, now, to_server, hb, device_id, seq, sent_ts, bitmap):
+        msgtype = hb & 0xF
+        if to_server:
+            if msgtype == MSG_DATA:
+                self.add_data(now, hb, device_id, seq)
+            elif msgtype == MSG_INIT:
+                # a restart starts the seq space over, like the server does
+                dev = self.devices.get(device_id)
+                if dev is not None and dev.session_unique:
+                    self.stats["restarts"] = self.stats.get("restarts", 0) + 1
+                    dev.restart()
+            return
+        dev = self.devices.get(device_id)
+        if dev is None or not dev.session_unique:
+            return
+        if msgtype == MSG_ACK and seq != 0:
+            dev.acks += 1
+            self.acked(dev, dev.window.highest + seq_delta(seq, dev.window.highest), now)
+        elif msgtype == MSG_SACK:
+            dev.sacks += 1
+            cum = dev.window.highest + seq_delta(seq, dev.window.highest)
+            for s in [s for s in dev.pending if s <= cum or
+                      (bitmap and 0 <= s - cum - 1 < SACK_BITS and bitmap >> (s - cum - 1) & 1)]:
+                self.acked(dev, s, now)
+
+    def add_data(self, now, hb, device_id, seq):
+        dev = self.device(device_id)
+        dev.data += 1
+        if dev.first_time is None:
+            dev.first_time = now
+        dev.last_time = now
+        if hb & FLAG_COMPRESSED:
+            dev.compressed += 1
+        window = dev.window
+        highest = window.highest if window.bitmap else None
+        ext = window.extend(seq)
+        state = window.mark(ext)
+        if state != SEQ_NEW:
+            if state == SEQ_DUPLICATE:
+                dev.duplicates += 1
+                if ext in dev.pending:
+                    dev.retransmitted.add(ext)
+            else:
+                dev.stale += 1
+            return
+        dev.unique += 1
+        dev.session_unique += 1
+        if highest is not None:
+            if ext < highest:
+                dev.reordered += 1
+            elif ext - highest < (dev.step or ext):
+                # smallest advance between packets = the batch size
+                dev.step = ext - highest
+        dev.pending[ext] = now
+        if len(dev.pending) > MAX_PENDING:
+            old = next(iter(dev.pending))
+            del dev.pending[old]
+            dev.retransmitted.discard(old)
+            dev.given_up += 1
+
+    def acked(self, dev, ext, now):
+        sent = dev.pending.pop(ext, None)
+        if sent is None:
+            return
+        if ext in dev.retransmitted:
+            dev.retransmitted.discard(ext)
+            return
+        rtt = now - sent
+        dev.rtt_n += 1
+        dev.rtt_sum += rtt
+        if rtt < dev.rtt_min:
+            dev.rtt_min = rtt
+        if rtt > dev.rtt_max:
+            dev.rtt_max = rtt
+        # reservoir sample for the percentiles
+        self.rtt_seen += 1
+        if len(self.rtts) < RTT_RESERVOIR:
+            self.rtts.append(rtt)
+        else:
+            i = self.rng.randrange(self.rtt_seen)
+            if i < RTT_RESERVOIR:
+                self.rtts[i] = rtt
+
+    def rows(self, server_log=None):
+        # one dict per device, with the server log's unique count when we have it
+        out = []
+        for device_id in sorted(self.devices):
+            dev = self.devices[device_id]
+            expected = dev.expected()
+            lost = max(0, expected - dev.unique)
+            row = {
+                "device_id": device_id, "data_packets": dev.data, "unique": dev.unique,
+                "duplicates": dev.duplicates, "stale": dev.stale, "reordered": dev.reordered,
+                "expected": expected, "wire_lost": lost,
+                "wire_loss_rate": round(100.0 * lost / expected, 3) if expected else 0.0,
+                "acks": dev.acks, "sacks": dev.sacks,
+                "unacked": len(dev.pending) + dev.given_up,
+                "ack_rtt_min_ms": round(dev.rtt_min * 1e3, 3) if dev.rtt_n else "",
+                "ack_rtt_mean_ms": round(dev.rtt_sum / dev.rtt_n * 1e3, 3) if dev.rtt_n else "",
+                "ack_rtt_max_ms": round(dev.rtt_max * 1e3, 3) if dev.rtt_n else "",
+            }
+            if server_log is not None:
+                logged = server_log.get(device_id, 0)
+                row["server_logged"] = logged
+                row["server_dropped"] = dev.unique - logged
+            out.append(row)
+        return out
+
+
+def read_server_log(path):
+    # device_id -> unique DATA the server logged (duplicate_flag 0), streamed
+    counts = {}
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            if row["duplicate_flag"] == "0":
+                d = int(row["device_id"])
+                counts[d] = counts.get(d, 0) + 1
+    return counts
+
+
+def server_log_for(pcap_path):
+    if pcap_path.endswith("_trace.pcap"):
+        path = pcap_path[:-len("trace.pcap")] + "packets_log.csv"
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def port_for(pcap_path, default=SERVER_PORT):
+    # the server port of the matrix cell the pcap belongs to, else default
+    if pcap_path.endswith("_trace.pcap"):
+        try:
+            with open(pcap_path[:-len("trace.pcap")] + "cell.json") as f:
+                port = json.load(f).get("server_port")
+            if isinstance(port, int):
+                return port
+        except (OSError, ValueError, AttributeError):
+            pass
+    return default
+
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return float("nan")
+    return sorted_vals[min(len(sorted_vals) - 1, int(p / 100.0 * len(sorted_vals)))]
+
+
+def report(path, analysis, rows, verbose=False):
+    st = analysis.stats
+    print(f"PCAP :: {path} :: PORT {analysis.port} :: {st['records']} RECORDS :: {st['itp']} ITP :: {len(rows)} DEVICES"
+          + (f" :: {st['truncated']} TRUNCATED" if st["truncated"] else ""))
+    if st["records"] and not st["itp"]:
+        print(f"WARNING :: no ITP packets to/from port {analysis.port}, captured with another server port? (--port)")
+    if verbose:
+        for r in rows:
+            print(f"  DEVICE {r['device_id']} :: DATA {r['data_packets']} :: UNIQUE {r['unique']}/{r['expected']} :: "
+                  f"LOST {r['wire_lost']} ({r['wire_loss_rate']:.2f}%) :: DUP {r['duplicates']} :: "
+                  f"REORDERED {r['reordered']}" + (f" :: SERVER LOGGED {r['server_logged']}" if "server_logged" in r else ""))
+    tot = {k: sum(r[k] for r in rows) for k in ("data_packets", "unique", "duplicates", "reordered", "expected", "wire_lost")}
+    loss = 100.0 * tot["wire_lost"] / tot["expected"] if tot["expected"] else 0.0
+    print(f"WIRE :: DATA {tot['data_packets']} :: UNIQUE {tot['unique']}/{tot['expected']} :: "
+          f"LOST {tot['wire_lost']} ({loss:.2f}%) :: DUP {tot['duplicates']} :: REORDERED {tot['reordered']}")
+    if rows and "server_logged" in rows[0]:
+        logged = sum(r["server_logged"] for r in rows)
+        print(f"SERVER LOG :: LOGGED {logged} :: ON THE WIRE {tot['unique']} :: "
+              f"DROPPED AT THE SERVER {tot['unique'] - logged}")
+    rtts = sorted(analysis.rtts)
+    if rtts:
+        print(f"DATA->ACK ms :: p50 {percentile(rtts, 50) * 1e3:.3f} :: p90 {percentile(rtts, 90) * 1e3:.3f} :: "
+              f"p99 {percentile(rtts, 99) * 1e3:.3f} :: max {max(r['ack_rtt_max_ms'] or 0 for r in rows):.3f} :: "
+              f"{analysis.rtt_seen} SAMPLES")
+
+
+def main(paths, port=SERVER_PORT, compare=True, out=None, verbose=False):
+    all_rows = []
+    for path in paths:
+        try:
+            analysis = PcapAnalysis(port_for(path, port)).run(path)
+        except (OSError, PcapError) as e:
+            print(f"PCAP :: {path} :: skipped: {e}")
+            continue
+        log_path = server_log_for(path) if compare else None
+        rows = analysis.rows(read_server_log(log_path) if log_path else None)
+        report(path, analysis, rows, verbose)
+        for r in rows:
+            all_rows.append(dict(r, pcap=path))
+    if out and all_rows:
+        fields = ["pcap"] + list(max((r for r in all_rows), key=len))
+        fields = list(dict.fromkeys(fields))
+        with open(out, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=fields, restval="")
+            w.writeheader()
+            w.writerows(all_rows)
+        print(f"Per-device wire metrics saved to {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wire-level loss/duplicate/reorder/ACK RTT from ITP pcap captures")
+    parser.add_argument("pcaps", nargs="+", help="pcap files (the *_trace.pcap of the runs)")
+    parser.add_argument("--port", type=int, default=SERVER_PORT,
+                        help="server UDP port when there's no <label>_cell.json next to the pcap (default 5005)")
+    parser.add_argument("--no-compare", action="store_true",
+                        help="don't compare with the server's packets log next to the pcap")
+    parser.add_argument("--out", default=None, help="write the per-device metrics to this CSV")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every device")
+    args = parser.parse_args()
+    main(args.pcaps, args.port, not args.no_compare, args.out, args.verbose)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Reorder / jitter buffer for DATA.
+#
+# A packet that arrives ahead of the seq the session expects next is held in a
+# per-session min-heap keyed on seq instead of being flagged as a gap right
+# away. Held packets are released in seq order as soon as the hole before them
+# fills, or when their hold time runs out, and only then is the hole counted
+# as a real gap (the server flags it when it delivers the packet).
+#
+# Hold time adapts to the jitter the server measures for the session
+# (jitter_mult * jitter, clamped to [min_hold, max_hold]). max_packets caps the
+# packets held over all sessions, past it packets are delivered unbuffered.
+
+import heapq
+
+
+class ReorderBuffer:
+    def __init__(self, deliver, expected, max_hold=0.3, min_hold=0.01, jitter_mult=4.0, max_packets=10000):
+        # deliver(key, item): hand one packet to the server, in order
+        # expected(key): the ext seq the session expects next
+        self.deliver = deliver
+        self.expected = expected
+        self.max_hold = max_hold
+        self.min_hold = min_hold
+        self.jitter_mult = jitter_mult
+        self.max_packets = max_packets
+        self.heaps = {}   # key -> [(ext_seq, deadline, item)], only for keys holding something
+        self.held = 0
+        self.stats = {"held": 0, "reordered": 0, "real_gaps": 0, "overflow": 0}
+
+    def hold_time(self, jitter):
+        return min(self.max_hold, max(self.min_hold, self.jitter_mult * jitter))
+
+    def add(self, key, ext_seq, item, now, jitter):
+        heap = self.heaps.get(key)
+        if self.max_hold <= 0 or ext_seq <= self.expected(key):
+            self.deliver(key, item)
+            if heap:
+                self._release(key, heap, now)
+            return
+        if self.held >= self.max_packets:
+            self.stats["overflow"] += 1
+            self.deliver(key, item)
+            return
+        if heap is None:
+            heap = self.heaps[key] = []
+        heapq.heappush(heap, (ext_seq, now + self.hold_time(jitter), item))
+        self.held += 1
+        self.stats["held"] += 1
+
+    def tick(self, now):
+        # release whatever timed out, called from the server's periodic work
+        for key, heap in list(self.heaps.items()):
+            self._release(key, heap, now)
+
+    def flush(self, key):
+        # session is going away, deliver everything it still holds in seq order
+        heap = self.heaps.pop(key, None)
+        while heap:
+            ext_seq, _, item = heapq.heappop(heap)
+            self.held -= 1
+            self._count(key, ext_seq)
+            self.deliver(key, item)
+
+    def flush_all(self):
+        for key in list(self.heaps):
+            self.flush(key)
+
+    def _release(self, key, heap, now):
+        while heap:
+            ext_seq, deadline, item = heap[0]
+            if ext_seq > self.expected(key) and deadline > now:
+                break
+            heapq.heappop(heap)
+            self.held -= 1
+            self._count(key, ext_seq)
+            self.deliver(key, item)
+        if not heap:
+            del self.heaps[key]
+
+    def _count(self, key, ext_seq):
+        if ext_seq > self.expected(key):
+            self.stats["real_gaps"] += 1
+        else:
+            self.stats["reordered"] += 1
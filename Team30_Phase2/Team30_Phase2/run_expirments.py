@@ -3,6 +3,13 @@ import subprocess
 import time
 import sys
 import signal
+import json
+import shutil
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from packet_log import merge_chunk_dir, run_chunk_dir
 
 # --- CONFIGURATION ---
 INTERFACE = "enp0s8" 
@@ -100,6 +107,9 @@ def run_single_test(scenario_key, run_num):
         print("Warning: Server did not exit gracefully. Forcing kill.")
         # If it timed out or process not found, force kill
         os.killpg(os.getpgid(server_process.pid), signal.SIGKILL)
+        # The server streams its log in chunks, merge whatever made it to disk
+        recovered = merge_chunk_dir(run_chunk_dir(server_process.pid), temp_log_csv_path)
+        print(f"    Recovered {recovered} logged packets from the killed server.")
         
     # 6. Stop tcpdump
     print("[4] Stopping tcpdump capture...")
@@ -134,6 +144,241 @@ def run_single_test(scenario_key, run_num):
     print(f"\n--- {scenario_name.upper()} Run #{run_num} COMPLETE ---")
 
 
+# --- UNATTENDED SCENARIO MATRIX ---
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MATRIX_WORK_DIR = os.path.join("raw_data", ".work")
+MATRIX_BASE_PORT = 5100
+READY_TIMEOUT = 10       # seconds to wait for the server to say it's listening
+END_GRACE = 3            # seconds to wait for the ENDs after the client exited
+STOP_TIMEOUT = 15
+
+MATRIX_DEFAULTS = {
+    "repetitions": 1,
+    "messages": 70,          # readings per device (single device runs)
+    "interval": 1.0,         # seconds between DATA packets (single device runs)
+    "batch_sizes": [1],
+    "devices": [1],
+    "load": {"rate": 200, "duration": 10},   # for cells with more than one device
+    "client_args": [],
+    "server_args": [],
+    "capture": False,
+    "capture_cmd": ["tcpdump"],
+    "interface": "lo",
+    "timeout": 600,
+}
+
+
+def load_matrix(path):
+    """Reads a scenario matrix JSON file and fills in the defaults."""
+    with open(path) as f:
+        matrix = json.load(f)
+    for key, value in MATRIX_DEFAULTS.items():
+        matrix.setdefault(key, value)
+    if not matrix.get("scenarios"):
+        raise ValueError(f"{path}: needs a 'scenarios' object, e.g. {{\"baseline\": {{}}, \"loss\": {{\"loss\": 0.05}}}}")
+    return matrix
+
+
+def matrix_cells(matrix):
+    """One cell per scenario x batch size x device count x repetition, each with its own ports."""
+    cells = []
+    combos = itertools.product(matrix["scenarios"].items(), matrix["batch_sizes"], matrix["devices"],
+                               range(1, matrix["repetitions"] + 1))
+    for i, ((scenario, impairment), batch, devices, rep) in enumerate(combos):
+        cells.append({
+            "scenario": scenario,
+            "impairment": impairment,
+            "batch_size": batch,
+            "devices": devices,
+            "run": rep,
+            "label": f"{scenario}_b{batch}_d{devices}_run{rep}",
+            "server_port": MATRIX_BASE_PORT + 2 * i,
+            "proxy_port": MATRIX_BASE_PORT + 2 * i + 1,
+        })
+    return cells
+
+
+def proxy_args(impairment):
+    """{"loss": 0.05, "ge": "0.01,0.3"} -> ["--loss", "0.05", "--ge", "0.01,0.3"] for impair_proxy.py"""
+    args = []
+    for key, value in impairment.items():
+        args += [f"--{key.replace('_', '-')}", str(value)]
+    return args
+
+
+def wait_for_line(path, text, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with open(path) as f:
+                if text in f.read():
+                    return True
+        except FileNotFoundError:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def count_lines(path, text):
+    try:
+        with open(path) as f:
+            return f.read().count(text)
+    except FileNotFoundError:
+        return 0
+
+
+def stop_process(proc, sig=signal.SIGINT, timeout=STOP_TIMEOUT, group=False):
+    """Sends sig and waits, kills it if it doesn't exit. Returns True if it exited by itself.
+
+    group=True signals the whole process group (proc started with start_new_session),
+    like a Ctrl+C would, so the server's workers/processors stop together with it.
+    """
+    if proc is None or proc.poll() is not None:
+        return True
+    try:
+        if group:
+            os.killpg(proc.pid, sig)
+        else:
+            proc.send_signal(sig)
+        proc.wait(timeout=timeout)
+        return True
+    except subprocess.TimeoutExpired:
+        if group:
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+        proc.wait()
+        return False
+
+
+def run_matrix_cell(cell, matrix):
+    """
+    Runs one cell of the matrix without any operator:
+    1. Starts the server (and the impairment proxy, and tcpdump if asked) in a
+       work dir of its own, on the cell's own ports.
+    2. Runs the client (or the load generator for more than one device) against it.
+    3. Done when the client exits and the server logged the END of every device
+       (or END_GRACE passed), then stops everything with SIGINT.
+    4. Moves the results to raw_data/<scenario>/<label>_*.
+    """
+    label = cell["label"]
+    work = os.path.join(MATRIX_WORK_DIR, label)
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work)
+    server_log = os.path.join(work, SERVER_LOG_FILE)
+    client_log = os.path.join(work, "client_log.txt")
+    py = sys.executable
+    impaired = bool(cell["impairment"])
+    client_port = cell["proxy_port"] if impaired else cell["server_port"]
+    started = time.time()
+
+    capture = proxy = None
+    if matrix["capture"]:
+        cmd = matrix["capture_cmd"] + ["-i", matrix["interface"], "-w", PCAP_FILE,
+                                       f"udp and (port {cell['server_port']} or port {cell['proxy_port']})"]
+        try:
+            capture = subprocess.Popen(cmd, cwd=work, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            print(f"[{label}] {cmd[0]} not found, running without capture")
+
+    with open(server_log, "w") as log_file:
+        server = subprocess.Popen([py, "-u", os.path.join(HERE, SERVER_SCRIPT), "--port", str(cell["server_port"])]
+                                  + matrix["server_args"], cwd=work, stdout=log_file, stderr=subprocess.STDOUT,
+                                  start_new_session=True)
+    if impaired:
+        # seeded by repetition: cells that only differ in batch size / devices
+        # see the same loss pattern, so they can be compared run by run
+        with open(os.path.join(work, "proxy_log.txt"), "w") as log_file:
+            proxy = subprocess.Popen([py, "-u", os.path.join(HERE, "impair_proxy.py"),
+                                      "--listen", str(cell["proxy_port"]),
+                                      "--upstream", f"127.0.0.1:{cell['server_port']}",
+                                      "--seed", str(cell["run"]), "--trace", "impairment_trace.csv"]
+                                     + proxy_args(cell["impairment"]), cwd=work, stdout=log_file, stderr=subprocess.STDOUT)
+
+    client_rc = None
+    try:
+        if not wait_for_line(server_log, "UDP server listening", READY_TIMEOUT):
+            print(f"[{label}] server did not start, see {server_log}")
+            return {"label": label, "ok": False}
+        if proxy is not None:
+            wait_for_line(os.path.join(work, "proxy_log.txt"), "IMPAIR PROXY", READY_TIMEOUT)
+
+        client_cmd = [py, "-u", os.path.join(HERE, "udp_client.py"), "--server", "127.0.0.1",
+                      "--port", str(client_port), "--batch-size", str(cell["batch_size"])]
+        if cell["devices"] > 1:
+            load = matrix["load"]
+            client_cmd += ["--devices", str(cell["devices"]), "--rate", str(load["rate"]),
+                           "--duration", str(load["duration"]),
+                           "--first-device", str(load.get("first_device", 1000))]
+        else:
+            client_cmd += ["--messages", str(matrix["messages"]), "--interval", str(matrix["interval"])]
+        client_cmd += matrix["client_args"]
+        with open(client_log, "w") as log_file:
+            try:
+                client_rc = subprocess.run(client_cmd, cwd=work, stdout=log_file, stderr=subprocess.STDOUT,
+                                           timeout=matrix["timeout"]).returncode
+            except subprocess.TimeoutExpired:
+                print(f"[{label}] client timed out after {matrix['timeout']}s")
+
+        # the client is done, give the ENDs (possibly through the proxy delay) a moment
+        deadline = time.time() + END_GRACE
+        while count_lines(server_log, "closed (END)") < cell["devices"] and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        stop_process(proxy)
+        recovered = None
+        if not stop_process(server, group=True):
+            # killed before it merged its log, the chunks are under its cwd
+            recovered = merge_chunk_dir(os.path.join(work, run_chunk_dir(server.pid)),
+                                        os.path.join(work, "packets_log_sorted_by_timestamp.csv"))
+            print(f"[{label}] server had to be killed, recovered {recovered} packet log rows from its chunks")
+        stop_process(capture, signal.SIGTERM)
+
+    output_dir = os.path.join("raw_data", cell["scenario"])
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {
+        PCAP_FILE: "trace.pcap",
+        SERVER_LOG_FILE: "console_log.txt",
+        "packets_log_sorted_by_timestamp.csv": "packets_log.csv",
+        "client_log.txt": "client_log.txt",
+        "impairment_trace.csv": "impairment_trace.csv",
+    }
+    for src, suffix in outputs.items():
+        if os.path.exists(os.path.join(work, src)):
+            os.replace(os.path.join(work, src), os.path.join(output_dir, f"{label}_{suffix}"))
+    meta = dict(cell, client_exit=client_rc, log_recovered=recovered, seconds=round(time.time() - started, 1),
+                messages=matrix["messages"], load=matrix["load"] if cell["devices"] > 1 else None)
+    with open(os.path.join(output_dir, f"{label}_cell.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(work, ignore_errors=True)
+    # a killed server whose chunks held nothing means the run has no packet log
+    ok = client_rc == 0 and recovered != 0
+    print(f"[{label}] {'done' if ok else 'FAILED'} in {meta['seconds']}s -> {output_dir}/{label}_*")
+    return {"label": label, "ok": ok}
+
+
+def run_matrix(path, parallel=1, dry_run=False):
+    """Runs every cell of the matrix file, `parallel` cells at a time."""
+    matrix = load_matrix(path)
+    cells = matrix_cells(matrix)
+    print(f"Scenario matrix {path}: {len(cells)} cells, {parallel} in parallel")
+    if dry_run:
+        for cell in cells:
+            print(f"  {cell['label']:40s} ports {cell['server_port']}/{cell['proxy_port']} impairment {cell['impairment']}")
+        return
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        results = list(pool.map(lambda c: run_matrix_cell(c, matrix), cells))
+    try:
+        os.rmdir(MATRIX_WORK_DIR)
+    except OSError:
+        pass
+    failed = [r["label"] for r in results if not r["ok"]]
+    print(f"\nMatrix complete: {len(results) - len(failed)}/{len(results)} cells OK")
+    if failed:
+        print("Failed cells: " + ", ".join(failed))
+
+
 def main_menu():
     """Presents the user with a menu to select the test scenario."""
     while True:
@@ -165,6 +410,15 @@ def main_menu():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ITP experiment runner (interactive menu without --matrix)")
+    parser.add_argument("--matrix", help="scenario matrix JSON file, runs every cell unattended")
+    parser.add_argument("--parallel", type=int, default=1, help="matrix cells to run at the same time (default 1)")
+    parser.add_argument("--dry-run", action="store_true", help="only list the matrix cells")
+    args = parser.parse_args()
+    if args.matrix:
+        run_matrix(args.matrix, args.parallel, args.dry_run)
+        sys.exit(0)
+
     # Check if we are running with elevated privileges (needed for tcpdump)
     # This check is basic and mainly informative
     if os.geteuid() != 0:
@@ -172,14 +426,4 @@ if __name__ == "__main__":
         print("      or add your user to the 'wireshark' group for tcpdump to work.")
         print("-" * 30)
 
-    # The original script would handle this, but for Python:
-    # Check for pandas on the server, as the server script requires it for log analysis.
-    try:
-        import pandas as pd
-    except ImportError:
-        print("CRITICAL ERROR: pandas library not found.")
-        print("The server script requires 'pandas' to sort the logs before saving.")
-        print("Please install it on your Linux VM: 'pip install pandas' or 'pip3 install pandas'")
-        sys.exit(1)
-        
     main_menu()
\ No newline at end of file
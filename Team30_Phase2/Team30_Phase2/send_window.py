@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Client side send window for reliable DATA.
+#
+# Up to `size` DATA packets may be outstanding (sent, not ACKed). Each one has a
+# retransmission deadline from the RTO, the RTO comes from SRTT/RTTVAR like
+# RFC 6298, and every timeout multiplies the packet's RTO by `backoff`
+# (BASE_BACKOFF in the client). Only packets that were sent once give an RTT
+# sample (Karn), a retransmitted one can't tell which copy got ACKed.
+#
+# Fast retransmit: when `dup_thresh` packets sent AFTER an outstanding one have
+# been ACKed (per-packet ACKs or the SACK bitmap) the older one is most likely
+# lost, so it goes out again without waiting for its timer.
+#
+# With size=None and retransmit=False it only keeps track of what's outstanding,
+# which is what the best effort mode uses for its ACK summary. There a packet
+# still unacked when its RTO runs out is counted as lost (stats["expired"]) and
+# forgotten, so the window stays as small as the packets of the last RTO.
+# stats["loss_hints"] counts the loss evidence for the adaptive batcher: timeouts
+# and packets passed by dup_thresh later ACKs when retransmitting, expiries in
+# best effort.
+
+RTO_MIN = 0.2
+RTO_MAX = 60.0
+CLOCK_G = 0.001   # timer granularity term of the RTO
+
+
+class RtoEstimator:
+    __slots__ = ("srtt", "rttvar", "rto", "min_rto", "max_rto")
+
+    def __init__(self, initial=3.0, min_rto=RTO_MIN, max_rto=RTO_MAX):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + max(CLOCK_G, 4 * self.rttvar)))
+
+
+class SendWindow:
+    def __init__(self, size=None, rto=None, backoff=2, max_retries=8, dup_thresh=3, retransmit=True):
+        self.size = size
+        self.rto = rto if rto is not None else RtoEstimator()
+        self.backoff = backoff
+        self.max_retries = max_retries
+        self.dup_thresh = dup_thresh
+        self.retransmit = retransmit
+        # seq -> [batch_size, packet, first_sent, deadline, retries, later_acks]
+        self.entries = {}
+        self.stats = {"sent": 0, "acked": 0, "timeouts": 0, "fast": 0, "failed": 0, "loss_hints": 0,
+                      "expired": 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(list(self.entries))
+
+    def has_room(self):
+        return self.size is None or len(self.entries) < self.size
+
+    def sent(self, seq, batch_size, packet, now):
+        self.entries[seq] = [batch_size, packet, now, now + self.rto.rto, 0, 0]
+        self.stats["sent"] += 1
+
+    def ack(self, seqs, now):
+        # seqs: the outstanding seqs an ACK/SACK just covered
+        newest = None
+        for seq in seqs:
+            e = self.entries.pop(seq, None)
+            if e is None:
+                continue
+            self.stats["acked"] += 1
+            if e[4] == 0:
+                self.rto.sample(now - e[2])
+            if newest is None or seq > newest:
+                newest = seq
+        if newest is not None and self.retransmit:
+            # every older packet still outstanding just saw a later one get through
+            for seq, e in self.entries.items():
+                if seq < newest:
+                    e[5] += 1
+                    if e[5] == self.dup_thresh:
+                        self.stats["loss_hints"] += 1
+
+    def due(self, now):
+        # [(seq, packet)] to send again: fast retransmits and expired timers.
+        # Packets out of retries are dropped and counted as failed.
+        if not self.retransmit:
+            self._expire(now)
+            return []
+        out = []
+        for seq in list(self.entries):
+            e = self.entries[seq]
+            fast = e[5] >= self.dup_thresh
+            if not fast and e[3] > now:
+                continue
+            e[4] += 1
+            if e[4] > self.max_retries:
+                del self.entries[seq]
+                self.stats["failed"] += 1
+                continue
+            self.stats["fast" if fast else "timeouts"] += 1
+            if not fast:
+                self.stats["loss_hints"] += 1
+            e[5] = 0
+            e[3] = now + min(self.rto.max_rto, self.rto.rto * self.backoff ** e[4])
+            out.append((seq, e[1]))
+        return out
+
+    def _expire(self, now):
+        # best effort: forget what's past its deadline. Entries are in send
+        # order and the deadlines nearly so, stop at the first one not due.
+        entries = self.entries
+        while entries:
+            seq = next(iter(entries))
+            if entries[seq][3] > now:
+                break
+            del entries[seq]
+            self.stats["expired"] += 1
+            self.stats["loss_hints"] += 1
+
+    def next_deadline(self):
+        return min((e[3] for e in self.entries.values()), default=None)
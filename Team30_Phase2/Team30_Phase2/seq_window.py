@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# Per-session sequence tracking for the server.
+#
+# The header seq is only 16 bits (!H) so it wraps at 65535. Instead of keeping
+# every seq we ever saw in a set, each session keeps:
+#   - `highest`: the highest *extended* seq seen so far (plain python int, never wraps)
+#   - `bitmap`:  WINDOW bits, bit i set means (highest - i) was received
+# A new 16-bit seq is mapped to the extended seq closest to `highest`
+# (serial number arithmetic, RFC 1982 style), so the wrap is invisible to the
+# duplicate and gap checks and the memory per device never grows.
+
+SEQ_BITS = 16
+SEQ_MOD = 1 << SEQ_BITS
+SEQ_HALF = SEQ_MOD >> 1
+
+DEFAULT_WINDOW = 1024
+
+# results of SeqWindow.mark()
+SEQ_NEW = 0
+SEQ_DUPLICATE = 1
+SEQ_STALE = 2   # older than the window, can't tell if it's a dup or not
+
+
+def seq_delta(a, b):
+    # signed distance a - b on the 16-bit circle, in [-32768, 32767]
+    d = (a - b) & (SEQ_MOD - 1)
+    return d - SEQ_MOD if d >= SEQ_HALF else d
+
+
+class SeqWindow:
+    __slots__ = ("size", "mask", "highest", "bitmap")
+
+    def __init__(self, size=DEFAULT_WINDOW):
+        self.size = size
+        self.mask = (1 << size) - 1
+        self.reset()
+
+    def reset(self):
+        self.highest = 0
+        self.bitmap = 0
+
+    def extend(self, seq):
+        # 16-bit wire seq -> extended seq nearest to the current anchor.
+        # Until something has been marked there is no anchor, take it as is.
+        if not self.bitmap:
+            return seq
+        return self.highest + seq_delta(seq, self.highest)
+
+    def mark(self, ext_seq):
+        # Record ext_seq as received. Returns SEQ_NEW, SEQ_DUPLICATE or SEQ_STALE.
+        offset = self.highest - ext_seq
+        if offset < 0:
+            # new highest: slide the window forward
+            self.bitmap = ((self.bitmap << -offset) | 1) & self.mask
+            self.highest = ext_seq
+            return SEQ_NEW
+        if offset >= self.size:
+            return SEQ_STALE
+        bit = 1 << offset
+        if self.bitmap & bit:
+            return SEQ_DUPLICATE
+        self.bitmap |= bit
+        return SEQ_NEW
+
+    def seen(self, ext_seq):
+        offset = self.highest - ext_seq
+        if offset < 0 or offset >= self.size:
+            return False
+        return bool(self.bitmap & (1 << offset))
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# Console logging for the server hot path.
+#
+# - log calls only check the level and push (time, level, msg, args) onto a
+#   queue, a background thread does the formatting and the writing, one write()
+#   per batch of lines
+# - timestamps are floats until the line is actually written, and the
+#   date+time part is cached per second instead of strftime'd every line
+# - noisy event types go through a token bucket per event type (limited()),
+#   the suppressed count is added to the next line that gets through
+# - DataSummary folds the per-packet "DATA RECEIVED" lines into one line per
+#   device per interval with counts
+
+import sys, time, threading, queue, datetime
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARN": WARN, "ERROR": ERROR}
+
+# default token bucket for limited() events: lines per second, burst
+EVENT_RATE = 20.0
+EVENT_BURST = 40.0
+
+
+class TsFormatter:
+    # '%Y-%m-%d %H:%M:%S.%f' without a strftime per line
+    def __init__(self):
+        self._sec = None
+        self._prefix = ""
+
+    def __call__(self, t):
+        sec = int(t)
+        if sec != self._sec:
+            self._sec = sec
+            self._prefix = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(sec))
+        return f"{self._prefix}.{int((t - sec) * 1e6):06d}"
+
+
+class LazyTs:
+    # float timestamp that only becomes '%Y-%m-%d %H:%M:%S.%f' when a line is written
+    __slots__ = ("t",)
+
+    def __init__(self, t):
+        self.t = t
+
+    def __str__(self):
+        return datetime.datetime.fromtimestamp(self.t).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+class ServerLog:
+    def __init__(self, level=INFO, stream=None, event_rate=EVENT_RATE, event_burst=EVENT_BURST):
+        self.level = level
+        self.stream = stream if stream is not None else sys.stdout
+        self.event_rate = event_rate
+        self.event_burst = event_burst
+        self._buckets = {}   # event -> [tokens, last_t, suppressed]
+        self._q = queue.SimpleQueue()
+        self._fmt_ts = TsFormatter()
+        self._thread = threading.Thread(target=self._run, name="server-log", daemon=True)
+        self._thread.start()
+
+    def log(self, level, t, msg, *args):
+        # msg is a %-format string, args are only formatted by the emitter thread
+        if level >= self.level:
+            self._q.put((t, msg, args))
+
+    def debug(self, t, msg, *args):
+        if DEBUG >= self.level:
+            self._q.put((t, msg, args))
+
+    def info(self, t, msg, *args):
+        if INFO >= self.level:
+            self._q.put((t, msg, args))
+
+    def warn(self, t, msg, *args):
+        if WARN >= self.level:
+            self._q.put((t, msg, args))
+
+    def error(self, t, msg, *args):
+        if ERROR >= self.level:
+            self._q.put((t, msg, args))
+
+    def limited(self, event, level, t, msg, *args):
+        # like log() but at most event_rate lines/s (event_burst at once) per event type
+        if level < self.level:
+            return
+        bucket = self._buckets.get(event)
+        if bucket is None:
+            bucket = self._buckets[event] = [self.event_burst, t, 0]
+        tokens = min(self.event_burst, bucket[0] + (t - bucket[1]) * self.event_rate)
+        bucket[1] = t
+        if tokens < 1.0:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return
+        bucket[0] = tokens - 1.0
+        if bucket[2]:
+            msg = msg + " (+%d similar suppressed)"
+            args = args + (bucket[2],)
+            bucket[2] = 0
+        self._q.put((t, msg, args))
+
+    def close(self):
+        self._q.put(None)
+        self._thread.join()
+
+    def _run(self):
+        q = self._q
+        while True:
+            item = q.get()
+            lines = []
+            while True:
+                if item is None:
+                    self._write(lines)
+                    return
+                t, msg, args = item
+                lines.append(f"[{self._fmt_ts(t)}] {msg % args if args else msg}\n")
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+            self._write(lines)
+
+    def _write(self, lines):
+        if lines:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+
+
+class DataSummary:
+    # One "DATA RECEIVED" line per device per `interval` seconds instead of one
+    # per packet. interval <= 0 disables it (the caller logs every packet).
+    def __init__(self, log, interval=1.0):
+        self.log = log
+        self.interval = interval
+        self._devices = {}   # device_id -> [packets, readings, bytes, first_seq, last_seq, gaps, since]
+
+    def add(self, t, device_id, seq, batch_size, payload_len, gap):
+        d = self._devices.get(device_id)
+        if d is None:
+            self._devices[device_id] = [1, batch_size, payload_len, seq, seq, int(gap), t]
+            return
+        d[0] += 1
+        d[1] += batch_size
+        d[2] += payload_len
+        d[4] = seq
+        d[5] += gap
+        if t - d[6] >= self.interval:
+            self._emit(t, device_id, d)
+            del self._devices[device_id]
+
+    def flush(self, now, force=False):
+        # called from the server's periodic timer so quiet devices still get their line
+        for device_id in [k for k, d in self._devices.items() if force or now - d[6] >= self.interval]:
+            self._emit(now, device_id, self._devices.pop(device_id))
+
+    def _emit(self, t, device_id, d):
+        packets, readings, nbytes, first_seq, last_seq, gaps, since = d
+        self.log.info(t, "DATA RECEIVED :: DEVICE %d :: PACKETS %d :: SEQ %d-%d :: READINGS %d :: BYTES %d :: GAPS %d :: OVER %.2fs",
+                      device_id, packets, first_seq, last_seq, readings, nbytes, gaps, max(t - since, 0.0))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+# Live stats snapshot of a running udp_server.py.
+#
+# The server only does plain counter increments per packet (packets and bytes
+# per message type, handler busy time, per-session data/dup/gap counters).
+# Every --stats-interval seconds its periodic timer hands the cumulative
+# counters to StatsWriter, which works out the rates since the previous
+# snapshot, adds the socket's kernel drop counter from /proc/net/udp and
+# rewrites the JSON file atomically (write + rename), so a reader never sees a
+# half written file. With --workers every worker writes its own file
+# (server_stats.w<N>.json).
+#
+# Reading it:
+#   python3 server_stats.py server_stats.json            # merges the worker files too
+#   python3 server_stats.py server_stats.json --watch 1 --devices 10
+
+import json, os, time, glob, argparse
+
+MSG_NAMES = {0: "INIT", 1: "DATA", 2: "ACK", 3: "END", 4: "HEARTBEAT", 5: "SACK"}
+
+# per-device entries in the snapshot, the ones with the most missing ids first
+MAX_DEVICES = 1000
+
+
+def worker_path(path, worker_id):
+    base, ext = os.path.splitext(path)
+    return f"{base}.w{worker_id}{ext or '.json'}"
+
+
+def socket_counters(inode):
+    # (rx_queue bytes, drops) of the UDP socket with this inode, from /proc/net/udp(6).
+    # drops counts datagrams the kernel threw away because the receive buffer was full.
+    for proc in ("/proc/net/udp", "/proc/net/udp6"):
+        try:
+            with open(proc) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) >= 13 and fields[9] == inode:
+                        return int(fields[4].split(":")[1], 16), int(fields[12])
+        except OSError:
+            pass
+    return None, None
+
+
+class StatsWriter:
+    def __init__(self, path, interval=1.0, sock=None):
+        self.path = path
+        self.interval = interval
+        self.inode = str(os.fstat(sock.fileno()).st_ino) if sock is not None else None
+        self.started = time.time()
+        self.next_write = self.started + interval
+        self.prev = None   # (time, packets, bytes, handler busy)
+
+    def due(self, now):
+        return self.interval > 0 and now >= self.next_write
+
+    def write(self, now, snap):
+        # snap: the server's cumulative counters, rates are filled in here
+        packets, nbytes, busy = snap["packets"], snap["bytes"], snap["handler"]["busy_s"]
+        if self.prev is None:
+            dt, p_packets, p_bytes, p_busy = now - self.started, {}, {}, 0.0
+        else:
+            t, p_packets, p_bytes, p_busy = self.prev
+            dt = now - t
+        dt = max(dt, 1e-9)
+        snap["time"] = now
+        snap["uptime_s"] = round(now - self.started, 3)
+        snap["interval_s"] = round(dt, 3)
+        snap["rates"] = {
+            "packets_per_s": {k: round((v - p_packets.get(k, 0)) / dt, 1) for k, v in packets.items()},
+            "bytes_per_s": round((sum(nbytes.values()) - sum(p_bytes.values())) / dt, 1),
+            "total_packets_per_s": round((sum(packets.values()) - sum(p_packets.values())) / dt, 1),
+            # fraction of the wall clock spent in the packet handlers, 1.0 = saturated
+            "handler_busy": round((busy - p_busy) / dt, 4),
+        }
+        if self.inode is not None:
+            rx_queue, drops = socket_counters(self.inode)
+            snap["socket"] = {"inode": self.inode, "rx_queue_bytes": rx_queue, "drops": drops}
+        self.prev = (now, dict(packets), dict(nbytes), busy)
+        self.next_write = now + self.interval
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(snap, f)
+        os.replace(tmp, self.path)
+
+
+def load_snapshots(path):
+    # the file itself, or the per-worker files next to it
+    paths = [path] if os.path.exists(path) else []
+    paths += sorted(glob.glob(worker_path(path, "*")))
+    snaps = []
+    for p in paths:
+        try:
+            with open(p) as f:
+                snaps.append(json.load(f))
+        except (OSError, ValueError):
+            pass
+    return snaps
+
+
+def merge(snaps):
+    # add up the workers, devices are sharded so they don't overlap.
+    # Ring processors share one socket, its counters are only added once.
+    total = {"workers": len(snaps), "time": max(s["time"] for s in snaps), "packets": {}, "bytes": {},
+             "pps": {}, "bytes_per_s": 0.0, "total_pps": 0.0, "handler_busy": [], "load": [], "sessions": 0,
+             "drops": 0, "rx_queue": 0, "admission": {}, "devices": {}}
+    inodes = set()
+    for s in snaps:
+        for k, v in s["packets"].items():
+            total["packets"][k] = total["packets"].get(k, 0) + v
+        for k, v in s["rates"]["packets_per_s"].items():
+            total["pps"][k] = total["pps"].get(k, 0.0) + v
+        total["bytes_per_s"] += s["rates"]["bytes_per_s"]
+        total["total_pps"] += s["rates"]["total_packets_per_s"]
+        total["handler_busy"].append(s["rates"]["handler_busy"])
+        if s.get("load"):
+            total["load"].append(s["load"]["level"])
+        total["sessions"] += s["sessions"]["active"]
+        sock = s.get("socket") or {}
+        if sock.get("inode") is None or sock["inode"] not in inodes:
+            inodes.add(sock.get("inode"))
+            total["drops"] += sock.get("drops") or 0
+            total["rx_queue"] += sock.get("rx_queue_bytes") or 0
+        total["devices"].update(s["devices"])
+        for k, v in (s.get("admission") or {}).items():
+            if k != "policy":
+                total["admission"][k] = total["admission"].get(k, 0) + v
+    return total
+
+
+def show(path, max_devices=10):
+    snaps = load_snapshots(path)
+    if not snaps:
+        print(f"no stats at {path} (is the server running with --stats-file?)")
+        return
+    t = merge(snaps)
+    age = time.time() - t["time"]
+    print(f"STATS :: {t['workers']} WORKER(S) :: {age:.1f}s OLD :: {t['sessions']} ACTIVE SESSIONS :: "
+          f"{t['total_pps']:.1f} PKT/S :: {t['bytes_per_s'] / 1e3:.1f} KB/S :: "
+          f"HANDLER BUSY {' '.join(f'{b * 100:.1f}%' for b in t['handler_busy'])}"
+          + (f" :: ACK LOAD {' '.join(map(str, t['load']))}" if t["load"] else ""))
+    print("  PKT/S  :: " + " :: ".join(f"{k} {v:.1f}" for k, v in sorted(t["pps"].items())))
+    print("  TOTAL  :: " + " :: ".join(f"{k} {v}" for k, v in sorted(t["packets"].items())))
+    print(f"  SOCKET :: DROPS {t['drops']} :: RX QUEUE {t['rx_queue']} B")
+    if t["admission"]:
+        a = t["admission"]
+        print(f"  ADMISSION :: SHED DATA {a['shed_global'] + a['shed_device']} (GLOBAL {a['shed_global']}, DEVICE {a['shed_device']}) :: "
+              f"SHED OTHER {a['shed_other']} :: ACK ONLY {a['acked_only']} :: SAMPLED {a['sampled']}")
+    devices = sorted(t["devices"].items(), key=lambda kv: (-kv[1]["missing"], int(kv[0])))
+    for device_id, d in devices[:max_devices]:
+        print(f"  DEVICE {device_id} :: DATA {d['data']} :: MISSING {d['missing']} ({d['loss_pct']:.2f}%) :: "
+              f"GAPS {d['gaps']} :: DUP {d['dups']} :: SHED {d.get('shed', 0)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the live stats of a running udp_server.py")
+    parser.add_argument("path", nargs="?", default="server_stats.json", help="the server's --stats-file")
+    parser.add_argument("--watch", type=float, default=0, help="refresh every this many seconds")
+    parser.add_argument("--devices", type=int, default=10, help="devices to list, most missing ids first")
+    args = parser.parse_args()
+    try:
+        while True:
+            show(args.path, args.devices)
+            if args.watch <= 0:
+                break
+            time.sleep(args.watch)
+            print()
+    except KeyboardInterrupt:
+        pass
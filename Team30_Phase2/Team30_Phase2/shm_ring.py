@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# Shared-memory ring between the server's ingest process and its processors.
+#
+# The ingest process only receives: every datagram is recvfrom_into'd straight
+# into the next free slot of a fixed-size ring in multiprocessing.shared_memory,
+# stamped with its arrival time, the sender address and the processor it
+# belongs to (device_id % processors, so a device always lands on the same
+# processor and its session lives there). Nothing else happens on that path,
+# so a slow print or a big batch decode in a processor no longer backs up the
+# kernel socket buffer, the ring takes up the slack.
+#
+# Single producer, several consumers. Every processor has its own read cursor
+# and walks every slot, skipping the ones for other processors (one small
+# unpack). A processor hands the datagram to the server as a memoryview of the
+# slot, no copy, and only moves its cursor on once the whole batch has been
+# handled, so the producer never reuses a slot somebody may still be reading.
+# The producer writes the slots of a receive batch first and publishes the new
+# write index after (aligned 8 byte stores, which x86-64/arm64 do in one go).
+#
+# Ring full (the slowest processor is `slots` packets behind): the datagram is
+# received into a scratch buffer and counted as an overrun, the socket is
+# always drained. Datagrams bigger than a slot are counted as oversize.
+#
+# Processors with nothing to do sleep on a pipe: they raise their `sleeping`
+# flag, check the ring once more and select() on the pipe (with their tick as
+# timeout), the producer writes a byte to the pipe of every sleeping processor
+# after it published a batch.
+#
+# Layout: control block (write index + counters), one 64 byte line per
+# consumer (read cursor, sleeping flag, handled), then the slots:
+#   SLOT_HDR (arrival, length, shard, IPv4, port) + data
+
+import os, select, socket, struct
+from multiprocessing import shared_memory
+
+CTRL = struct.Struct("<Q Q Q Q Q Q Q Q")   # write, puts, overruns, oversize, high_water, slots, slot_size, consumers
+CTRL_SIZE = 64
+CONS = struct.Struct("<Q Q Q")             # read cursor, sleeping, handled
+CONS_SIZE = 64
+U64 = struct.Struct("<Q")
+SLOT_HDR = struct.Struct("<d H H 4s H")     # arrival, length, shard, ip, port
+SLOT_HDR_SIZE = 24
+
+W_WRITE, W_PUTS, W_OVERRUNS, W_OVERSIZE, W_HIGH = 0, 8, 16, 24, 32
+C_READ, C_SLEEPING, C_HANDLED = 0, 8, 16
+
+DEFAULT_SLOTS = 16384
+DEFAULT_SLOT_SIZE = 2048      # slot incl. its header, datagrams up to 2024 bytes
+
+
+class ShmRing:
+    def __init__(self, consumers, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE):
+        # created by the ingest process before it forks the processors, they inherit it
+        if slot_size <= SLOT_HDR_SIZE or slot_size - SLOT_HDR_SIZE > 0xFFFF:
+            raise ValueError(f"slot size must be between {SLOT_HDR_SIZE + 1} and {SLOT_HDR_SIZE + 0xFFFF}")
+        self.consumers = consumers
+        self.slots = slots
+        self.slot_size = slot_size
+        self.data_off = CTRL_SIZE + CONS_SIZE * consumers
+        self.shm = shared_memory.SharedMemory(create=True, size=self.data_off + slots * slot_size)
+        self.buf = self.shm.buf
+        self.buf[:self.data_off] = bytes(self.data_off)
+        CTRL.pack_into(self.buf, 0, 0, 0, 0, 0, 0, slots, slot_size, consumers)
+        self.wake = [os.pipe() for _ in range(consumers)]
+        for r, w in self.wake:
+            os.set_blocking(w, False)
+            os.set_blocking(r, False)
+        # producer side
+        self.write = 0
+        self.limit = slots            # write may go up to this before the cursors are looked at again
+        self.scratch = bytearray(65536)
+        self.puts = self.overruns = self.oversize = self.high_water = 0
+
+    def close(self, unlink=False):
+        self.buf = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass   # a view is still around somewhere, the mapping goes with the process
+        if unlink:
+            self.shm.unlink()
+
+    # --- producer (ingest) ---
+
+    def min_read(self):
+        return min(U64.unpack_from(self.buf, CTRL_SIZE + CONS_SIZE * k + C_READ)[0] for k in range(self.consumers))
+
+    def recv_into(self, sock, arrival_time):
+        # one datagram from sock into the next slot (or counted as overrun/oversize),
+        # raises BlockingIOError when the socket is empty. Not visible before publish().
+        w = self.write
+        if w >= self.limit:
+            self.limit = self.min_read() + self.slots
+            if w >= self.limit:
+                sock.recvfrom_into(self.scratch, 0, socket.MSG_DONTWAIT)
+                self.overruns += 1
+                return
+        off = self.data_off + (w % self.slots) * self.slot_size
+        cap = self.slot_size - SLOT_HDR_SIZE
+        n, addr = sock.recvfrom_into(self.buf[off + SLOT_HDR_SIZE: off + self.slot_size], cap,
+                                     socket.MSG_DONTWAIT | socket.MSG_TRUNC)
+        if n > cap:
+            self.oversize += 1
+            return
+        # device_id is bytes 1-2 of the ITP header, it picks the processor
+        shard = ((self.buf[off + SLOT_HDR_SIZE + 1] << 8) | self.buf[off + SLOT_HDR_SIZE + 2]) % self.consumers if n >= 3 else 0
+        SLOT_HDR.pack_into(self.buf, off, arrival_time, n, shard, socket.inet_aton(addr[0]), addr[1])
+        self.write = w + 1
+        self.puts += 1
+
+    def publish(self):
+        # make everything received so far visible and wake whoever is asleep
+        buf = self.buf
+        low = self.min_read()
+        self.limit = low + self.slots
+        occupancy = self.write - low
+        if occupancy > self.high_water:
+            self.high_water = occupancy
+        CTRL.pack_into(buf, 0, self.write, self.puts, self.overruns, self.oversize, self.high_water,
+                       self.slots, self.slot_size, self.consumers)
+        for k in range(self.consumers):
+            base = CTRL_SIZE + CONS_SIZE * k
+            if U64.unpack_from(buf, base + C_SLEEPING)[0]:
+                U64.pack_into(buf, base + C_SLEEPING, 0)
+                try:
+                    os.write(self.wake[k][1], b"x")
+                except BlockingIOError:
+                    pass   # pipe full, it's awake anyway
+
+    # --- consumers (processors) ---
+
+    def drain(self, k, handle, max_batch=1024):
+        # handle(view, addr, arrival_time) for every published datagram of
+        # processor k, views are only valid during the call. Returns the number
+        # of slots walked (all processors'), 0 = nothing new.
+        buf = self.buf
+        base = CTRL_SIZE + CONS_SIZE * k
+        r = U64.unpack_from(buf, base + C_READ)[0]
+        w = min(U64.unpack_from(buf, W_WRITE)[0], r + max_batch)
+        handled = 0
+        for i in range(r, w):
+            off = self.data_off + (i % self.slots) * self.slot_size
+            arrival, n, shard, ip, port = SLOT_HDR.unpack_from(buf, off)
+            if shard != k:
+                continue
+            view = buf[off + SLOT_HDR_SIZE: off + SLOT_HDR_SIZE + n]
+            try:
+                handle(view, (socket.inet_ntoa(ip), port), arrival)
+            finally:
+                view.release()
+            handled += 1
+        if w > r:
+            U64.pack_into(buf, base + C_READ, w)
+            if handled:
+                U64.pack_into(buf, base + C_HANDLED, U64.unpack_from(buf, base + C_HANDLED)[0] + handled)
+        return w - r
+
+    def wait(self, k, timeout):
+        # sleep until the producer publishes something (or timeout)
+        buf = self.buf
+        base = CTRL_SIZE + CONS_SIZE * k
+        U64.pack_into(buf, base + C_SLEEPING, 1)
+        if U64.unpack_from(buf, W_WRITE)[0] > U64.unpack_from(buf, base + C_READ)[0]:
+            U64.pack_into(buf, base + C_SLEEPING, 0)
+            return
+        fd = self.wake[k][0]
+        if select.select([fd], [], [], timeout)[0]:
+            try:
+                os.read(fd, 4096)
+            except BlockingIOError:
+                pass
+        U64.pack_into(buf, base + C_SLEEPING, 0)
+
+    # --- anyone ---
+
+    def stats(self):
+        write, puts, overruns, oversize, high, slots, slot_size, consumers = CTRL.unpack_from(self.buf, 0)
+        cons = [CONS.unpack_from(self.buf, CTRL_SIZE + CONS_SIZE * k) for k in range(consumers)]
+        return {"slots": slots, "slot_size": slot_size, "occupancy": write - min(c[0] for c in cons),
+                "high_water": high, "received": puts, "overruns": overruns, "oversize": oversize,
+                "handled": [c[2] for c in cons]}
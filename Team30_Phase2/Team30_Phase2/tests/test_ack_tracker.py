@@ -0,0 +1,112 @@
+import random
+
+from ack_tracker import AckTracker, sack_covers, unwrap_seq
+
+
+def test_in_order_moves_cum():
+    acks = AckTracker()
+    for first in range(1, 11):
+        acks.add(first, 1)
+    assert acks.cum == 10
+    assert acks.sack_bitmap() == 0
+
+
+def test_batches_and_sack_bits():
+    acks = AckTracker()
+    acks.add(1, 4)          # 1..4
+    acks.add(8, 2)          # 8..9, 5..7 missing
+    assert acks.cum == 4
+    assert acks.sack_bitmap() == 0b11000
+    assert sack_covers(acks.cum, acks.sack_bitmap(), 8)
+    assert not sack_covers(acks.cum, acks.sack_bitmap(), 5)
+    acks.add(5, 3)
+    assert acks.cum == 9
+    assert acks.sack_bitmap() == 0
+
+
+def test_skip_to_gives_up_on_a_hole():
+    acks = AckTracker()
+    acks.add(1, 1)
+    acks.add(3, 1)
+    acks.add(4, 1)
+    assert acks.cum == 1
+    acks.skip_to(3)
+    # 2 given up, 3 and 4 had arrived
+    assert acks.cum == 4
+    assert acks.sack_bitmap() == 0
+    # a late 2 is below cum, nothing changes
+    acks.add(2, 1)
+    assert acks.cum == 4
+    # skipping backwards does nothing
+    acks.skip_to(2)
+    assert acks.cum == 4
+
+
+def test_far_ahead_slides_the_window():
+    acks = AckTracker(size=64)
+    acks.add(1, 1)
+    acks.add(100, 1)        # 2..99 missing, 100 is past size
+    assert acks.cum + 1 + 64 > 100
+    assert sack_covers(acks.cum, acks.sack_bitmap(), 100)
+    assert not sack_covers(acks.cum, acks.sack_bitmap(), acks.cum + 1)
+
+
+def test_lossy_stream_is_fully_covered():
+    # best effort client, 10% loss, the server gives up on every hole it
+    # delivers past (what the reorder buffer does): everything that arrived
+    # has to be covered by the last ACK, and cum has to keep up
+    rng = random.Random(7)
+    acks = AckTracker()
+    received = []
+    expected = 1
+    for seq in range(1, 3001):
+        if rng.random() < 0.1:
+            continue
+        received.append(seq)
+        acks.add(seq, 1)
+        if seq > expected:
+            acks.skip_to(seq)
+        expected = seq + 1
+    cum, bitmap = acks.cum, acks.sack_bitmap()
+    assert cum == received[-1]
+    assert all(sack_covers(cum, bitmap, s) for s in received)
+
+
+def test_lossy_stream_without_give_up_still_moves():
+    # no reorder buffer help at all: the tracked range alone has to keep cum
+    # within `size` of the newest id
+    rng = random.Random(11)
+    acks = AckTracker(size=256)
+    for seq in range(1, 5001):
+        if rng.random() >= 0.1:
+            acks.add(seq, 1)
+    assert acks.cum > 5000 - 256
+
+
+def test_unwrap_seq_across_16_bits():
+    assert unwrap_seq(65535, 65530) == 65535
+    assert unwrap_seq(2, 65534) == 65538
+    assert unwrap_seq(65534, 65538) == 65534
+
+
+def test_lossy_cumulative_acks_across_the_wrap():
+    # the ACK header only carries cum & 0xFFFF, the client unwraps it against
+    # its next id: the progress it sees has to go on past 65535
+    rng = random.Random(5)
+    acks = AckTracker()
+    acks.reset(cum=65400)
+    expected = 65401
+    seen = []
+    for ext in range(65401, 65801):
+        if rng.random() < 0.1:
+            continue
+        acks.add(unwrap_seq(ext & 0xFFFF, acks.cum + 1), 1)
+        if ext > expected:
+            acks.skip_to(ext)
+        expected = ext + 1
+        client_cum = unwrap_seq(acks.cum & 0xFFFF, ext + 1)
+        assert client_cum == acks.cum
+        seen.append(client_cum)
+    assert seen == sorted(seen)
+    assert seen[-1] == acks.cum > 65536
+    assert acks.sack_bitmap() == 0
@@ -0,0 +1,65 @@
+from clock_sync import ClockEstimator, MIN_SAMPLES, STARTUP_INTERVAL, heartbeat_interval
+
+
+def exchange(clock, t1, out_delay, back_delay, offset=0.0, turnaround=0.0001):
+    # one INIT/HEARTBEAT exchange with the server clock `offset` ahead
+    t2 = t1 + out_delay + offset
+    t3 = t2 + turnaround
+    t4 = t3 - offset + back_delay
+    return clock.add(t1, t2, t3, t4)
+
+
+def test_no_offset_before_min_samples():
+    clock = ClockEstimator()
+    for i in range(MIN_SAMPLES - 1):
+        assert exchange(clock, 100.0 + i, 0.00005, 0.00005)
+        assert clock.at(100.0 + i) is None
+    exchange(clock, 110.0, 0.00005, 0.00005)
+    assert abs(clock.at(110.0)) < 1e-9
+
+
+def test_lowest_delay_sample_wins():
+    # loopback: a first exchange whose ACK was read 2 ms late is off by 1 ms,
+    # the quick ones after it aren't
+    clock = ClockEstimator()
+    exchange(clock, 100.0, 0.00005, 0.002)
+    for i in range(1, MIN_SAMPLES):
+        exchange(clock, 100.0 + i * STARTUP_INTERVAL, 0.00005, 0.00006)
+    assert abs(clock.at(101.0)) < 0.00001
+    assert clock.error < 0.0001
+
+
+def test_offset_and_drift():
+    clock = ClockEstimator()
+    skew, ppm = 1.5, 200e-6
+    for i in range(20):
+        t = 1000.0 + i * 3
+        exchange(clock, t, 0.001, 0.001 + (0.004 if i % 3 == 0 else 0), offset=skew + ppm * (t - 1000.0))
+    assert abs(clock.at(1060.0) - (skew + ppm * 60)) < 0.0005
+    assert abs(clock.drift - ppm) < 20e-6
+
+
+def test_repeated_and_bad_samples():
+    clock = ClockEstimator()
+    assert clock.add(100.0, 100.1, 100.1001, 100.2)
+    # the same sample again (its heartbeat ACK got lost) doesn't count twice
+    assert not clock.add(100.0, 100.1, 100.1001, 100.2)
+    assert clock.count == 1
+    # t4 before t1
+    assert not clock.add(100.0, 100.1, 100.1001, 99.0)
+    assert clock.rejected == 1
+
+
+def test_heartbeat_interval():
+    assert heartbeat_interval(0, 3) == STARTUP_INTERVAL
+    assert heartbeat_interval(MIN_SAMPLES - 1, 3) == STARTUP_INTERVAL
+    assert heartbeat_interval(MIN_SAMPLES, 3) == 3
+
+
+def test_offset_within_error_is_zero():
+    # synced clocks, the ACK path a bit slower than the DATA path
+    clock = ClockEstimator()
+    for i in range(MIN_SAMPLES):
+        exchange(clock, 100.0 + i * STARTUP_INTERVAL, 0.0001, 0.0004)
+    assert clock.error > 0.00015
+    assert clock.at(101.0) == 0.0
@@ -0,0 +1,72 @@
+import json, zlib
+
+import pytest
+
+from payload_codec import (CODEC_JSON, CODEC_F32, CODEC_F16, PACKED_HDR, encode_batch, decode_packed,
+                           encode_zdelta, decode_zdelta, ZDELTA_HDR, ZDELTA_WBITS, ZDELTA_MEMLEVEL, ZDICT,
+                           choose_codec, choose_compress, COMPRESS_ZDELTA)
+
+
+def test_zdelta_round_trip():
+    values = [25.0 + (i * 7 % 13) / 100 for i in range(200)]
+    first_id, count, out, unit, ids, _ = decode_zdelta(encode_zdelta(1000, values, "F"))
+    assert (first_id, count, unit) == (1000, 200, "F")
+    assert out == pytest.approx(values)
+    assert ids == list(range(1000, 1200))
+
+
+def test_zdelta_rejects_a_body_that_inflates_past_count():
+    # a few KB on the wire, megabytes inflated: has to stop at count's worth
+    comp = zlib.compressobj(9, zlib.DEFLATED, -ZDELTA_WBITS, ZDELTA_MEMLEVEL, zdict=ZDICT)
+    bomb = ZDELTA_HDR.pack(1, 2, 0, 2) + comp.compress(b"\x00" * 5_000_000) + comp.flush()
+    assert len(bomb) < 8000
+    with pytest.raises(ValueError):
+        decode_zdelta(bomb)
+
+
+def test_zdelta_rejects_a_cut_off_stream():
+    payload = encode_zdelta(1, [20.0 + i for i in range(100)])
+    with pytest.raises(ValueError):
+        decode_zdelta(payload[:-4])
+
+
+@pytest.mark.parametrize("codec", [CODEC_F32, CODEC_F16])
+def test_packed_round_trip(codec):
+    values = [20.5, -3.25, 0.0, 1000.0, 21.75]
+    payload = encode_batch(codec, 70000, values, "K")
+    first_id, count, out, unit = decode_packed(bytes(payload))
+    assert (first_id, count, unit) == (70000, 5, "K")
+    assert list(out) == values
+
+
+def test_packed_decode_copies_out_of_the_buffer():
+    # the server hands in ring slots that get reused right after
+    buf = bytearray(encode_batch(CODEC_F16, 1, [1.5, 2.5]))
+    _, _, values, _ = decode_packed(memoryview(buf))
+    buf[PACKED_HDR.size:] = bytes(4)
+    assert list(values) == [1.5, 2.5]
+
+
+@pytest.mark.parametrize("codec", [CODEC_F32, CODEC_F16])
+def test_packed_rejects_a_wrong_length(codec):
+    payload = encode_batch(codec, 1, [1.0, 2.0, 3.0])
+    with pytest.raises(ValueError):
+        decode_packed(payload[:-1])
+    with pytest.raises(ValueError):
+        decode_packed(payload + b"\x00\x00\x00\x00")
+
+
+def test_json_batch_round_trip():
+    payload = json.loads(encode_batch(CODEC_JSON, 5, [1.0, 2.0], "C"))
+    assert [r["reading_id"] for r in payload["batch"]] == [5, 6]
+
+
+def test_codec_negotiation():
+    assert choose_codec(["f16", "f32"]) == CODEC_F16
+    assert choose_codec(["cbor", "f32"]) == CODEC_F32
+    # an old client that doesn't ask, or asks for something odd, gets json
+    assert choose_codec(None) == CODEC_JSON
+    assert choose_codec("f32") == CODEC_JSON
+    assert choose_codec(["cbor"]) == CODEC_JSON
+    assert choose_compress(["lz4", COMPRESS_ZDELTA]) == COMPRESS_ZDELTA
+    assert choose_compress(None) is None
@@ -0,0 +1,43 @@
+import json, struct
+
+from pcap_analysis import PcapAnalysis, port_for, HDR, MSG_INIT, MSG_DATA
+
+
+def write_pcap(path, packets, port):
+    # Linux cooked (v1) capture of client -> server datagrams, packets: (msgtype, device_id, seq)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 113))
+        t = 1000.0
+        for msgtype, device_id, seq in packets:
+            payload = HDR.pack(0x10 | msgtype, device_id, seq, t)
+            udp = struct.pack("!HHHH", 40000, port, 8 + len(payload), 0) + payload
+            ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+                             b"\x7f\0\0\1", b"\x7f\0\0\1") + udp
+            sll = struct.pack("!HHH8sH", 0, 772, 0, b"", 0x0800) + ip
+            f.write(struct.pack("<IIII", int(t), int(t % 1 * 1e6), len(sll), len(sll)) + sll)
+            t += 0.001
+
+
+def test_port_from_the_cell_manifest(tmp_path):
+    pcap = tmp_path / "loss_b1_d1_run1_trace.pcap"
+    write_pcap(pcap, [(MSG_DATA, 7, s) for s in range(1, 11)], 5102)
+    assert port_for(str(pcap), 5005) == 5005
+    assert PcapAnalysis(5005).run(str(pcap)).stats["itp"] == 0
+    (tmp_path / "loss_b1_d1_run1_cell.json").write_text(json.dumps({"server_port": 5102}))
+    assert port_for(str(pcap), 5005) == 5102
+    assert PcapAnalysis(port_for(str(pcap))).run(str(pcap)).stats["itp"] == 10
+
+
+def test_loss_counted_across_a_restart(tmp_path):
+    # session 1: 1..100, INIT, session 2: 1..50, 1 in 10 lost in both
+    pkts = [(MSG_DATA, 7, s) for s in range(1, 101) if s % 10 != 5]
+    pkts.append((MSG_INIT, 7, 0))
+    pkts += [(MSG_DATA, 7, s) for s in range(1, 51) if s % 10 != 5]
+    pcap = tmp_path / "x_trace.pcap"
+    write_pcap(pcap, pkts, 5005)
+    analysis = PcapAnalysis(5005).run(str(pcap))
+    row = analysis.rows()[0]
+    assert analysis.stats["restarts"] == 1
+    assert row["unique"] == 135
+    assert row["expected"] == 150
+    assert row["wire_lost"] == 15
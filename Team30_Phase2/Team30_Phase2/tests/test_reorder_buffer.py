@@ -0,0 +1,92 @@
+from reorder_buffer import ReorderBuffer
+
+
+class Session:
+    # what the server does with a delivered packet: expect the one after it
+    def __init__(self, **kw):
+        self.next = {}
+        self.out = []
+        self.buf = ReorderBuffer(self.deliver, self.expected, **kw)
+
+    def deliver(self, key, seq):
+        self.out.append(seq)
+        self.next[key] = max(self.next.get(key, 1), seq + 1)
+
+    def expected(self, key):
+        return self.next.get(key, 1)
+
+    def add(self, seq, now, key=1, jitter=0.0):
+        self.buf.add(key, seq, seq, now, jitter)
+
+
+def test_in_order_goes_straight_through():
+    s = Session()
+    for seq in range(1, 6):
+        s.add(seq, 0.0)
+    assert s.out == [1, 2, 3, 4, 5]
+    assert s.buf.held == 0 and s.buf.stats["held"] == 0
+
+
+def test_reordered_packets_released_in_order():
+    s = Session()
+    s.add(1, 0.0)
+    s.add(3, 0.001)
+    s.add(4, 0.002)
+    assert s.out == [1]
+    s.add(2, 0.003)
+    assert s.out == [1, 2, 3, 4]
+    assert s.buf.stats["reordered"] == 2
+    assert s.buf.stats["real_gaps"] == 0
+    assert s.buf.held == 0 and not s.buf.heaps
+
+
+def test_hole_given_up_after_the_hold_time():
+    s = Session(min_hold=0.01, max_hold=0.3)
+    s.add(1, 0.0)
+    s.add(3, 0.0, jitter=0.01)      # held 4 * 10 ms
+    s.buf.tick(0.03)
+    assert s.out == [1]
+    s.buf.tick(0.04)
+    assert s.out == [1, 3]
+    assert s.buf.stats["real_gaps"] == 1
+    # the late 2 is delivered as it is, the server calls it a dup/late arrival
+    s.add(2, 0.05)
+    assert s.out == [1, 3, 2]
+
+
+def test_hold_time_is_clamped():
+    buf = ReorderBuffer(None, None, max_hold=0.3, min_hold=0.01, jitter_mult=4.0)
+    assert buf.hold_time(0.0) == 0.01
+    assert buf.hold_time(0.02) == 0.08
+    assert buf.hold_time(1.0) == 0.3
+
+
+def test_overflow_delivers_unbuffered():
+    s = Session(max_packets=2)
+    s.add(5, 0.0)
+    s.add(6, 0.0)
+    s.add(7, 0.0)
+    assert s.out == [7]
+    assert s.buf.stats["overflow"] == 1
+    assert s.buf.held == 2
+
+
+def test_sessions_are_separate_and_flush():
+    s = Session()
+    s.add(1, 0.0, key=1)
+    s.add(3, 0.0, key=1)
+    s.add(2, 0.0, key=2)
+    s.add(5, 0.0, key=2)
+    s.buf.flush(1)
+    assert s.out == [1, 3]
+    assert 1 not in s.buf.heaps and 2 in s.buf.heaps
+    s.buf.flush_all()
+    assert s.out == [1, 3, 2, 5]
+    assert s.buf.held == 0
+
+
+def test_disabled_with_zero_hold():
+    s = Session(max_hold=0)
+    s.add(3, 0.0)
+    s.add(1, 0.0)
+    assert s.out == [3, 1]
@@ -0,0 +1,49 @@
+from send_window import SendWindow, RtoEstimator
+
+
+def test_best_effort_forgets_unacked_after_rto():
+    window = SendWindow(rto=RtoEstimator(initial=1.0), retransmit=False)
+    for seq in range(1, 101):
+        window.sent(seq, 1, b"x", seq * 0.1)
+    # ACKs for every other packet, the rest are lost
+    window.ack(range(2, 101, 2), 10.5)
+    assert len(window) == 50
+    assert window.due(10.5) == []
+    # the odd ones sent at <= 9.5 are past their 1 s RTO at 10.5, 97 and 99 aren't
+    assert sorted(window) == [97, 99]
+    assert window.stats["expired"] == 48
+    assert window.stats["loss_hints"] == 48
+
+
+def test_best_effort_window_stays_bounded():
+    window = SendWindow(rto=RtoEstimator(initial=0.5), retransmit=False)
+    for seq in range(1, 10001):
+        now = seq * 0.01
+        window.sent(seq, 1, b"x", now)
+        if seq % 10:
+            window.ack([seq], now)
+        window.due(now)
+        assert len(window) <= 6
+
+
+def test_fast_retransmit_after_dup_thresh_later_acks():
+    window = SendWindow(4, RtoEstimator(initial=10.0), dup_thresh=3)
+    for seq in range(1, 5):
+        window.sent(seq, 1, bytes([seq]), 0.0)
+    window.ack([2], 0.1)
+    window.ack([3], 0.1)
+    assert window.due(0.2) == []
+    window.ack([4], 0.1)
+    assert window.due(0.2) == [(1, b"\x01")]
+    assert window.stats["fast"] == 1
+
+
+def test_timeout_retransmit_backs_off_and_gives_up():
+    window = SendWindow(1, RtoEstimator(initial=1.0, min_rto=1.0), backoff=2, max_retries=2)
+    window.sent(1, 1, b"p", 0.0)
+    assert window.due(0.5) == []
+    assert window.due(1.0) == [(1, b"p")]
+    assert window.due(2.9) == []          # next deadline 1.0 + 1.0 * 2
+    assert window.due(3.0) == [(1, b"p")]
+    assert window.due(100.0) == []        # out of retries
+    assert window.stats["failed"] == 1 and len(window) == 0
@@ -0,0 +1,67 @@
+from seq_window import SeqWindow, seq_delta, SEQ_NEW, SEQ_DUPLICATE, SEQ_STALE, SEQ_MOD
+
+
+def test_seq_delta_on_the_circle():
+    assert seq_delta(5, 3) == 2
+    assert seq_delta(3, 5) == -2
+    assert seq_delta(1, 65535) == 2
+    assert seq_delta(65535, 1) == -2
+    assert seq_delta(32767, 0) == 32767
+    assert seq_delta(32768, 0) == -32768
+
+
+def test_new_duplicate_and_stale():
+    w = SeqWindow(size=64)
+    assert w.mark(w.extend(10)) == SEQ_NEW
+    assert w.mark(w.extend(12)) == SEQ_NEW
+    assert w.mark(w.extend(10)) == SEQ_DUPLICATE
+    # the hole fills late
+    assert w.mark(w.extend(11)) == SEQ_NEW
+    assert w.mark(w.extend(11)) == SEQ_DUPLICATE
+    assert w.seen(11) and not w.seen(13)
+    w.mark(w.extend(100))
+    # 12 is 88 behind the highest, past the 64 the window remembers
+    assert w.mark(w.extend(12)) == SEQ_STALE
+    assert not w.seen(12)
+
+
+def test_wraps_around_65535():
+    w = SeqWindow(size=64)
+    ext = []
+    for i in range(65530, 65540):
+        ext.append(w.extend(i % SEQ_MOD))
+        assert w.mark(ext[-1]) == SEQ_NEW
+    # wire seqs 0..3 after 65535 keep counting up
+    assert ext == list(range(65530, 65540))
+    assert w.highest == 65539
+    # a late 65534 and a repeated 2 are told apart across the wrap
+    assert w.extend(65534) == 65534
+    assert w.mark(w.extend(65534)) == SEQ_DUPLICATE
+    assert w.mark(w.extend(2)) == SEQ_DUPLICATE
+
+
+def test_reordered_across_the_wrap():
+    w = SeqWindow(size=64)
+    w.mark(w.extend(65533))
+    w.mark(w.extend(1))        # 65537, 65534..65536 still missing
+    assert w.highest == 65537
+    for seq in (65535, 0, 65534):
+        assert w.mark(w.extend(seq)) == SEQ_NEW
+    assert all(w.seen(s) for s in range(65533, 65538))
+
+
+def test_many_wraps_stay_bounded():
+    w = SeqWindow(size=64)
+    for i in range(3 * SEQ_MOD):
+        assert w.mark(w.extend(i % SEQ_MOD)) == SEQ_NEW
+    assert w.highest == 3 * SEQ_MOD - 1
+    assert w.bitmap == w.mask
+
+
+def test_reset():
+    w = SeqWindow()
+    w.mark(w.extend(500))
+    w.reset()
+    # no anchor any more, the next seq is taken as is
+    assert w.extend(7) == 7
+    assert w.mark(7) == SEQ_NEW
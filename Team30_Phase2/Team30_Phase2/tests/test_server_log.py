@@ -0,0 +1,72 @@
+import io
+
+from server_log import ServerLog, DataSummary, TsFormatter, INFO, WARN
+
+
+def lines_of(log, stream):
+    log.close()
+    return stream.getvalue().splitlines()
+
+
+def test_limited_burst_then_rate():
+    out = io.StringIO()
+    log = ServerLog(stream=out, event_rate=2.0, event_burst=3.0)
+    # 10 at once: the burst of 3 gets through, 7 are suppressed
+    for i in range(10):
+        log.limited("dup", WARN, 100.0, "dup %d", i)
+    # half a second later the bucket has one token again
+    log.limited("dup", WARN, 100.5, "dup %d", 10)
+    log.limited("dup", WARN, 100.5, "dup %d", 11)
+    lines = lines_of(log, out)
+    assert [l.split("] ", 1)[1] for l in lines] == ["dup 0", "dup 1", "dup 2", "dup 10 (+7 similar suppressed)"]
+
+
+def test_suppressed_count_resets_and_events_are_separate():
+    out = io.StringIO()
+    log = ServerLog(stream=out, event_rate=1.0, event_burst=1.0)
+    log.limited("gap", WARN, 10.0, "gap")
+    log.limited("gap", WARN, 10.1, "gap")
+    log.limited("dup", WARN, 10.1, "dup")       # its own bucket
+    log.limited("gap", WARN, 11.2, "gap")
+    log.limited("gap", WARN, 12.3, "gap")
+    msgs = [l.split("] ", 1)[1] for l in lines_of(log, out)]
+    assert msgs == ["gap", "dup", "gap (+1 similar suppressed)", "gap"]
+
+
+def test_limited_below_level_costs_no_tokens():
+    out = io.StringIO()
+    log = ServerLog(level=WARN, stream=out, event_rate=1.0, event_burst=1.0)
+    for _ in range(5):
+        log.limited("hb", INFO, 10.0, "heartbeat")
+    log.limited("hb", WARN, 10.0, "late heartbeat")
+    assert [l.split("] ", 1)[1] for l in lines_of(log, out)] == ["late heartbeat"]
+
+
+def test_levels_and_lazy_formatting():
+    out = io.StringIO()
+    log = ServerLog(level=INFO, stream=out)
+    log.debug(1.0, "hidden %d", 1)
+    log.info(1.0, "seq=%d codec=%s", 5, "f32")
+    log.error(1.0, "100% literal")      # no args, not %-formatted
+    msgs = [l.split("] ", 1)[1] for l in lines_of(log, out)]
+    assert msgs == ["seq=5 codec=f32", "100% literal"]
+
+
+def test_ts_formatter_matches_strftime():
+    import datetime
+    fmt = TsFormatter()
+    for t in (1700000000.25, 1700000000.999999, 1700000001.0):
+        assert fmt(t) == datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def test_data_summary_one_line_per_interval():
+    out = io.StringIO()
+    log = ServerLog(stream=out)
+    summary = DataSummary(log, interval=1.0)
+    for i in range(5):
+        summary.add(10.0 + i * 0.1, 7, i + 1, 2, 30, gap=(i == 3))
+    summary.flush(10.5)          # not due yet
+    summary.flush(11.0)
+    msgs = [l.split("] ", 1)[1] for l in lines_of(log, out)]
+    assert len(msgs) == 1
+    assert "DEVICE 7 :: PACKETS 5 :: SEQ 1-5 :: READINGS 10 :: BYTES 150 :: GAPS 1" in msgs[0]
@@ -0,0 +1,48 @@
+from timer_wheel import TimerWheel
+
+
+def test_fires_once_at_its_tick():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule("a", 3.0)
+    wheel.schedule("b", 2.5)
+    assert wheel.advance(1.9) == []
+    assert wheel.advance(2.9) == []
+    assert sorted(wheel.advance(3.0)) == ["a", "b"]
+    assert len(wheel) == 0
+    assert wheel.advance(10.0) == []
+
+
+def test_reschedule_and_cancel():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule("a", 2.0)
+    wheel.schedule("b", 2.0)
+    wheel.schedule("a", 5.0)    # re-armed, only the later one counts
+    wheel.cancel("b")
+    wheel.cancel("missing")
+    assert wheel.advance(4.0) == []
+    assert wheel.advance(5.0) == ["a"]
+
+
+def test_past_deadline_fires_on_the_next_tick():
+    wheel = TimerWheel(tick=1.0, slots=8, now=10.0)
+    wheel.schedule("late", 3.0)
+    assert wheel.advance(10.5) == []
+    assert wheel.advance(11.0) == ["late"]
+
+
+def test_further_than_one_turn():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule("far", 20.0)     # same bucket as tick 4 and 12
+    assert wheel.advance(4.0) == []
+    assert wheel.advance(12.0) == []
+    assert len(wheel) == 1
+    assert wheel.advance(20.0) == ["far"]
+
+
+def test_long_stall_fires_everything_due():
+    wheel = TimerWheel(tick=0.5, slots=16)
+    for i in range(100):
+        wheel.schedule(i, 1.0 + i * 0.25)
+    fired = wheel.advance(100.0)
+    assert sorted(fired) == list(range(100))
+    assert len(wheel) == 0
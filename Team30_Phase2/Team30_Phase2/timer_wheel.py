@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# Hashed timer wheel for per-session timeouts.
+#
+# `slots` buckets of `tick` seconds each. A key scheduled for time `when` goes
+# into bucket (tick number % slots) together with its absolute tick number, so
+# deadlines further away than one turn of the wheel just wait in their bucket
+# until their turn comes round. advance() only looks at the buckets the clock
+# moved past, so the cost of a sweep depends on how many timers are due, not on
+# how many sessions exist.
+#
+# The server uses it lazily: packets only update session["last_seen"], and when
+# a session's timer fires it either expires or gets re-armed at its real deadline.
+
+import math
+
+
+class TimerWheel:
+    def __init__(self, tick=1.0, slots=256, now=0.0):
+        self.tick = tick
+        self.n = slots
+        self.slots = [{} for _ in range(slots)]
+        self.current = int(now / tick)   # last tick processed
+        self._where = {}                 # key -> the bucket it's in
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, when):
+        # (re)arm the timer for key, fires on the first advance() at/after `when`
+        t = max(int(math.ceil(when / self.tick)), self.current + 1)
+        self.cancel(key)
+        slot = self.slots[t % self.n]
+        slot[key] = t
+        self._where[key] = slot
+
+    def cancel(self, key):
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def advance(self, now):
+        # move the clock to `now`, returns the keys whose timer fired
+        target = int(now / self.tick)
+        if target <= self.current:
+            return []
+        expired = []
+        # after a long stall one full turn still visits every bucket
+        for t in range(max(self.current + 1, target - self.n + 1), target + 1):
+            slot = self.slots[t % self.n]
+            if not slot:
+                continue
+            due = [key for key, key_t in slot.items() if key_t <= target]
+            for key in due:
+                del slot[key]
+                del self._where[key]
+            expired.extend(due)
+        self.current = target
+        return expired
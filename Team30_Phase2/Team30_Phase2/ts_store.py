@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+
+# Per-device time-series store for the readings in DATA payloads.
+#
+# Every device's readings are appended to fixed-size column chunks of
+# CHUNK_READINGS readings: time (d), value (d), reading_id (I) and unit code (B)
+# side by side, 21 bytes a reading against the ~400 of a {"reading_id",
+# "value", "unit"} dict. A batch is written with one slice assignment per
+# column (small ones reading by reading), so appending is O(1) amortized per
+# reading. A reading's time is its
+# packet's client timestamp moved to the server clock (clock_sync.py), or the
+# arrival time until the first clock sample.
+#
+# The chunks are carved out of SEGMENT_BYTES mmaps: sparse files under the
+# store dir (--ts-dir), or anonymous maps without one. The columns are typed
+# memoryviews straight into the map, so the readings live in the page cache
+# rather than on the Python heap, a persistent store survives a restart (the
+# chunk headers are synced every SYNC_INTERVAL) and this script can read a
+# running server's store from its files. Once every chunk of a segment is past
+# the retention the whole segment is unmapped and deleted.
+#
+# Range queries: per device the chunks are kept oldest first with a running max
+# of their end times, a bisect finds the first chunk that can hold the start of
+# the range and within a chunk whose times only go up another bisect finds the
+# readings (reordered packets just make a chunk fall back to a scan).
+#
+# Rollups: count/min/max/sum per device per ROLLUP_SECONDS bucket, updated with
+# every batch and kept for much longer than the raw readings. They are saved
+# as json on close, on load anything after the save time is rebuilt from the
+# raw chunks (after a crash too).
+#
+# Layout of a chunk: CHUNK_HDR, then times, values, ids, units for `capacity` readings.
+#
+# Reading a store:
+#   python3 ts_store.py ts_data                                  # devices in the store
+#   python3 ts_store.py ts_data --device 7 --since 3600          # raw readings, last hour
+#   python3 ts_store.py ts_data --device 7 --since 86400 --bucket 300
+
+import os, mmap, glob, json, time, struct, argparse, datetime, csv, sys
+from array import array
+from bisect import bisect_left, bisect_right
+from payload_codec import UNIT_CODES, UNIT_NAMES
+
+CHUNK_HDR = struct.Struct("<4s I I I d d")   # magic, device_id, capacity, count, t_min, t_max
+CHUNK_MAGIC = b"TSC1"
+CHUNK_MAGIC_DEAD = b"TSC0"   # evicted, its segment is still in use
+CHUNK_READINGS = 1024
+# batches up to this size are written reading by reading, building the column
+# arrays for a slice assignment costs more than that for a few readings
+SMALL_BATCH = 16
+SEGMENT_BYTES = 16 << 20
+SEGMENT_GLOB = "seg*.ts"
+ROLLUP_FILE = "rollups.json"
+
+ROLLUP_SECONDS = 60
+RAW_RETENTION = 3600.0
+ROLLUP_RETENTION = 7 * 86400.0
+SYNC_INTERVAL = 1.0
+EVICT_INTERVAL = 10.0
+
+NO_UNIT = 255
+ID_MASK = 0xFFFFFFFF
+INF = float("inf")
+
+
+def chunk_bytes(capacity):
+    return CHUNK_HDR.size + 21 * capacity
+
+
+class Segment:
+    # one fixed-size map that chunks are carved from
+    def __init__(self, path=None, size=SEGMENT_BYTES, readonly=False):
+        self.path = path
+        if path is None:
+            self.mm = mmap.mmap(-1, size)
+        else:
+            exists = os.path.exists(path)
+            with open(path, "rb" if readonly else "r+b" if exists else "w+b") as f:
+                if not exists:
+                    f.truncate(size)   # sparse, disk fills up as chunks do
+                size = os.fstat(f.fileno()).st_size
+                self.mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        self.size = size
+        self.view = memoryview(self.mm)
+        self.used = 0
+        self.live = 0
+
+    def close(self, unlink=False):
+        try:
+            self.view.release()
+            self.mm.close()
+        except BufferError:
+            pass   # a query still holds a view, the map goes when that does
+        if unlink and self.path is not None:
+            os.unlink(self.path)
+
+
+class Chunk:
+    __slots__ = ("seg", "off", "device_id", "capacity", "count", "t_min", "t_max", "ordered",
+                 "times", "values", "ids", "units")
+
+    def __init__(self, seg, off, device_id, capacity, count=0, t_min=INF, t_max=-INF):
+        self.seg = seg
+        self.off = off
+        self.device_id = device_id
+        self.capacity = capacity
+        self.count = count
+        self.t_min = t_min
+        self.t_max = t_max
+        v = seg.view
+        base = off + CHUNK_HDR.size
+        self.times = v[base: base + 8 * capacity].cast("d")
+        self.values = v[base + 8 * capacity: base + 16 * capacity].cast("d")
+        self.ids = v[base + 16 * capacity: base + 20 * capacity].cast("I")
+        self.units = v[base + 20 * capacity: base + 21 * capacity]
+        times = self.times[:count].tolist()
+        self.ordered = all(a <= b for a, b in zip(times, times[1:]))
+
+    def sync(self):
+        CHUNK_HDR.pack_into(self.seg.mm, self.off, CHUNK_MAGIC, self.device_id, self.capacity,
+                            self.count, self.t_min, self.t_max)
+
+    def kill(self):
+        CHUNK_HDR.pack_into(self.seg.mm, self.off, CHUNK_MAGIC_DEAD, self.device_id, self.capacity, 0, 0.0, 0.0)
+
+    def release(self):
+        for v in (self.times, self.values, self.ids, self.units):
+            v.release()
+
+
+class TimeSeriesStore:
+    def __init__(self, path=None, retention=RAW_RETENTION, rollup_retention=ROLLUP_RETENTION, readonly=False):
+        self.path = path
+        self.retention = retention
+        self.rollup_retention = rollup_retention
+        self.readonly = readonly
+        self.devices = {}   # device_id -> chunks, oldest first
+        self.ends = {}      # device_id -> running max of the chunks' t_max (the time index)
+        self.active = {}    # device_id -> chunk being appended to
+        self.rollups = {}   # device_id -> {bucket: [count, min, max, sum]}
+        self.segments = []
+        self.current = None
+        self.next_seg = 1
+        self.dirty = set()
+        self.stored = 0
+        self.added = 0
+        self.evicted = 0
+        self.next_sync = 0.0
+        self.next_evict = 0.0
+        if path is not None:
+            if not readonly:
+                os.makedirs(path, exist_ok=True)
+            self.load()
+
+    # --- writing ---
+
+    def new_chunk(self, device_id, capacity=CHUNK_READINGS):
+        size = chunk_bytes(capacity)
+        seg = self.current
+        if seg is None or seg.used + size > seg.size:
+            path = os.path.join(self.path, f"seg{self.next_seg:06d}.ts") if self.path is not None else None
+            seg = self.current = Segment(path, max(SEGMENT_BYTES, size))
+            self.segments.append(seg)
+            self.next_seg += 1
+        chunk = Chunk(seg, seg.used, device_id, capacity)
+        chunk.sync()
+        seg.used += size
+        seg.live += 1
+        self.devices.setdefault(device_id, []).append(chunk)
+        ends = self.ends.setdefault(device_id, [])
+        ends.append(ends[-1] if ends else -INF)
+        self.active[device_id] = chunk
+        return chunk
+
+    def add(self, device_id, t, first_id, values, unit="C", ids=None):
+        # one batch, all readings at time t. ids default to first_id, first_id+1, ...
+        n = len(values)
+        if not n:
+            return
+        if ids is None:
+            first_id &= ID_MASK
+            ids = range(first_id, first_id + n) if first_id + n <= ID_MASK + 1 else \
+                [(first_id + i) & ID_MASK for i in range(n)]
+        else:
+            ids = [i & ID_MASK for i in ids]
+        if n > SMALL_BATCH:
+            values = values if isinstance(values, array) and values.typecode == "d" else array("d", values)
+            ids = array("I", ids)
+        code = UNIT_CODES.get(unit, NO_UNIT)
+
+        chunk = self.active.get(device_id)
+        ends = self.ends.get(device_id)
+        pos = 0
+        while pos < n:
+            if chunk is None or chunk.count == chunk.capacity:
+                chunk = self.new_chunk(device_id)
+                ends = self.ends[device_id]
+            c = chunk.count
+            k = min(n - pos, chunk.capacity - c)
+            if n <= SMALL_BATCH:
+                times, vals, cids, units = chunk.times, chunk.values, chunk.ids, chunk.units
+                for j in range(k):
+                    times[c + j] = t
+                    vals[c + j] = values[pos + j]
+                    cids[c + j] = ids[pos + j]
+                    units[c + j] = code
+            else:
+                chunk.times[c:c + k] = array("d", (t,)) * k
+                chunk.values[c:c + k] = values[pos:pos + k]
+                chunk.ids[c:c + k] = ids[pos:pos + k]
+                chunk.units[c:c + k] = bytes((code,)) * k
+            if t < chunk.t_max:
+                chunk.ordered = False
+            if t < chunk.t_min:
+                chunk.t_min = t
+            if t > chunk.t_max:
+                chunk.t_max = t
+                if t > ends[-1]:
+                    ends[-1] = t
+            chunk.count = c + k
+            self.dirty.add(chunk)
+            pos += k
+        self.stored += n
+        self.added += n
+        self.add_rollup(device_id, t, n, min(values), max(values), sum(values))
+
+    def add_json(self, device_id, t, readings):
+        # the json codec's [{"reading_id", "value", "unit"}, ...], unusable readings are skipped.
+        # A batch is stored with the unit of its first reading.
+        ids, values, unit = [], [], None
+        for r in readings:
+            try:
+                v = float(r["value"])
+                i = int(r["reading_id"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if unit is None:
+                unit = r.get("unit")
+            ids.append(i)
+            values.append(v)
+        self.add(device_id, t, 0, values, unit, ids)
+
+    def add_rollup(self, device_id, t, n, lo, hi, total):
+        r = self.rollups.get(device_id)
+        if r is None:
+            r = self.rollups[device_id] = {}
+        b = int(t // ROLLUP_SECONDS)
+        agg = r.get(b)
+        if agg is None:
+            r[b] = [n, lo, hi, total]
+        else:
+            agg[0] += n
+            if lo < agg[1]:
+                agg[1] = lo
+            if hi > agg[2]:
+                agg[2] = hi
+            agg[3] += total
+
+    # --- housekeeping ---
+
+    def maintain(self, now):
+        # from the server's periodic timer
+        if now >= self.next_sync:
+            self.sync()
+            self.next_sync = now + SYNC_INTERVAL
+        if now >= self.next_evict:
+            self.evict(now)
+            self.next_evict = now + EVICT_INTERVAL
+
+    def sync(self):
+        # chunk headers (count, time range) to the map, what a reader of the files goes by
+        for chunk in self.dirty:
+            chunk.sync()
+        self.dirty.clear()
+
+    def evict(self, now):
+        raw_cutoff = now - self.retention
+        for device_id in list(self.devices):
+            chunks = self.devices[device_id]
+            k = 0
+            while k < len(chunks) and chunks[k].t_max < raw_cutoff:
+                k += 1
+            if not k:
+                continue
+            for chunk in chunks[:k]:
+                self.drop(chunk)
+            del chunks[:k]
+            del self.ends[device_id][:k]
+            if not chunks:
+                del self.devices[device_id], self.ends[device_id]
+                self.active.pop(device_id, None)
+
+        # rollup buckets go in time order, so old ones are at the front of the dict
+        # (a packet late across a bucket boundary may leave one behind for a while)
+        bucket_cutoff = int((now - self.rollup_retention) // ROLLUP_SECONDS)
+        for device_id in list(self.rollups):
+            r = self.rollups[device_id]
+            for b in list(r):
+                if b >= bucket_cutoff:
+                    break
+                del r[b]
+            if not r:
+                del self.rollups[device_id]
+
+    def drop(self, chunk):
+        self.stored -= chunk.count
+        self.evicted += chunk.count
+        self.dirty.discard(chunk)
+        chunk.release()
+        seg = chunk.seg
+        seg.live -= 1
+        if not seg.live and seg is not self.current:
+            self.segments.remove(seg)
+            seg.close(unlink=not self.readonly)
+        elif not self.readonly:
+            chunk.kill()   # so a reader of the file skips it
+
+    def close(self):
+        if not self.readonly:
+            self.sync()
+            if self.path is not None:
+                self.save_rollups()
+        for chunks in self.devices.values():
+            for chunk in chunks:
+                chunk.release()
+        for seg in self.segments:
+            seg.close()
+        self.devices, self.ends, self.active, self.segments, self.current = {}, {}, {}, [], None
+
+    def save_rollups(self):
+        path = os.path.join(self.path, ROLLUP_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"saved": time.time(), "seconds": ROLLUP_SECONDS,
+                       "devices": {str(d): [[b] + agg for b, agg in r.items()] for d, r in self.rollups.items()}}, f)
+        os.replace(path + ".tmp", path)
+
+    def load(self):
+        paths = sorted(glob.glob(os.path.join(self.path, SEGMENT_GLOB)))
+        for path in paths:
+            seg = Segment(path, readonly=self.readonly)
+            off = 0
+            while off + CHUNK_HDR.size <= seg.size:
+                magic, device_id, capacity, count, t_min, t_max = CHUNK_HDR.unpack_from(seg.mm, off)
+                if magic not in (CHUNK_MAGIC, CHUNK_MAGIC_DEAD) or off + chunk_bytes(capacity) > seg.size:
+                    break
+                if magic == CHUNK_MAGIC_DEAD:
+                    off += chunk_bytes(capacity)
+                    continue
+                chunk = Chunk(seg, off, device_id, capacity, count, t_min, t_max)
+                seg.live += 1
+                off += chunk_bytes(capacity)
+                self.devices.setdefault(device_id, []).append(chunk)
+                ends = self.ends.setdefault(device_id, [])
+                ends.append(max(ends[-1], t_max) if ends else t_max)
+                self.active[device_id] = chunk
+                self.stored += count
+            seg.used = off
+            self.segments.append(seg)
+            self.current = seg
+            self.next_seg = int(os.path.basename(path)[3:-3]) + 1
+        if not self.readonly:
+            for seg in [s for s in self.segments if not s.live and s is not self.current]:
+                self.segments.remove(seg)
+                seg.close(unlink=True)
+
+        saved = -INF
+        try:
+            with open(os.path.join(self.path, ROLLUP_FILE)) as f:
+                d = json.load(f)
+            if d["seconds"] == ROLLUP_SECONDS:
+                saved = d["saved"]
+                self.rollups = {int(dev): {row[0]: row[1:] for row in rows} for dev, rows in d["devices"].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+        # readings after the last save (all of them after a crash) go in from the raw chunks
+        for device_id, chunks in self.devices.items():
+            for chunk in chunks:
+                if chunk.t_max <= saved:
+                    continue
+                for i in range(chunk.count):
+                    t = chunk.times[i]
+                    if t > saved:
+                        v = chunk.values[i]
+                        self.add_rollup(device_id, t, 1, v, v, v)
+        if not self.readonly:
+            self.evict(time.time())
+
+    # --- queries ---
+
+    def readings(self, device_id, t0=-INF, t1=INF):
+        # (time, reading_id, value, unit) of device_id with t0 <= time <= t1, oldest chunk first
+        chunks = self.devices.get(device_id)
+        if not chunks:
+            return
+        for chunk in chunks[bisect_left(self.ends[device_id], t0):]:
+            if chunk.t_min > t1 or chunk.t_max < t0:
+                continue
+            times, n = chunk.times, chunk.count
+            if chunk.ordered:
+                lo = bisect_left(times, t0, 0, n)
+                idx = range(lo, bisect_right(times, t1, lo, n))
+            else:
+                idx = [i for i in range(n) if t0 <= times[i] <= t1]
+            for i in idx:
+                yield times[i], chunk.ids[i], chunk.values[i], UNIT_NAMES.get(chunk.units[i], "?")
+
+    def rollup(self, device_id, t0=-INF, t1=INF, seconds=ROLLUP_SECONDS):
+        # [(bucket start, count, min, max, mean)] over [t0, t1]. Multiples of
+        # ROLLUP_SECONDS come from the rollups (and reach back further), anything
+        # else is worked out from the raw readings.
+        out = {}
+        if seconds >= ROLLUP_SECONDS and seconds % ROLLUP_SECONDS == 0:
+            for b, (n, lo, hi, total) in self.rollups.get(device_id, {}).items():
+                start = b * ROLLUP_SECONDS
+                if t0 - ROLLUP_SECONDS < start <= t1:
+                    self.merge_bucket(out, int(start // seconds), n, lo, hi, total)
+        else:
+            for t, _, v, _ in self.readings(device_id, t0, t1):
+                self.merge_bucket(out, int(t // seconds), 1, v, v, v)
+        return [(b * seconds, n, lo, hi, total / n) for b, (n, lo, hi, total) in sorted(out.items())]
+
+    @staticmethod
+    def merge_bucket(out, b, n, lo, hi, total):
+        agg = out.get(b)
+        if agg is None:
+            out[b] = [n, lo, hi, total]
+        else:
+            agg[0] += n
+            agg[1] = min(agg[1], lo)
+            agg[2] = max(agg[2], hi)
+            agg[3] += total
+
+    def stats(self):
+        return {"devices": len(self.devices), "readings": self.stored, "added": self.added, "evicted": self.evicted,
+                "chunks": sum(len(c) for c in self.devices.values()), "segments": len(self.segments),
+                "mapped_bytes": sum(s.size for s in self.segments),
+                "rollup_buckets": sum(len(r) for r in self.rollups.values())}
+
+
+def open_stores(path):
+    # a store dir, or the dir holding the per-worker/per-processor stores (--ts-dir)
+    dirs = [path] if glob.glob(os.path.join(path, SEGMENT_GLOB)) else \
+        sorted(d for d in glob.glob(os.path.join(path, "*")) if os.path.isdir(d))
+    return [TimeSeriesStore(d, readonly=True) for d in dirs]
+
+
+def fmt_time(t):
+    return datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the readings a udp_server.py --ts-dir store holds")
+    parser.add_argument("path", nargs="?", default="ts_data", help="the server's --ts-dir")
+    parser.add_argument("--device", type=int, help="device to print, without it every device is summarized")
+    parser.add_argument("--since", type=float, default=3600, help="seconds back from now (default 3600)")
+    parser.add_argument("--bucket", type=float, default=0, help="min/max/mean per this many seconds instead of raw readings")
+    args = parser.parse_args()
+
+    stores = open_stores(args.path)
+    if not stores:
+        sys.exit(f"no store at {args.path}")
+    t0 = time.time() - args.since
+    out = csv.writer(sys.stdout)
+    try:
+        if args.device is None:
+            out.writerow(["device_id", "readings", "first", "last", "rollup_buckets"])
+            for st in stores:
+                for device_id, chunks in sorted(st.devices.items()):
+                    out.writerow([device_id, sum(c.count for c in chunks),
+                                  fmt_time(min(c.t_min for c in chunks if c.count)) if any(c.count for c in chunks) else "",
+                                  fmt_time(st.ends[device_id][-1]) if st.ends[device_id][-1] > -INF else "",
+                                  len(st.rollups.get(device_id, ()))])
+        elif args.bucket > 0:
+            out.writerow(["bucket_start", "device_id", "count", "min", "max", "mean"])
+            for st in stores:
+                for start, n, lo, hi, mean in st.rollup(args.device, t0, INF, args.bucket):
+                    out.writerow([fmt_time(start), args.device, n, lo, hi, round(mean, 6)])
+        else:
+            out.writerow(["time", "device_id", "reading_id", "value", "unit"])
+            for st in stores:
+                for t, rid, v, unit in st.readings(args.device, t0):
+                    out.writerow([fmt_time(t), args.device, rid, v, unit])
+    except BrokenPipeError:
+        pass
+    finally:
+        for st in stores:
+            st.close()
@@ -1,170 +1,447 @@
-
-
-import socket, struct, time, json, os, random
-import datetime 
-
-#8ayaro el IP lama tego te3mlo run. el IP ykoon nafs el 3la linux lama tekteb ifconfig
-
-
-SERVER_IP = "192.168.1.10"
-SERVER_PORT = 5005
-
-# geda3an eftekro 3ayzeen n5aly el batch size ykoon input m4 fixed kda
-# mmkn bardo nbos 3la ba2et el 7agat n5aleha input zy el number of messages aw kda
-# hearbeat 5aly 4 w 5las w el ack_timeout bardo sebo zy ma howa.
-
-
-HDR_FMT = "!B H H d"
-HDR_LEN = struct.calcsize(HDR_FMT)
-
-
-MSG_INIT = 0
-MSG_DATA = 1
-MSG_ACK  = 2
-MSG_END  = 3
-MSG_HEARTBEAT = 4
-
-
-ACK_TIMEOUT = 3
-MAX_RETRIES = 0
-BASE_BACKOFF = 2
-NUM_MESSAGES = 70
-BATCH_SIZE = 1
-HEARTBEAT_INTERVAL = 3
-
-
-def send_best_effort(sock, packed_msg):
-    try:
-        sock.sendto(packed_msg, (SERVER_IP, SERVER_PORT))
-        return True
-    except Exception:
-        return False
-
-
-def pack_header(version, msgtype, device_id, seq, timestamp):
-    header_byte = ((version & 0xF) << 4) | (msgtype & 0xF)
-    return struct.pack(HDR_FMT, header_byte, device_id & 0xFFFF, seq & 0xFFFF, timestamp)
-
-def unpack_header(raw):
-    header = struct.unpack(HDR_FMT, raw[:HDR_LEN])
-    header_byte, device_id, seq, timestamp = header
-    version = (header_byte >> 4) & 0xF
-    msgtype = header_byte & 0xF
-    return version, msgtype, device_id, seq, timestamp
-
-def get_detailed_ts(t):
-    # keep the time format
-    return datetime.datetime.fromtimestamp(t).strftime('%H:%M:%S.%f')
-
-# For INIT only
-def send_and_wait_ack(sock, packed_msg, expect_seq=None, expect_type=None, timeout=ACK_TIMEOUT):
-    tries = 0
-    while tries <= MAX_RETRIES:
-        try:
-            sock.sendto(packed_msg, (SERVER_IP, SERVER_PORT))
-            sock.settimeout(timeout * (2 ** tries))
-            data, _ = sock.recvfrom(4096)
-            
-            if len(data) < HDR_LEN:
-                tries += 1
-                continue
-            
-            v, t, did, seq_r, ts = unpack_header(data)
-            if expect_type is not None and t != expect_type:
-                tries += 1
-                continue
-            if expect_seq is not None and seq_r != expect_seq:
-                tries += 1
-                continue
-            
-            payload_bytes = data[HDR_LEN:]
-            payload = None
-            if payload_bytes:
-                try:
-                    payload = json.loads(payload_bytes.decode())
-                except Exception:
-                    payload = None
-            return True, (v, t, did, seq_r, ts, payload)
-        except socket.timeout:
-            tries += 1
-            if tries > MAX_RETRIES:
-                return False, None
-            backoff = BASE_BACKOFF * (2 ** (tries - 1)) * (0.8 + 0.4 * random.random())
-            time.sleep(backoff)
-        except Exception:
-            return False, None
-    return False, None
-
-def main():
-    device_id = os.getpid() & 0xFFFF
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    version = 1
-
-    ts = time.time() 
-    init_hdr = pack_header(version, MSG_INIT, device_id, 0, ts)
-    init_payload = json.dumps({
-    "proto": "AUDP-X",
-    "version": 1,
-    "info": "init"
-    }).encode()
-
-    init_packet = init_hdr + init_payload
-    ok, resp = send_and_wait_ack(sock, init_packet, expect_type=MSG_ACK)
-    
-    if not ok:
-        print(f"[{get_detailed_ts(time.time())}] FAILED INITIALIZE :: DEVICE {device_id} :: NO ACK. EXITING NOW.")
-        return
-        
-    print(f"[{get_detailed_ts(time.time())}] SUCCESS HANDSHAKE :: DEVICE {device_id} :: ACK RECIEVED. RESPONSE {resp}")
-
-    seq = 1
-    last_heartbeat_time = time.time() 
-
-    while seq <= NUM_MESSAGES:
-        current_time = time.time()
-
-        if current_time - last_heartbeat_time >= HEARTBEAT_INTERVAL:
-            ts_str = get_detailed_ts(current_time)
-            print(f"[{ts_str}] HEARTBEAT SENT :: DEVICE {device_id}")
-
-            hb_hdr = pack_header(version, MSG_HEARTBEAT, device_id, 0, current_time)
-            hb_packet = hb_hdr + b''
-            send_best_effort(sock, hb_packet) 
-            last_heartbeat_time = current_time
-        
-
-        readings = []
-        for b in range(BATCH_SIZE):
-            reading = {
-                "reading_id": seq + b,
-                "value": round(random.uniform(20.0, 30.0), 2),
-                "unit": "C"
-            }
-            readings.append(reading)
-        payload_obj = {
-            "batch": readings
-        }
-        payload_bytes = json.dumps(payload_obj).encode()
-        
-        hdr = pack_header(version, MSG_DATA, device_id, seq, time.time())
-        packet = hdr + payload_bytes
-
-        ts_str = get_detailed_ts(time.time())
-        
-        if send_best_effort(sock, packet):
-            print(f"[{ts_str}] DATA SENT OK :: DEVICE {device_id} :: SEQ {seq}")
-            seq += BATCH_SIZE
-        else:
-            print(f"[{ts_str}] DATA SEND FAIL :: DEVICE {device_id} :: SEQ {seq} :: LOCAL SOCKET ERROR")
-            seq += BATCH_SIZE
-        
-        time.sleep(1)
-
-    end_hdr = pack_header(version, MSG_END, device_id, 0, time.time())
-    end_packet = end_hdr + b''
-    send_best_effort(sock, end_packet)
-    sock.close()
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+
+
+import socket, struct, time, json, os, random, argparse, select
+import datetime 
+from payload_codec import CODEC_JSON, SUPPORTED_CODECS, encode_batch, FLAG_COMPRESSED, COMPRESS_ZDELTA, encode_zdelta
+from ack_tracker import MSG_SACK, SACK_PAYLOAD, unwrap_seq, sack_covers
+from send_window import SendWindow, RtoEstimator
+from batcher import AdaptiveBatcher, max_payload, max_batch, PATH_MTU
+from clock_sync import CLOCK_ECHO, CLOCK_SAMPLE, heartbeat_interval
+from msg_auth import KeyRing, ClientAuth
+from flow_control import RateControl, ack_load
+
+#8ayaro el IP lama tego te3mlo run. el IP ykoon nafs el 3la linux lama tekteb ifconfig
+
+
+SERVER_IP = "192.168.1.10"
+SERVER_PORT = 5005
+
+# geda3an eftekro 3ayzeen n5aly el batch size ykoon input m4 fixed kda
+# mmkn bardo nbos 3la ba2et el 7agat n5aleha input zy el number of messages aw kda
+# hearbeat 5aly 4 w 5las w el ack_timeout bardo sebo zy ma howa.
+
+
+HDR_FMT = "!B H H d"
+HDR_LEN = struct.calcsize(HDR_FMT)
+
+
+MSG_INIT = 0
+MSG_DATA = 1
+MSG_ACK  = 2
+MSG_END  = 3
+MSG_HEARTBEAT = 4
+
+
+ACK_TIMEOUT = 3
+MAX_RETRIES = 0
+BASE_BACKOFF = 2
+NUM_MESSAGES = 70
+BATCH_SIZE = 1
+HEARTBEAT_INTERVAL = 3
+# best effort mode sends one DATA packet per SEND_INTERVAL seconds
+SEND_INTERVAL = 1.0
+PAYLOAD_CODEC = CODEC_JSON
+# how long to keep listening for the last (possibly delayed) ACKs before END
+ACK_DRAIN_TIME = 1.0
+# Reliable mode: up to SEND_WINDOW DATA packets in flight, retransmitted on
+# timeout (adaptive RTO, BASE_BACKOFF per retry) or on SACK/later-ACK evidence
+RELIABLE = False
+SEND_WINDOW = 16
+DATA_MAX_RETRIES = 8
+DUP_ACK_THRESH = 3
+# Adaptive batching: the sensor produces READING_RATE readings/s and a batch is
+# sent when it reaches the adaptive target, fills the MTU, or is BATCH_MAX_DELAY old
+ADAPTIVE_BATCH = False
+READING_RATE = 1.0
+BATCH_MAX_DELAY = 0.5
+# Ask for zdelta compressed DATA (delta + zlib, flagged in the header byte)
+COMPRESS = False
+# Authenticated mode: HMAC tag on every datagram, key shared with the server (msg_auth.py)
+AUTH_KEY_FILE = None
+# Backpressure: DATA paced at no more than 1 / SEND_INTERVAL packets/s, slowed
+# down (AIMD) by the load byte in the server's ACKs, batches grow to make up (flow_control.py)
+BACKPRESSURE = False
+
+
+def send_best_effort(sock, packed_msg):
+    try:
+        sock.sendto(packed_msg, (SERVER_IP, SERVER_PORT))
+        return True
+    except Exception:
+        return False
+
+
+def pack_header(version, msgtype, device_id, seq, timestamp, flags=0):
+    header_byte = ((version & 0x7) << 4) | (msgtype & 0xF) | flags
+    return struct.pack(HDR_FMT, header_byte, device_id & 0xFFFF, seq & 0xFFFF, timestamp)
+
+def unpack_header(raw):
+    header = struct.unpack(HDR_FMT, raw[:HDR_LEN])
+    header_byte, device_id, seq, timestamp = header
+    version = (header_byte >> 4) & 0x7
+    msgtype = header_byte & 0xF
+    return version, msgtype, device_id, seq, timestamp
+
+def get_detailed_ts(t):
+    # keep the time format
+    return datetime.datetime.fromtimestamp(t).strftime('%H:%M:%S.%f')
+
+def read_acks(sock, device_id, window, next_seq, clock=None, auth=None, flow=None):
+    # Drain every ACK already waiting on the socket without blocking.
+    # window: SendWindow of the DATA not acked yet, acked ones are removed.
+    # Understands both the per-packet MSG_ACK and the cumulative MSG_SACK.
+    # clock: dict, a heartbeat ACK's (t1, t2) echo + its header ts (t3) and our
+    # receive time (t4) go in clock["sample"] for the next HEARTBEAT.
+    # auth: ClientAuth in authenticated mode, ACKs with a bad tag are ignored.
+    # flow: RateControl in backpressure mode, gets the load byte of DATA ACKs.
+    # Returns the number of ACK datagrams read.
+    count = 0
+    while select.select([sock], [], [], 0)[0]:
+        try:
+            data, _ = sock.recvfrom(4096)
+        except OSError:
+            break
+        count += 1
+        if auth is not None:
+            data = auth.check(data)
+            if data is None:
+                continue
+        if len(data) < HDR_LEN:
+            continue
+        v, t, did, seq_r, ts = unpack_header(data)
+        if did != device_id:
+            continue
+        if t == MSG_ACK:
+            # seq 0 is INIT/HEARTBEAT, DATA starts at 1
+            if seq_r == 0 and clock is not None and len(data) >= HDR_LEN + CLOCK_ECHO.size:
+                t1, t2 = CLOCK_ECHO.unpack_from(data, HDR_LEN)
+                clock["sample"] = CLOCK_SAMPLE.pack(t1, t2, ts, time.time())
+                clock["new"] = True
+            window.ack([unwrap_seq(seq_r, next_seq)], time.time())
+            load = ack_load(data, HDR_LEN)
+        elif t == MSG_SACK and len(data) >= HDR_LEN + SACK_PAYLOAD.size:
+            cum = unwrap_seq(seq_r, next_seq)
+            bitmap = SACK_PAYLOAD.unpack_from(data, HDR_LEN)[0]
+            window.ack([s for s in window if sack_covers(cum, bitmap, s)], time.time())
+            load = ack_load(data, HDR_LEN + SACK_PAYLOAD.size)
+        else:
+            continue
+        if flow is not None and load is not None:
+            flow.on_load(load, time.time())
+    return count
+
+# For INIT only
+def send_and_wait_ack(sock, packed_msg, expect_seq=None, expect_type=None, timeout=ACK_TIMEOUT, auth=None):
+    # packed_msg may be a function making the packet, every try gets a new one
+    # (an authenticated server takes an INIT with an old timestamp as a replay)
+    tries = 0
+    while tries <= MAX_RETRIES:
+        try:
+            sock.sendto(packed_msg() if callable(packed_msg) else packed_msg, (SERVER_IP, SERVER_PORT))
+            sock.settimeout(timeout * (2 ** tries))
+            data, _ = sock.recvfrom(4096)
+            
+            if auth is not None:
+                # only the real server can tag it with our new session key
+                data = auth.accept_init_ack(data, HDR_LEN, lambda b: json.loads(b.decode()))
+                if data is None:
+                    tries += 1
+                    continue
+            if len(data) < HDR_LEN:
+                tries += 1
+                continue
+            
+            v, t, did, seq_r, ts = unpack_header(data)
+            if expect_type is not None and t != expect_type:
+                tries += 1
+                continue
+            if expect_seq is not None and seq_r != expect_seq:
+                tries += 1
+                continue
+            
+            payload_bytes = data[HDR_LEN:]
+            payload = None
+            if payload_bytes:
+                try:
+                    payload = json.loads(payload_bytes.decode())
+                except Exception:
+                    payload = None
+            return True, (v, t, did, seq_r, ts, payload)
+        except socket.timeout:
+            tries += 1
+            if tries > MAX_RETRIES:
+                return False, None
+            backoff = BASE_BACKOFF * (2 ** (tries - 1)) * (0.8 + 0.4 * random.random())
+            time.sleep(backoff)
+        except Exception:
+            return False, None
+    return False, None
+
+def main(codec=PAYLOAD_CODEC, reliable=None, adaptive=None, mtu=PATH_MTU, compress=None, backpressure=None):
+    if reliable is None:
+        reliable = RELIABLE
+    if adaptive is None:
+        adaptive = ADAPTIVE_BATCH
+    if compress is None:
+        compress = COMPRESS
+    if backpressure is None:
+        backpressure = BACKPRESSURE
+    device_id = os.getpid() & 0xFFFF
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    version = 1
+
+    init_obj = {
+    "proto": "AUDP-X",
+    "version": 1,
+    "info": "init",
+    "codecs": [codec, CODEC_JSON]
+    }
+    if compress:
+        init_obj["compress"] = [COMPRESS_ZDELTA]
+    auth = ClientAuth(KeyRing.from_file(AUTH_KEY_FILE), device_id) if AUTH_KEY_FILE else None
+    if auth is not None:
+        init_obj["auth"] = auth.nonce.hex()
+    init_payload = json.dumps(init_obj).encode()
+
+    def init_packet():
+        init_packet = pack_header(version, MSG_INIT, device_id, 0, time.time()) + init_payload
+        return auth.sign_init(init_packet) if auth is not None else init_packet
+    # everything after the INIT is tagged with the session key
+    sign = auth.sign if auth is not None else (lambda pkt: pkt)
+    ok, resp = send_and_wait_ack(sock, init_packet, expect_type=MSG_ACK, auth=auth)
+    init_ack_time = time.time()
+    
+    if not ok:
+        print(f"[{get_detailed_ts(time.time())}] FAILED INITIALIZE :: DEVICE {device_id} :: NO ACK. EXITING NOW.")
+        return
+        
+    print(f"[{get_detailed_ts(time.time())}] SUCCESS HANDSHAKE :: DEVICE {device_id} :: ACK RECIEVED. RESPONSE {resp}")
+
+    # Use whatever codec the server confirmed, an old server won't say and only speaks json
+    ack_payload = resp[5]
+    codec = ack_payload.get("codec", CODEC_JSON) if isinstance(ack_payload, dict) else CODEC_JSON
+    # same for compression, only use it if the server said yes
+    compress = compress and isinstance(ack_payload, dict) and ack_payload.get("compress") == COMPRESS_ZDELTA
+    print(f"[{get_detailed_ts(time.time())}] PAYLOAD CODEC :: DEVICE {device_id} :: {codec}" + (" + zdelta" if compress else ""))
+
+    # Clock offset samples for the server (clock_sync.py): the INIT exchange is
+    # the first one, it goes out with a heartbeat right away. "sent" counts the
+    # different samples sent, the first few heartbeats go out quickly
+    clock = {"sample": b"", "new": False, "sent": 0}
+    echo = ack_payload.get("clock") if isinstance(ack_payload, dict) else None
+    if isinstance(echo, list) and len(echo) == 2:
+        clock["sample"] = CLOCK_SAMPLE.pack(echo[0], echo[1], resp[4], init_ack_time)
+        clock["new"] = True
+
+    seq = 1                 # reading id of the next DATA packet (= its first reading)
+    last_heartbeat_time = time.time() - (HEARTBEAT_INTERVAL if clock["sample"] else 0)
+    packets_sent = 0
+    # compressed mode: payload bytes sent vs what `codec` would have sent, and encode time
+    zd_bytes = plain_bytes = 0
+    zd_time = 0.0
+    if adaptive:
+        # zdelta is never bigger than f32 per reading, size the batches for that
+        batcher = AdaptiveBatcher("f32" if compress else codec, "C", max_payload(mtu), BATCH_MAX_DELAY)
+        next_reading = seq      # next reading id the sensor produces
+        next_reading_time = time.time()
+    if reliable:
+        window = SendWindow(SEND_WINDOW, RtoEstimator(initial=ACK_TIMEOUT), BASE_BACKOFF,
+                            DATA_MAX_RETRIES, DUP_ACK_THRESH)
+    else:
+        window = SendWindow(retransmit=False)
+    acks_received = 0
+    flow = None
+    if backpressure:
+        flow = RateControl(1.0 / SEND_INTERVAL, time.time())
+        # the server's load when it took the INIT
+        if isinstance(ack_payload, dict) and isinstance(ack_payload.get("load"), int):
+            flow.on_load(ack_payload["load"], time.time())
+        # a slowed down fixed-batch client packs more readings per packet, up to the MTU
+        flow_max_batch = max_batch("f32" if compress else codec, "C", max_payload(mtu))
+
+    # reliable mode keeps going until everything is ACKed (or out of retries)
+    while seq <= NUM_MESSAGES or (reliable and window):
+        current_time = time.time()
+        acks_received += read_acks(sock, device_id, window, seq, clock, auth, flow)
+        if adaptive:
+            batcher.adapt(window)
+
+        # (an old server sends no clock echo, nothing to hurry for)
+        hb_interval = heartbeat_interval(clock["sent"], HEARTBEAT_INTERVAL) if clock["sample"] else HEARTBEAT_INTERVAL
+        if current_time - last_heartbeat_time >= hb_interval:
+            ts_str = get_detailed_ts(current_time)
+            print(f"[{ts_str}] HEARTBEAT SENT :: DEVICE {device_id}")
+
+            hb_hdr = pack_header(version, MSG_HEARTBEAT, device_id, 0, current_time)
+            hb_packet = sign(hb_hdr + clock["sample"])
+            send_best_effort(sock, hb_packet) 
+            last_heartbeat_time = current_time
+            if clock["new"]:
+                clock["sent"] += 1
+                clock["new"] = False
+
+        for r_seq, r_packet in window.due(current_time):
+            print(f"[{get_detailed_ts(current_time)}] DATA RETRANSMIT :: DEVICE {device_id} :: SEQ {r_seq} :: RTO {window.rto.rto:.3f}s")
+            send_best_effort(sock, r_packet)
+
+        if adaptive:
+            # collect what the sensor produced since the last round
+            while next_reading <= NUM_MESSAGES and next_reading_time <= current_time:
+                batcher.add(round(random.uniform(20.0, 30.0), 2), next_reading_time)
+                next_reading += 1
+                next_reading_time += 1.0 / READING_RATE
+            send_now = batcher.ready(current_time) or (next_reading > NUM_MESSAGES and len(batcher) > 0)
+        else:
+            send_now = seq <= NUM_MESSAGES
+        # paced by the server's load, a full adaptive batch goes anyway
+        paced = flow is not None and not flow.ready(current_time) and not (adaptive and len(batcher) >= batcher.max_count)
+
+        if not send_now or paced or not window.has_room():
+            # nothing to send (or window full): sleep until an ACK, a retransmit
+            # timer, the heartbeat, the next reading or the batch deadline
+            wake = [window.next_deadline() or current_time + HEARTBEAT_INTERVAL,
+                    last_heartbeat_time + hb_interval]
+            if adaptive and next_reading <= NUM_MESSAGES:
+                wake.append(next_reading_time)
+            if adaptive and len(batcher) > 0:
+                wake.append(batcher.deadline())
+            if send_now and paced:
+                wake.append(flow.next_send)
+            select.select([sock], [], [], max(0.0, min(wake) - time.time()))
+            continue
+
+        if adaptive:
+            values = batcher.take()
+        else:
+            n = BATCH_SIZE
+            if flow is not None:
+                n = min(flow.batch_size(BATCH_SIZE, flow_max_batch), max(BATCH_SIZE, NUM_MESSAGES - seq + 1))
+            values = [round(random.uniform(20.0, 30.0), 2) for _ in range(n)]
+        batch_size = len(values)
+        if compress:
+            t0 = time.perf_counter()
+            payload_bytes = encode_zdelta(seq, values, "C")
+            zd_time += time.perf_counter() - t0
+            zd_bytes += len(payload_bytes)
+            plain_bytes += len(encode_batch(codec, seq, values, "C"))
+        else:
+            payload_bytes = encode_batch(codec, seq, values, "C")
+        
+        hdr = pack_header(version, MSG_DATA, device_id, seq, time.time(), FLAG_COMPRESSED if compress else 0)
+        packet = sign(hdr + payload_bytes)
+
+        ts_str = get_detailed_ts(time.time())
+        
+        packets_sent += 1
+        if flow is not None:
+            flow.sent(time.time())
+        if send_best_effort(sock, packet):
+            print(f"[{ts_str}] DATA SENT OK :: DEVICE {device_id} :: SEQ {seq}" + (f" :: BATCH {batch_size}" if adaptive or flow else ""))
+            window.sent(seq, batch_size, packet, time.time())
+            seq += batch_size
+        elif reliable:
+            # socket buffer full or similar, retransmit timer will take care of it
+            print(f"[{ts_str}] DATA SEND FAIL :: DEVICE {device_id} :: SEQ {seq} :: LOCAL SOCKET ERROR, WILL RETRY")
+            window.sent(seq, batch_size, packet, time.time())
+            seq += batch_size
+        else:
+            print(f"[{ts_str}] DATA SEND FAIL :: DEVICE {device_id} :: SEQ {seq} :: LOCAL SOCKET ERROR")
+            seq += batch_size
+        
+        if not reliable and not adaptive:
+            # wait out the interval reading ACKs as they come, a heartbeat ACK
+            # read late would make its clock sample look like a slow round trip
+            next_send = flow.next_send if flow is not None else time.time() + SEND_INTERVAL
+            while time.time() < next_send:
+                if select.select([sock], [], [], max(0.0, next_send - time.time()))[0]:
+                    acks_received += read_acks(sock, device_id, window, seq, clock, auth, flow)
+
+    # Last ACKs may still be in flight (or held back by a cumulative-ACK server)
+    drain_until = time.time() + ACK_DRAIN_TIME
+    while window and time.time() < drain_until:
+        select.select([sock], [], [], max(0.0, drain_until - time.time()))
+        acks_received += read_acks(sock, device_id, window, seq, clock, auth, flow)
+    st = window.stats
+    print(f"[{get_detailed_ts(time.time())}] ACK SUMMARY :: DEVICE {device_id} :: DATA SENT {packets_sent} :: ACKED {st['acked']} :: ACK PACKETS {acks_received}"
+          + ("" if reliable else f" :: NO ACK WITHIN RTO {st['expired']}"))
+    if adaptive:
+        print(f"[{get_detailed_ts(time.time())}] BATCH SUMMARY :: DEVICE {device_id} :: READINGS {seq - 1} :: PACKETS {packets_sent} "
+              f":: AVG BATCH {(seq - 1) / max(packets_sent, 1):.1f} :: TARGET NOW {batcher.target} (MAX {batcher.max_count})")
+    if compress:
+        print(f"[{get_detailed_ts(time.time())}] COMPRESS SUMMARY :: DEVICE {device_id} :: PAYLOAD {zd_bytes} B :: AS {codec.upper()} {plain_bytes} B "
+              f":: SAVED {100.0 * (1 - zd_bytes / max(plain_bytes, 1)):.1f}% :: ENCODE {zd_time / max(packets_sent, 1) * 1e6:.1f} us/packet")
+    if flow is not None:
+        fs = flow.stats
+        print(f"[{get_detailed_ts(time.time())}] BACKPRESSURE SUMMARY :: DEVICE {device_id} :: RATE NOW {flow.rate:.1f}/s (MAX {flow.max_rate:.1f}) "
+              f":: DECREASES {fs['decreases']} :: PEAK LOAD {fs['peak_load']} :: LOADED ACKS {fs['acks']} "
+              f":: AVG BATCH {(seq - 1) / max(packets_sent, 1):.1f}")
+    if reliable:
+        srtt = window.rto.srtt
+        print(f"[{get_detailed_ts(time.time())}] RELIABLE SUMMARY :: DEVICE {device_id} :: RETRANSMITS {st['timeouts'] + st['fast']} "
+              f"({st['fast']} FAST) :: GAVE UP {st['failed']} :: SRTT {(srtt or 0) * 1e3:.1f}ms :: RTO {window.rto.rto:.3f}s")
+
+    end_hdr = pack_header(version, MSG_END, device_id, 0, time.time())
+    end_packet = sign(end_hdr + b'')
+    send_best_effort(sock, end_packet)
+    sock.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ITP UDP client")
+    parser.add_argument("--codec", choices=SUPPORTED_CODECS, default=PAYLOAD_CODEC,
+                        help="DATA payload codec to ask the server for at INIT (default json)")
+    parser.add_argument("--server", default=SERVER_IP,
+                        help="server IP (default %(default)s), 127.0.0.1 for loopback load tests")
+    parser.add_argument("--port", type=int, default=SERVER_PORT,
+                        help="server port (default 5005, impair_proxy.py listens on 5006)")
+    parser.add_argument("--messages", type=int, default=NUM_MESSAGES,
+                        help="readings to send (default %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                        help="readings per DATA packet without --adaptive-batch (default %(default)s)")
+    parser.add_argument("--interval", type=float, default=SEND_INTERVAL,
+                        help="best effort mode: seconds between DATA packets, --backpressure: the least (default 1)")
+    parser.add_argument("--reliable", action="store_true",
+                        help="windowed DATA with retransmissions instead of best effort at 1 msg/s")
+    parser.add_argument("--window", type=int, default=SEND_WINDOW,
+                        help="reliable mode: max DATA packets in flight (default 16)")
+    parser.add_argument("--adaptive-batch", action="store_true",
+                        help="batch readings by size/latency, adapting the batch size to ACK RTT and loss")
+    parser.add_argument("--reading-rate", type=float, default=READING_RATE,
+                        help="adaptive batching: sensor readings per second (default 1)")
+    parser.add_argument("--batch-delay", type=float, default=BATCH_MAX_DELAY,
+                        help="adaptive batching: max seconds a reading waits for its batch (default 0.5)")
+    parser.add_argument("--mtu", type=int, default=PATH_MTU,
+                        help="adaptive batching: path MTU the batch has to fit in (default 1500)")
+    parser.add_argument("--compress", action="store_true",
+                        help="send DATA delta encoded + zlib compressed (zdelta) if the server supports it")
+    parser.add_argument("--auth-key-file", default=AUTH_KEY_FILE,
+                        help="authenticated mode: HMAC tag every datagram with this key shared with the server (default off)")
+    parser.add_argument("--backpressure", action="store_true",
+                        help="slow DATA down (AIMD, bigger batches) when the server's ACKs say it is loaded")
+    load = parser.add_argument_group("load generator", "simulate many devices at once (see load_gen.py)")
+    load.add_argument("--devices", type=int, default=1,
+                      help="number of simulated devices, more than 1 switches to the load generator")
+    load.add_argument("--rate", type=float, default=1000.0, help="aggregate DATA msg/s over all devices")
+    load.add_argument("--pattern", choices=["constant", "poisson", "bursty"], default="constant",
+                      help="send schedule (default constant)")
+    load.add_argument("--burst", type=int, default=10, help="bursty pattern: packets per burst")
+    load.add_argument("--duration", type=float, default=10.0, help="seconds of sending")
+    load.add_argument("--procs", type=int, default=1, help="sender processes, each runs its own asyncio loop")
+    load.add_argument("--first-device", type=int, default=1000, help="device_id of the first simulated device")
+    args = parser.parse_args()
+    SERVER_IP = args.server
+    SERVER_PORT = args.port
+    NUM_MESSAGES = args.messages
+    BATCH_SIZE = args.batch_size
+    SEND_INTERVAL = args.interval
+    SEND_WINDOW = args.window
+    READING_RATE = args.reading_rate
+    BATCH_MAX_DELAY = args.batch_delay
+    AUTH_KEY_FILE = args.auth_key_file
+    if args.devices > 1:
+        import load_gen
+        load_gen.run_load(args.devices, args.rate, args.duration, args.pattern, args.procs,
+                          args.first_device, args.burst, args.codec, BATCH_SIZE, SERVER_IP, SERVER_PORT,
+                          AUTH_KEY_FILE, args.backpressure)
+    else:
+        main(args.codec, args.reliable, args.adaptive_batch, args.mtu, args.compress, args.backpressure)
\ No newline at end of file
@@ -3,16 +3,30 @@
 
 # da version el mafeho4 network_sim. da el mafrod yetsalem. el tany kona ben test be bs take care!!
 
-import socket, struct, json, time, csv, datetime
-from collections import defaultdict, deque
-import pandas as pd
+import socket, select, struct, json, time, os, glob, signal, ctypes, argparse, multiprocessing, asyncio
+from packet_log import PacketLogWriter, merge_chunk_dir, run_chunk_dir
+from seq_window import SeqWindow, SEQ_NEW, SEQ_STALE
+from payload_codec import CODEC_JSON, choose_codec, decode_packed, FLAG_COMPRESSED, choose_compress, decode_zdelta
+from ack_tracker import AckTracker, MSG_SACK, SACK_PAYLOAD
+from timer_wheel import TimerWheel
+from reorder_buffer import ReorderBuffer
+from latency_hist import LogHistogram, format_ms
+from clock_sync import ClockEstimator, CLOCK_ECHO, CLOCK_SAMPLE
+from server_stats import StatsWriter, worker_path, MSG_NAMES, MAX_DEVICES
+from shm_ring import ShmRing, DEFAULT_SLOTS, DEFAULT_SLOT_SIZE
+from ts_store import TimeSeriesStore, RAW_RETENTION
+from msg_auth import KeyRing, NONCE_LEN
+from admission import Admission, POLICIES
+from flow_control import LoadGauge, FLOW, FLOW_HIGH, FLOW_SHED
+from server_log import ServerLog, DataSummary, LazyTs, LEVELS, INFO, WARN, ERROR
 
 SERVER_IP = "0.0.0.0"
 SERVER_PORT = 5005
 
 # Header packing: !B H H d  -> 1 + 2 + 2 + 8 = 13 bytes.
 HDR_FMT = "!B H H d"
-HDR_LEN = struct.calcsize(HDR_FMT)
+HDR = struct.Struct(HDR_FMT)
+HDR_LEN = HDR.size
 
 MSG_INIT = 0
 MSG_DATA = 1
@@ -21,40 +35,228 @@ MSG_END  = 3
 MSG_HEARTBEAT = 4
 
 
+# Reorder buffer: out-of-order DATA is held at most this long (0 disables it),
+# at least REORDER_MIN_HOLD, in between REORDER_JITTER_MULT x measured jitter
 REORDER_BUFFER_SECONDS = 0.3 
+REORDER_MIN_HOLD = 0.01
+REORDER_JITTER_MULT = 4.0
+REORDER_MAX_PACKETS = 10000   # over all sessions
+REORDER_TICK = 0.02
+
+# How many seqs behind the highest one we still remember (bits per session)
+SEQ_WINDOW_SIZE = 1024
+
+# Max datagrams drained from the socket per wakeup
+RECV_BATCH = 64
+
+# Ingest process + processors over a shared-memory ring (--ring, see shm_ring.py)
+RING_SLOTS = DEFAULT_SLOTS
+RING_SLOT_SIZE = DEFAULT_SLOT_SIZE
+RING_LOG_INTERVAL = 10.0
+
+# How often the receive loops wake up for periodic work even with no traffic
+TIMER_TICK = 0.25
+
+# Console logging (overridden from the command line)
+LOG_LEVEL = INFO
+DATA_LOG_INTERVAL = 1.0   # one DATA RECEIVED line per device per second, 0 = every packet
+LATENCY_LOG_INTERVAL = 10.0   # seconds between the live LATENCY percentile lines, 0 = only at shutdown
+
+# Live stats snapshot (see server_stats.py), None = off
+STATS_FILE = None
+STATS_INTERVAL = 1.0
+
+# Admission control (admission.py): per-device DATA and global datagram budgets
+# in packets/s per process, 0 = no limit. Bursts default to a second's worth.
+RATE_LIMIT = 0.0
+RATE_BURST = None
+GLOBAL_RATE = 0.0
+GLOBAL_BURST = None
+SHED_POLICY = "drop"
+SHED_SAMPLE = 10
+
+# Message authentication (msg_auth.py), on with a key file
+AUTH_KEY_FILE = None
+# A tagged INIT also has to be fresh: its header ts newer than the device's last
+# accepted INIT and within INIT_WINDOW seconds of the server clock (0 = no window)
+INIT_WINDOW = 60.0
+# An INIT from another address doesn't take over a session that was heard from
+# in the last INIT_TAKEOVER_IDLE seconds (clients heartbeat every 3 s)
+INIT_TAKEOVER_IDLE = 5.0
+
+# Time-series store of the readings (ts_store.py), in memory unless TS_DIR is set
+TS_DIR = None
+TS_RETENTION = 0   # seconds of raw readings kept, 0 = no store (opt-in)
+
+# DATA ACKs: "packet" = one ACK per DATA (old behaviour), "cumulative" = one
+# MSG_SACK per device every ACK_EVERY packets or ACK_DELAY seconds
+ACK_MODE = "packet"
+ACK_EVERY = 8
+ACK_DELAY = 0.05
+
+# A session with no packet at all (DATA or HEARTBEAT) for this long is torn down
+SESSION_TIMEOUT = 15.0
+SESSION_WHEEL_TICK = 1.0
+SESSION_WHEEL_SLOTS = 64
+
+# Not exported by the socket module on every python version (linux value)
+SO_ATTACH_REUSEPORT_CBPF = getattr(socket, "SO_ATTACH_REUSEPORT_CBPF", 51)
 
-PACKET_LOG = "packets_log.csv"
 ANALYSIS_LOG = "packets_log_sorted_by_timestamp.csv"
+NAN = float("nan")
+
+# Global session state (for all connected devices). Only INIT creates an
+# entry, END or SESSION_TIMEOUT of silence removes it.
+sessions = {}
+# device_id -> header ts of its last accepted INIT, outlives the sessions so an
+# INIT captured earlier can't be replayed later (authenticated mode)
+init_ts = {}
+
+def new_session(addr, now):
+    return {
+        "addr": addr,
+        "seq_window": SeqWindow(SEQ_WINDOW_SIZE),
+        "last_seq": 0,
+        "last_hb": 0,
+        "jitter": 0.0,
+        "last_transit": None,
+        "delay_hist": LogHistogram(),
+        "jitter_hist": LogHistogram(),
+        "clock": ClockEstimator(),
+        "corrected_hist": LogHistogram(),
+        "last_batch_size": 1,
+        "codec": CODEC_JSON,
+        "version": 1,
+        "acks": AckTracker(),
+        "auth": None,   # session Authenticator in authenticated mode
+        "bucket": ADMISSION.device_bucket(now) if ADMISSION is not None else None,
+        "shed": 0,      # DATA shed by admission control
+        "throttled": False,   # shed since its last ACK, that one says FLOW_SHED
+        "unacked": 0,
+        "data": 0,
+        "dups": 0,
+        "gaps": 0,
+        "missing": 0,   # reading ids skipped, late arrivals give them back
+        "created": now,
+        "last_seen": now
+    }
+
+# Expiry timers, one per session (see timer_wheel.py)
+session_timers = TimerWheel(SESSION_WHEEL_TICK, SESSION_WHEEL_SLOTS, time.time())
+
+session_stats = {
+    "opened": 0,
+    "closed_end": 0,
+    "expired": 0,
+    "rejected_unknown": 0,
+    "rejected_addr": 0,
+    "rejected_auth": 0,
+    "rejected_replay": 0,
+    "rejected_takeover": 0
+}
 
-# Global session state (for all connected devices)
-sessions = defaultdict(lambda: {
-    "addr": None,
-    "received_seqs": set(),
-    "last_seq": 0,
-    "arrival_times": {},
-    "recv_buffer": deque(),
-    "last_hb": 0,
-    "last_batch_size": 1 
-})
+# zdelta (compressed) DATA, reported at shutdown: bytes on the wire vs inflated
+# vs the same readings as f32, and the time spent decoding
+compress_stats = {"packets": 0, "wire_bytes": 0, "inflated_bytes": 0, "f32_bytes": 0, "decode_s": 0.0}
 
-ALL_PACKET_ROWS = [] 
+# Per message type packet/byte counters and the time spent in the handlers,
+# the stats snapshot turns them into rates
+packet_counts = [0] * 16
+byte_counts = [0] * 16
+handler_stats = {"batches": 0, "packets": 0, "busy_s": 0.0, "bad_header": 0}
 
-def get_detailed_ts(t):
-    return datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S.%f')
+# device_id -> time its delayed cumulative ACK is due
+pending_acks = {}
+
+# ACKs are built in place in this buffer. pack_ack/pack_sack return views of
+# it, so send them before packing the next one.
+# DATA ACKs and SACKs end with the load byte (flow_control.py).
+ACK_BUF = bytearray(HDR_LEN + SACK_PAYLOAD.size + FLOW.size)
+ACK_VIEW = memoryview(ACK_BUF)
+ACK_HDR_VIEW = ACK_VIEW[:HDR_LEN]
+DATA_ACK_VIEW = ACK_VIEW[:HDR_LEN + FLOW.size]
+
+# Started per process (threads don't survive the fork of the worker pool)
+PACKET_WRITER = None
+LOG = None
+DATA_SUMMARY = None
+REORDER = None
+# one-way delay and inter-arrival jitter (|transit difference|) of every unique
+# DATA packet this process got, sessions keep their own pair too
+LATENCY = None
+next_latency_log = 0.0
+STATS = None
+RING = None   # processors: the ring they read from
+STORE = None
+KEYS = None   # KeyRing in authenticated mode
+ADMISSION = None
+LOAD = None   # LoadGauge, the load byte in the ACKs
 
 def unpack_header(raw):
     if len(raw) < HDR_LEN:
          raise ValueError("Packet too short for header")
-    header = struct.unpack(HDR_FMT, raw[:HDR_LEN])
-    header_byte, device_id, seq, timestamp = header
-    version = (header_byte >> 4) & 0xF
+    header_byte, device_id, seq, timestamp = HDR.unpack_from(raw)
+    # top bit of the version nibble is FLAG_COMPRESSED, handle_data looks at it
+    version = (header_byte >> 4) & 0x7
     msgtype = header_byte & 0xF
     return version, msgtype, device_id, seq, timestamp
 
 def pack_ack(version, device_id, ack_seq, msgtype):
     current_time = time.time()
     header_byte = ((version & 0xF) << 4) | (msgtype & 0xF)
-    return struct.pack(HDR_FMT, header_byte, device_id & 0xFFFF, ack_seq & 0xFFFF, current_time)
+    HDR.pack_into(ACK_BUF, 0, header_byte, device_id & 0xFFFF, ack_seq & 0xFFFF, current_time)
+    return ACK_HDR_VIEW
+
+def pack_data_ack(version, device_id, ack_seq, load):
+    pack_ack(version, device_id, ack_seq, MSG_ACK)
+    FLOW.pack_into(ACK_BUF, HDR_LEN, load)
+    return DATA_ACK_VIEW
+
+def pack_sack(version, device_id, cum_seq, bitmap, load):
+    header_byte = ((version & 0xF) << 4) | MSG_SACK
+    HDR.pack_into(ACK_BUF, 0, header_byte, device_id & 0xFFFF, cum_seq & 0xFFFF, time.time())
+    SACK_PAYLOAD.pack_into(ACK_BUF, HDR_LEN, bitmap)
+    FLOW.pack_into(ACK_BUF, HDR_LEN + SACK_PAYLOAD.size, load)
+    return ACK_VIEW
+
+def flow_level(session):
+    # the load byte for a DATA ACK to this session, a device that is being
+    # shed is told to back off whatever the process' load
+    if session["throttled"]:
+        session["throttled"] = False
+        level = FLOW_SHED
+    else:
+        level = LOAD.level
+    if level >= FLOW_HIGH:
+        LOAD.stats["marked"] += 1
+    return level
+
+def signed(session, pkt):
+    # authenticated sessions tag everything they send
+    auth = session["auth"]
+    return pkt if auth is None else auth.sign(pkt)
+
+def send_cumulative_ack(send, device_id):
+    session = sessions[device_id]
+    acks = session["acks"]
+    send(signed(session, pack_sack(session["version"], device_id, acks.cum, acks.sack_bitmap(), flow_level(session))),
+         session["addr"])
+    session["unacked"] = 0
+    pending_acks.pop(device_id, None)
+
+def ack_data(send, device_id, arrival_time, urgent):
+    # cumulative mode: ACK right away on every ACK_EVERY packets or when
+    # something looks wrong (dup / gap), otherwise arm the delayed ACK
+    session = sessions[device_id]
+    session["unacked"] += 1
+    if urgent or session["unacked"] >= ACK_EVERY:
+        send_cumulative_ack(send, device_id)
+    elif device_id not in pending_acks:
+        pending_acks[device_id] = arrival_time + ACK_DELAY
+
+def flush_pending_acks(send, now):
+    for device_id in [d for d, due in pending_acks.items() if due <= now]:
+        send_cumulative_ack(send, device_id)
 
 def get_batch_gap_info(readings, expected_first_id):
     # cheks for gaps *inside* the batch payload itself
@@ -74,155 +276,884 @@ def get_batch_gap_info(readings, expected_first_id):
     
     return False, []
 
+def get_id_gap_info(ids, expected_first_id):
+    # get_batch_gap_info for a plain list of reading ids (compressed payloads)
+    missing = sorted(set(range(expected_first_id, expected_first_id + len(ids))) - set(ids))
+    return bool(missing), missing
+
+def get_range_gap_info(first_id, count, expected_first_id):
+    # Same as get_batch_gap_info for the packed codecs, where the ids are always
+    # first_id .. first_id+count-1, so a contiguous batch is an O(1) check.
+    if count == 0 or first_id == expected_first_id:
+        return False, []
+    expected_end = expected_first_id + count
+    missing = list(range(expected_first_id, min(expected_end, first_id)))
+    missing += list(range(max(expected_first_id, first_id + count), expected_end))
+    return bool(missing), missing
+
+def start_packet_log(chunk_dir, prefix="w0"):
+    global PACKET_WRITER
+    PACKET_WRITER = PacketLogWriter(chunk_dir, prefix)
+
+def stop_packet_log():
+    if PACKET_WRITER is not None:
+        PACKET_WRITER.close()
+
+def start_server_log():
+    global LOG, DATA_SUMMARY
+    LOG = ServerLog(LOG_LEVEL)
+    DATA_SUMMARY = DataSummary(LOG, DATA_LOG_INTERVAL)
+
+def stop_server_log():
+    if LOG is not None:
+        DATA_SUMMARY.flush(time.time(), force=True)
+        LOG.close()
+
+def close_session(device_id, reason, now):
+    if device_id not in sessions:
+        return
+    REORDER.flush(device_id)
+    session = sessions.pop(device_id)
+    session_timers.cancel(device_id)
+    pending_acks.pop(device_id, None)
+    LOG.info(now, "[Server] Session of device %d closed (%s) after %.1fs", device_id, reason, now - session["created"])
+    if session["shed"]:
+        LOG.info(now, "[Server] SHED DATA :: DEVICE %d :: %d PACKETS OVER BUDGET", device_id, session["shed"])
+    if session["delay_hist"].total:
+        LOG.info(now, "[Server] LATENCY ms :: DEVICE %d :: DELAY %s :: JITTER %s", device_id,
+                 format_ms(session["delay_hist"]), format_ms(session["jitter_hist"]))
+    clock = session["clock"]
+    if session["corrected_hist"].total:
+        LOG.info(now, "[Server] CORRECTED DELAY ms :: DEVICE %d :: %s :: OFFSET %.3f ms +- %.3f :: DRIFT %.1f ppm :: %d SAMPLES",
+                 device_id, format_ms(session["corrected_hist"]), clock.at(now) * 1e3, clock.error * 1e3,
+                 clock.drift * 1e6, clock.count)
+
+def expire_sessions(now):
+    # only sessions whose timer fired get looked at
+    for device_id in session_timers.advance(now):
+        session = sessions.get(device_id)
+        if session is None:
+            continue
+        due = session["last_seen"] + SESSION_TIMEOUT
+        if due > now:
+            # it was active since the timer was armed, re-arm at the real deadline
+            session_timers.schedule(device_id, due)
+        else:
+            session_stats["expired"] += 1
+            close_session(device_id, "timeout", now)
+
+def tick_interval():
+    # the delayed ACK timer and the reorder hold times need a finer tick than
+    # the rest of the housekeeping
+    tick = TIMER_TICK
+    if ACK_MODE == "cumulative":
+        tick = min(tick, ACK_DELAY)
+    if REORDER_BUFFER_SECONDS > 0:
+        tick = min(tick, REORDER_TICK)
+    return tick
+
+def log_latency(now, hists, label="LATENCY"):
+    if hists["delay"].total:
+        LOG.info(now, "[Server] %s ms :: %d PACKETS :: DELAY %s :: JITTER %s", label, hists["delay"].total,
+                 format_ms(hists["delay"]), format_ms(hists["jitter"]))
+    if hists["corrected"].total:
+        # one-way delay with the client's clock offset taken out (clock_sync.py)
+        LOG.info(now, "[Server] %s ms :: %d PACKETS :: CORRECTED DELAY %s", label, hists["corrected"].total,
+                 format_ms(hists["corrected"]))
+
+def stats_snapshot(now):
+    # cumulative counters for StatsWriter, it adds the rates and socket drops
+    devices = sorted(sessions.items(), key=lambda kv: -kv[1]["missing"])[:MAX_DEVICES]
+    return {
+        "pid": os.getpid(),
+        "packets": {MSG_NAMES.get(t, str(t)): n for t, n in enumerate(packet_counts) if n},
+        "bytes": {MSG_NAMES.get(t, str(t)): n for t, n in enumerate(byte_counts) if n},
+        "handler": dict(handler_stats, us_per_packet=round(handler_stats["busy_s"] / max(handler_stats["packets"], 1) * 1e6, 2)),
+        "sessions": dict(session_stats, active=len(sessions)),
+        "reorder": dict(REORDER.stats),
+        "ring": RING.stats() if RING is not None else None,
+        "ts_store": STORE.stats() if STORE is not None else None,
+        "admission": dict(ADMISSION.stats, policy=ADMISSION.policy) if ADMISSION is not None else None,
+        "load": dict(LOAD.stats, level=LOAD.level, busy=round(LOAD.busy, 3), queue=round(LOAD.queue, 3)),
+        "latency_ms": {k: dict(zip(("p50", "p90", "p99", "p999"), [round(v * 1e3, 3) for v in h.percentiles()]))
+                       for k, h in LATENCY.items()},
+        "devices": {str(d): {"data": ss["data"], "dups": ss["dups"], "gaps": ss["gaps"], "missing": ss["missing"],
+                             "shed": ss["shed"],
+                             "loss_pct": round(100.0 * ss["missing"] / max(ss["missing"] + ss["data"], 1), 3)}
+                    for d, ss in devices},
+    }
+
+def start_process_state(chunk_dir, prefix="w0", sock=None, stats_file=None):
+    global REORDER, LATENCY, next_latency_log, STATS, STORE, ADMISSION, LOAD
+    start_packet_log(chunk_dir, prefix)
+    start_server_log()
+    if stats_file:
+        STATS = StatsWriter(stats_file, STATS_INTERVAL, sock)
+    if TS_RETENTION > 0:
+        # every worker/processor has its own store, devices are sharded anyway
+        STORE = TimeSeriesStore(os.path.join(TS_DIR, prefix) if TS_DIR else None, TS_RETENTION)
+    LOAD = LoadGauge(time.time())
+    if RATE_LIMIT > 0 or GLOBAL_RATE > 0:
+        ADMISSION = Admission(RATE_LIMIT, RATE_BURST, GLOBAL_RATE, GLOBAL_BURST, SHED_POLICY, SHED_SAMPLE, time.time())
+    LATENCY = {"delay": LogHistogram(), "jitter": LogHistogram(), "corrected": LogHistogram()}
+    next_latency_log = time.time() + LATENCY_LOG_INTERVAL
+    REORDER = ReorderBuffer(deliver_data, expected_seq, REORDER_BUFFER_SECONDS, REORDER_MIN_HOLD,
+                            REORDER_JITTER_MULT, REORDER_MAX_PACKETS)
+
+def stop_process_state(latency_dump=None):
+    # latency_dump: file for this process' histograms, the worker pool parent merges them
+    now = time.time()
+    REORDER.flush_all()
+    log_latency(now, LATENCY)
+    if STATS is not None:
+        STATS.write(now, stats_snapshot(now))
+    if STORE is not None:
+        st = STORE.stats()
+        LOG.info(now, "[Server] TS STORE :: DEVICES %d :: READINGS %d :: CHUNKS %d :: MAPPED %.1f MB :: EVICTED %d%s",
+                 st["devices"], st["readings"], st["chunks"], st["mapped_bytes"] / 1e6, st["evicted"],
+                 f" :: SAVED TO {STORE.path}" if STORE.path else "")
+        STORE.close()
+    if latency_dump:
+        with open(latency_dump, "w") as f:
+            json.dump({k: h.to_dict() for k, h in LATENCY.items()}, f)
+    LOG.info(now, "[Server] LOAD :: PEAK %d :: ACKS WITH LOAD >= %d %d", LOAD.stats["peak"], FLOW_HIGH, LOAD.stats["marked"])
+    if ADMISSION is not None:
+        st = ADMISSION.stats
+        LOG.info(now, "[Server] ADMISSION :: POLICY %s :: SHED DATA %d (GLOBAL %d, DEVICE %d) :: SHED OTHER %d :: ACK ONLY %d :: SAMPLED %d",
+                 ADMISSION.policy.upper(), st["shed_global"] + st["shed_device"], st["shed_global"], st["shed_device"],
+                 st["shed_other"], st["acked_only"], st["sampled"])
+    if REORDER_BUFFER_SECONDS > 0:
+        st = REORDER.stats
+        LOG.info(now, "[Server] REORDER BUFFER :: HELD %d :: REORDERED %d :: REAL GAPS %d :: OVERFLOW %d",
+                 st["held"], st["reordered"], st["real_gaps"], st["overflow"])
+    cs = compress_stats
+    if cs["packets"]:
+        LOG.info(now, "[Server] COMPRESSED DATA :: PACKETS %d :: WIRE %d B :: INFLATED %d B (%.2fx) :: AS F32 %d B (%.2fx) :: DECODE %.1f us/packet",
+                 cs["packets"], cs["wire_bytes"], cs["inflated_bytes"], cs["inflated_bytes"] / max(cs["wire_bytes"], 1),
+                 cs["f32_bytes"], cs["f32_bytes"] / max(cs["wire_bytes"], 1), cs["decode_s"] / cs["packets"] * 1e6)
+    stop_server_log()
+    stop_packet_log()
+
+def run_periodic(now, send):
+    # housekeeping that has to happen even when a device goes quiet
+    global next_latency_log
+    if LOAD.update(now, handler_stats["busy_s"]) >= FLOW_HIGH:
+        LOG.limited("load", WARN, now, "[Server] LOAD %d :: BUSY %.0f%% :: QUEUE %.0f%% :: ACKS ASK DEVICES TO SLOW DOWN",
+                    LOAD.level, LOAD.busy * 100, LOAD.queue * 100)
+    REORDER.tick(now)
+    DATA_SUMMARY.flush(now)
+    if LATENCY_LOG_INTERVAL > 0 and now >= next_latency_log:
+        log_latency(now, LATENCY)
+        next_latency_log = now + LATENCY_LOG_INTERVAL
+    if STATS is not None and STATS.due(now):
+        STATS.write(now, stats_snapshot(now))
+    if STORE is not None:
+        STORE.maintain(now)
+    flush_pending_acks(send, now)
+    expire_sessions(now)
+
 def write_packet_log_row(row):
-    global ALL_PACKET_ROWS
-    ALL_PACKET_ROWS.append(row)
+    PACKET_WRITER.write(row)
 
-def analyze_log_and_sort():
-    
-    if not ALL_PACKET_ROWS:
+def analyze_log_and_sort(chunk_dir):
+    # k-way merge of the sorted chunks written during the run
+    count = merge_chunk_dir(chunk_dir, ANALYSIS_LOG)
+    if not count:
         print("No packets logged to analize.")
         return
+    print(f"Analysis complete. Sorted packet log saved to {ANALYSIS_LOG}")
+
+# --- MESSAGE TYPE HANDLERS ---
+# Every handler gets the same arguments. `send` is sock.sendto for the blocking
+# engines and transport.sendto for asyncio, so the handlers don't care which
+# engine is driving them.
 
-    df = pd.DataFrame(ALL_PACKET_ROWS, columns=['device_id', 'seq', 'timestamp', 'arrival_time', 'duplicate_flag', 'gap_flag', 'payload_len'])
+def handle_init(send, pkt_addr, arrival_time, version, device_id, seq, ts, raw_pkt):
+    # Session is fresh (handle_datagram made it), confirm handshake (ACK)
+    sessions[device_id]["seq_window"].mark(0)
+    sessions[device_id]["version"] = version
+
+    # Payload codec (and compression) negotiation, old clients don't send
+    # "codecs" and get json, no "compress" means no compressed DATA
+    try:
+        # str(buffer, encoding) decodes bytes and ring memoryviews alike
+        init_obj = json.loads(str(raw_pkt[HDR_LEN:], 'utf-8')) if len(raw_pkt) > HDR_LEN else {}
+        if not isinstance(init_obj, dict):
+            init_obj = {}
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        init_obj = {}
+    codec = choose_codec(init_obj.get("codecs"))
+    compress = choose_compress(init_obj.get("compress"))
+    sessions[device_id]["codec"] = codec
+    # (t1, t2) for the client's first clock offset sample
+    reply = {"status": "ok", "codec": codec, "clock": [ts, arrival_time], "load": LOAD.level}
+    if compress:
+        reply["compress"] = compress
+    if KEYS is not None:
+        # the INIT's tag was good, the session key mixes in both nonces
+        try:
+            client_nonce = bytes.fromhex(init_obj.get("auth", ""))
+        except (TypeError, ValueError):
+            client_nonce = b""
+        server_nonce, sessions[device_id]["auth"] = KEYS.new_session(device_id, client_nonce[:NONCE_LEN])
+        reply["auth"] = server_nonce.hex()
     
-    # Convert timestamp columns to datetime objects
-    df['timestamp'] = pd.to_datetime(df['timestamp'], format='%Y-%m-%d %H:%M:%S.%f')
-    df['arrival_time'] = pd.to_datetime(df['arrival_time'], format='%Y-%m-%d %H:%M:%S.%f')
+    ack = bytes(pack_ack(version, device_id, seq, MSG_ACK)) + json.dumps(reply).encode()
+    send(signed(sessions[device_id], ack), pkt_addr)
+    LOG.info(arrival_time, "[Server] INIT from device %d seq=%d codec=%s%s. ACK sent.", device_id, seq, codec,
+             " compress=" + compress if compress else "")
+
+def handle_heartbeat(send, pkt_addr, arrival_time, version, device_id, seq, ts, raw_pkt):
+    # update time, take the clock sample the client sent along (if any) and ACK
+    session = sessions[device_id]
+    session["last_hb"] = arrival_time
+    if len(raw_pkt) >= HDR_LEN + CLOCK_SAMPLE.size:
+        clock = session["clock"]
+        if clock.add(*CLOCK_SAMPLE.unpack_from(raw_pkt, HDR_LEN)) and clock.at(arrival_time) is not None:
+            LOG.limited("clock", INFO, arrival_time, "[Server] CLOCK :: DEVICE %d :: OFFSET %.3f ms +- %.3f :: DRIFT %.1f ppm",
+                        device_id, clock.at(arrival_time) * 1e3, clock.error * 1e3, clock.drift * 1e6)
+
+    # the ACK echoes (t1, t2) for the client's next clock sample
+    ack = bytes(pack_ack(version, device_id, seq, MSG_ACK)) + CLOCK_ECHO.pack(ts, arrival_time)
+    send(signed(session, ack), pkt_addr)
+    LOG.limited("heartbeat", INFO, arrival_time, "[Server] HEARTBEAT from device %d. ACK sent.", device_id)
+
+def handle_end(send, pkt_addr, arrival_time, version, device_id, seq, ts, raw_pkt):
+    # client is done: settle the last cumulative ACK, ACK the END and forget it
+    if device_id in pending_acks:
+        send_cumulative_ack(send, device_id)
+    ack = pack_ack(version, device_id, seq, MSG_ACK)
+    send(signed(sessions[device_id], ack), pkt_addr)
+    session_stats["closed_end"] += 1
+    close_session(device_id, "END", arrival_time)
+
+def handle_data(send, pkt_addr, arrival_time, version, device_id, seq, ts, raw_pkt):
+    payload_len = len(raw_pkt) - HDR_LEN
     
-    # Sort by the client's timestamp
-    df_sorted = df.sort_values(by='timestamp').reset_index(drop=True)
+    # Wire seq is 16 bits, work on the extended (wrap-free) seq from here on
+    session = sessions[device_id]
+    window = session["seq_window"]
+    ext_seq = window.extend(seq)
+    seq_state = window.mark(ext_seq)
+    is_dup = seq_state != SEQ_NEW
+    # server - client clock offset, NaN in the packet log until the first sample
+    offset = session["clock"].at(arrival_time)
+    if offset is None:
+        offset = NAN
     
-    # Calculate Network Delay (Latency).
-    df_sorted['network_delay_s'] = (df_sorted['arrival_time'] - df_sorted['timestamp']).dt.total_seconds().round(6)
+    # 1. Duplicate check and suppression
+    if is_dup:
+        session["dups"] += 1
+        # Log it as a duplicate, then ignore the payload.
+        row = [device_id, ext_seq, ts, arrival_time, 1, 0, payload_len, offset]
+        write_packet_log_row(row)
+        
+        if seq_state == SEQ_STALE:
+            LOG.limited("stale", WARN, arrival_time, "[Server] DATA from device %d seq=%d is older than the seq window. Ignoring.", device_id, seq)
+        else:
+            LOG.limited("duplicate", INFO, arrival_time, "[Server] Duplicate DATA from device %d seq=%d. Ignoring.", device_id, seq)
+        if ACK_MODE == "cumulative":
+            # the client probably lost our ACK, tell it where we are now
+            ack_data(send, device_id, arrival_time, urgent=True)
+        else:
+            ack = pack_data_ack(version, device_id, seq, flow_level(session))
+            send(signed(session, ack), pkt_addr)
+        return 
     
-    # Save the sorted data to a new CSV file
-    df_sorted.to_csv(ANALYSIS_LOG, index=False, date_format='%Y-%m-%d %H:%M:%S.%f')
-    print(f"Analysis complete. Sorted packet log saved to {ANALYSIS_LOG}")
+    # 2. Payload processing
+    # readings are stored at the packet's send time on the server clock
+    reading_time = ts + offset if offset == offset else arrival_time
+    codec = session["codec"]
+    try:
+        payload = raw_pkt[HDR_LEN:]
+        if raw_pkt[0] & FLAG_COMPRESSED:
+            codec = "zdelta"
+            t0 = time.perf_counter()
+            first_id, batch_size, values, unit, ids, inflated = decode_zdelta(payload)
+            compress_stats["decode_s"] += time.perf_counter() - t0
+            compress_stats["packets"] += 1
+            compress_stats["wire_bytes"] += payload_len
+            compress_stats["inflated_bytes"] += inflated
+            compress_stats["f32_bytes"] += 8 + 4 * batch_size
+            batch_gap_info = get_id_gap_info(ids, ext_seq & 0xFFFFFFFF)
+            if STORE is not None:
+                STORE.add(device_id, reading_time, first_id, values, unit, ids)
+        elif codec == CODEC_JSON:
+            payload_obj = json.loads(str(payload, 'utf-8'))
+            readings = payload_obj.get("batch", [])
+            batch_size = len(readings)
+            
+            # Internal Batch Gap Check 
+            batch_gap_info = get_batch_gap_info(readings, ext_seq)
+            if STORE is not None:
+                STORE.add_json(device_id, reading_time, readings)
+        else:
+            first_id, batch_size, values, unit = decode_packed(payload)
+            batch_gap_info = get_range_gap_info(first_id, batch_size, ext_seq & 0xFFFFFFFF)
+            if STORE is not None:
+                STORE.add(device_id, reading_time, first_id, values, unit)
+
+    except (UnicodeDecodeError, ValueError):
+        # json.JSONDecodeError is a ValueError too
+        LOG.limited("decode_fail", ERROR, arrival_time, "[Server] %s decode fail from device %d seq=%d. Payload ignored.", codec.upper(), device_id, seq)
+        batch_size = 0
+        batch_gap_info = (False, [])
+
+    # Jitter estimate (RFC 3550 style), the clock offset cancels out in the difference
+    transit = arrival_time - ts
+    session["delay_hist"].record(transit)
+    LATENCY["delay"].record(transit)
+    if offset == offset:
+        session["corrected_hist"].record(transit - offset)
+        LATENCY["corrected"].record(transit - offset)
+    if session["last_transit"] is not None:
+        d = abs(transit - session["last_transit"])
+        session["jitter"] += (d - session["jitter"]) / 16.0
+        session["jitter_hist"].record(d)
+        LATENCY["jitter"].record(d)
+    session["last_transit"] = transit
+
+    if ACK_MODE == "cumulative":
+        session["version"] = version
+        session["acks"].add(ext_seq, batch_size if batch_size > 0 else 1)
+        ack_data(send, device_id, arrival_time, urgent=ext_seq > expected_seq(device_id))
+    else:
+        ack = pack_data_ack(version, device_id, seq, flow_level(session))
+        send(signed(session, ack), pkt_addr)
+
+    # In-order part (gap detection, logging) goes through the reorder buffer
+    item = (ext_seq, seq, ts, arrival_time, payload_len, batch_size, batch_gap_info, offset)
+    REORDER.add(device_id, ext_seq, item, arrival_time, session["jitter"])
+
+def shed_data(session, device_id, admitted, arrival_time):
+    # a session's DATA against its bucket (admitted: it got past the global
+    # one) -> True if it's shed, the policy says what happens to it then
+    bucket = session["bucket"]
+    if admitted and (bucket is None or bucket.take(arrival_time)):
+        return False
+    session["throttled"] = True
+    if ADMISSION.shed(session, not admitted):
+        return False
+    LOG.limited("shed", WARN, arrival_time, "[Server] SHEDDING DATA :: DEVICE %d :: OVER THE %s BUDGET :: POLICY %s",
+                device_id, "DEVICE" if admitted else "GLOBAL", ADMISSION.policy.upper())
+    return True
+
+def ack_only(send, pkt_addr, arrival_time, version, device_id, seq):
+    # ack-only shedding: ACK the DATA without decoding or logging it. A
+    # cumulative ACK assumes the device's last batch size.
+    session = sessions[device_id]
+    ADMISSION.stats["acked_only"] += 1
+    if ACK_MODE == "cumulative":
+        session["version"] = version
+        session["acks"].add(session["seq_window"].extend(seq), session["last_batch_size"])
+        ack_data(send, device_id, arrival_time, urgent=False)
+    else:
+        send(signed(session, pack_data_ack(version, device_id, seq, flow_level(session))), pkt_addr)
+
+def expected_seq(device_id):
+    session = sessions[device_id]
+    return session["last_seq"] + session["last_batch_size"]
+
+def deliver_data(device_id, item):
+    # Called in seq order by the reorder buffer (or right away when it's off)
+    ext_seq, seq, ts, arrival_time, payload_len, batch_size, batch_gap_info, offset = item
+    session = sessions[device_id]
+
+    # 2. Sequence Gap Detection 
+    expected_next_seq = session["last_seq"] + session["last_batch_size"]
+    packet_gap_flag = ext_seq > expected_next_seq
+    session["data"] += 1
+    if packet_gap_flag:
+        session["gaps"] += 1
+        session["missing"] += ext_seq - expected_next_seq
+        if ACK_MODE == "cumulative":
+            # the reorder buffer gave up on the hole, so does the cumulative ACK
+            session["acks"].skip_to(ext_seq)
+    elif ext_seq < expected_next_seq and session["missing"]:
+        # came after the gap it was in had been given up on
+        session["missing"] = max(0, session["missing"] - max(batch_size, 1))
+    
+    if ext_seq >= session["last_seq"]:
+        session["last_seq"] = ext_seq
+        session["last_batch_size"] = batch_size if batch_size > 0 else 1
 
-def run_server():
+    # Log the packet 
+    row = [device_id, ext_seq, ts, arrival_time, 0, int(packet_gap_flag), payload_len, offset]
+    write_packet_log_row(row) 
+
+    if DATA_SUMMARY.interval > 0:
+        DATA_SUMMARY.add(arrival_time, device_id, ext_seq, batch_size, payload_len, packet_gap_flag)
+        if packet_gap_flag:
+            LOG.limited("gap", WARN, arrival_time, "[Server] MISSING PACKET :: DEVICE %d :: BEFORE SEQ %d", device_id, seq)
+    else:
+        LOG.info(arrival_time, "DATA RECEIVED :: DEVICE %d :: SEQ %d :: BATCH %d :: SIZE %d :: CLIENT TS %s%s",
+                 device_id, seq, batch_size, payload_len, LazyTs(ts),
+                 " :: MISSING PACKET BEFORE THIS" if packet_gap_flag else "")
+    if batch_gap_info[0]:
+        LOG.limited("batch_gap", WARN, arrival_time, "[Server] BATCH MISSING IDS :: DEVICE %d :: SEQ %d :: %s",
+                    device_id, seq, batch_gap_info[1])
+
+MSG_HANDLERS = {
+    MSG_INIT: handle_init,
+    MSG_HEARTBEAT: handle_heartbeat,
+    MSG_DATA: handle_data,
+    MSG_END: handle_end,
+}
+
+def handle_datagram(send, raw_pkt, pkt_addr, arrival_time):
+    try:
+        version, msgtype, device_id, seq, ts = unpack_header(raw_pkt)
+    except (struct.error, ValueError):
+        handler_stats["bad_header"] += 1
+        LOG.limited("bad_header", ERROR, arrival_time, "[Server] Error unpacking header from %s. discarding.", pkt_addr)
+        return
+    packet_counts[msgtype] += 1
+    byte_counts[msgtype] += len(raw_pkt)
+
+    # Admission control: the global budget for everything, DATA also has to get
+    # past its device's bucket once the session is known. Only DATA of a live
+    # session is shed by the policy, anything else over budget is dropped here.
+    admitted = True
+    if ADMISSION is not None:
+        admitted = ADMISSION.admit(arrival_time)
+        if not admitted and (msgtype != MSG_DATA or device_id not in sessions):
+            ADMISSION.stats["shed_other"] += 1
+            return
+
+    # Session Initialization/Lookup. Only INIT may open (or restart) a session,
+    # anything else has to come from the address that did the INIT.
+    if msgtype == MSG_INIT:
+        if KEYS is not None:
+            # tagged with the device key, checked before anything is decoded
+            raw_pkt = KEYS.device(device_id).check(raw_pkt)
+            if raw_pkt is None:
+                session_stats["rejected_auth"] += 1
+                LOG.limited("bad_auth", WARN, arrival_time, "[Server] INIT for device %d from %s with a bad auth tag. discarding.", device_id, pkt_addr)
+                return
+            # the tag makes ts trustworthy, a replayed INIT is an old one
+            last_ts = init_ts.get(device_id)
+            if (last_ts is not None and ts <= last_ts) or (INIT_WINDOW > 0 and abs(arrival_time - ts) > INIT_WINDOW):
+                session_stats["rejected_replay"] += 1
+                LOG.limited("init_replay", WARN, arrival_time, "[Server] Stale INIT for device %d from %s (ts %.3f). discarding.", device_id, pkt_addr, ts)
+                return
+        restarted = device_id in sessions
+        if restarted and sessions[device_id]["addr"] != pkt_addr and arrival_time - sessions[device_id]["last_seen"] < INIT_TAKEOVER_IDLE:
+            # the device is still talking from its old address
+            session_stats["rejected_takeover"] += 1
+            LOG.limited("init_takeover", WARN, arrival_time, "[Server] INIT for device %d from %s, its session at %s is still active. discarding.",
+                        device_id, pkt_addr, sessions[device_id]["addr"])
+            return
+        if KEYS is not None:
+            init_ts[device_id] = ts
+        if restarted:
+            # whatever the old session still holds belongs to the old seq space
+            REORDER.flush(device_id)
+        sessions[device_id] = new_session(pkt_addr, arrival_time)
+        session_timers.schedule(device_id, arrival_time + SESSION_TIMEOUT)
+        session_stats["opened"] += 1
+        LOG.info(arrival_time, "[Server] %s session started by device %d at %s", "Restarted" if restarted else "New", device_id, pkt_addr)
+    else:
+        session = sessions.get(device_id)
+        if session is None:
+            session_stats["rejected_unknown"] += 1
+            LOG.limited("no_session", WARN, arrival_time, "[Server] Type %d from device %d at %s without a session. discarding.", msgtype, device_id, pkt_addr)
+            return
+        if session["addr"] != pkt_addr:
+            session_stats["rejected_addr"] += 1
+            LOG.limited("wrong_addr", WARN, arrival_time, "[Server] Type %d for device %d from %s, session belongs to %s. discarding.", msgtype, device_id, pkt_addr, session["addr"])
+            return
+        if KEYS is not None:
+            # forged (or from an older session), dropped before any decoding
+            raw_pkt = session["auth"].check(raw_pkt)
+            if raw_pkt is None:
+                session_stats["rejected_auth"] += 1
+                LOG.limited("bad_auth", WARN, arrival_time, "[Server] Type %d for device %d from %s with a bad auth tag. discarding.", msgtype, device_id, pkt_addr)
+                return
+        session["last_seen"] = arrival_time
+        # charged to the device only after the tag check, so a forged packet
+        # from a spoofed address can't get the real device shed
+        if msgtype == MSG_DATA and ADMISSION is not None and shed_data(session, device_id, admitted, arrival_time):
+            if ADMISSION.policy == "ack-only":
+                ack_only(send, pkt_addr, arrival_time, version, device_id, seq)
+            return
+
+    handler = MSG_HANDLERS.get(msgtype)
+    if handler is None:
+        LOG.limited("unknown_type", WARN, arrival_time, "UNKOWN MESSAGE TYPE :: DEVICE %d :: TYPE: %d", device_id, msgtype)
+        return
+    handler(send, pkt_addr, arrival_time, version, device_id, seq, ts, raw_pkt)
+
+def recv_batch(sock, max_batch=RECV_BATCH, timeout=None):
+    # recvmmsg-style: wait for the socket to become readable, then drain
+    # whatever is already queued in the socket buffer without blocking again.
+    # Returns [] when nothing arrived within `timeout`.
+    if not select.select([sock], [], [], timeout)[0]:
+        return []
+    batch = []
+    while len(batch) < max_batch:
+        try:
+            raw, addr = sock.recvfrom(65535, socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            break
+        batch.append((raw, addr, time.time()))
+    return batch
+
+def serve_socket(sock):
+    send = sock.sendto
+    tick = tick_interval()
+    next_tick = time.time() + tick
+    while True:
+        wait = max(0.0, next_tick - time.time())
+        batch = recv_batch(sock, timeout=wait)
+        if batch:
+            LOAD.depth(len(batch) / RECV_BATCH)
+            t0 = time.perf_counter()
+            for raw_pkt, pkt_addr, arrival_time in batch:
+                handle_datagram(send, raw_pkt, pkt_addr, arrival_time)
+            handler_stats["busy_s"] += time.perf_counter() - t0
+            handler_stats["batches"] += 1
+            handler_stats["packets"] += len(batch)
+        now = time.time()
+        if now >= next_tick:
+            run_periodic(now, send)
+            next_tick = now + tick
+
+# --- ASYNCIO ENGINE ---
+
+class ITPServerProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        # transport.sendto never blocks, it queues the ACK if the socket is full
+        t0 = time.perf_counter()
+        handle_datagram(self.transport.sendto, data, addr, time.time())
+        handler_stats["busy_s"] += time.perf_counter() - t0
+        handler_stats["batches"] += 1
+        handler_stats["packets"] += 1
+
+    def error_received(self, exc):
+        LOG.limited("socket_error", ERROR, time.time(), "[Server] Socket error: %s", exc)
+
+async def serve_forever_async(sock):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(ITPServerProtocol, sock=sock)
+    try:
+        tick = tick_interval()
+        while True:
+            await asyncio.sleep(tick)
+            run_periodic(time.time(), transport.sendto)
+    finally:
+        transport.close()
+
+def serve_socket_async(sock):
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    asyncio.run(serve_forever_async(sock))
+
+ENGINES = {
+    "blocking": serve_socket,
+    "asyncio": serve_socket_async,
+}
+
+def run_server(engine="blocking"):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind((SERVER_IP, SERVER_PORT))
-    print(f"UDP server listening on {SERVER_IP}:{SERVER_PORT}")
+    print(f"UDP server listening on {SERVER_IP}:{SERVER_PORT} ({engine} engine)")
 
+    # Chunk dir is named after our pid so run_expirments can find it after a SIGKILL
+    chunk_dir = run_chunk_dir(os.getpid())
+    start_process_state(chunk_dir, sock=sock, stats_file=STATS_FILE)
+    try:
+        ENGINES[engine](sock)
+    except KeyboardInterrupt:
+        # a second Ctrl+C must not cut the flush and the log merge short
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        stop_process_state()
+        print("\nSHUTDOWN REQUESTED. PROCESSING LOGS...")
+        analyze_log_and_sort(chunk_dir)
+    finally:
+        sock.close()
+
+# --- WORKER POOL (SO_REUSEPORT) ---
+
+def attach_device_shard_filter(sock, num_workers):
+    # Classic BPF program run by the kernel for the reuseport group. It sees the
+    # UDP payload at offset 0, so it loads the device_id (offset 1, !H) and
+    # returns device_id % num_workers as the index of the socket to deliver to.
+    # That keeps every device on the same worker, so each worker owns its piece
+    # of the sessions table.
+    prog = b"".join([
+        struct.pack("HBBI", 0x28, 0, 0, 1),            # ldh [1]
+        struct.pack("HBBI", 0x94, 0, 0, num_workers),  # mod #num_workers
+        struct.pack("HBBI", 0x16, 0, 0, 0),            # ret a
+    ])
+    prog_buf = ctypes.create_string_buffer(prog)
+    fprog = struct.pack("HL", len(prog) // 8, ctypes.addressof(prog_buf))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_REUSEPORT_CBPF, fprog)
+
+def interrupt_once(signum, frame):
+    # Children stop on the first SIGINT and ignore the rest. A Ctrl+C reaches
+    # the whole process group and the parent forwards another one, the second
+    # must not land in the middle of the flush.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+def worker_main(worker_id, sock, engine, chunk_dir):
+    signal.signal(signal.SIGINT, interrupt_once)
+    start_process_state(chunk_dir, f"w{worker_id}", sock, worker_path(STATS_FILE, worker_id) if STATS_FILE else None)
+    try:
+        ENGINES[engine](sock)
+    except KeyboardInterrupt:
+        stop_process_state(os.path.join(chunk_dir, f"w{worker_id}_latency.json"))
+    finally:
+        sock.close()
+
+def run_worker_pool(num_workers, engine="blocking"):
+    socks = []
+    for _ in range(num_workers):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        s.bind((SERVER_IP, SERVER_PORT))
+        socks.append(s)
+
+    try:
+        attach_device_shard_filter(socks[0], num_workers)
+        print(f"UDP server listening on {SERVER_IP}:{SERVER_PORT} with {num_workers} workers (sharded by device_id)")
+    except OSError as e:
+        # Without the filter the kernel hashes on the source address instead,
+        # a device still sticks to one worker as long as its port does not change.
+        print(f"UDP server listening on {SERVER_IP}:{SERVER_PORT} with {num_workers} workers (kernel hash, BPF shard failed: {e})")
+
+    # Every worker writes its own chunks into the same dir, merged below
+    chunk_dir = run_chunk_dir(os.getpid())
+    ctx = multiprocessing.get_context("fork")
+    workers = []
+    for worker_id, s in enumerate(socks):
+        p = ctx.Process(target=worker_main, args=(worker_id, s, engine, chunk_dir), daemon=True)
+        p.start()
+        workers.append(p)
+    for s in socks:
+        s.close()
+
+    try:
+        for p in workers:
+            p.join()
+    except KeyboardInterrupt:
+        # the workers ignore a second Ctrl+C, so does the merge below
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        print("\nSHUTDOWN REQUESTED. WAITING FOR WORKERS...")
+        for p in workers:
+            if p.is_alive():
+                # In case only the parent got the Ctrl+C
+                os.kill(p.pid, signal.SIGINT)
+        for p in workers:
+            p.join()
+
+    print("MERGING WORKER LOGS...")
+    merge_latency(chunk_dir)
+    analyze_log_and_sort(chunk_dir)
+
+def merge_latency(chunk_dir):
+    # add up the workers' histograms into the percentiles of the whole server
+    merged = {"delay": LogHistogram(), "jitter": LogHistogram(), "corrected": LogHistogram()}
+    for path in sorted(glob.glob(os.path.join(chunk_dir, "*_latency.json"))):
+        with open(path) as f:
+            for k, d in json.load(f).items():
+                merged.setdefault(k, LogHistogram()).merge(LogHistogram.from_dict(d))
+        os.remove(path)
+    if merged["delay"].total:
+        print(f"LATENCY ms (ALL WORKERS) :: {merged['delay'].total} PACKETS :: DELAY {format_ms(merged['delay'])} :: "
+              f"JITTER {format_ms(merged['jitter'])}")
+    if merged["corrected"].total:
+        print(f"LATENCY ms (ALL WORKERS) :: {merged['corrected'].total} PACKETS :: CORRECTED DELAY {format_ms(merged['corrected'])}")
+
+# --- SHARED-MEMORY RING (ingest process + processors) ---
+
+def ring_line(ring):
+    st = ring.stats()
+    return (f"RING :: OCCUPANCY {st['occupancy']}/{st['slots']} :: HIGH WATER {st['high_water']} :: RECEIVED {st['received']} :: "
+            f"OVERRUNS {st['overruns']} :: OVERSIZE {st['oversize']} :: HANDLED {' '.join(map(str, st['handled']))}")
+
+def ingest_loop(sock, ring):
+    # the ingest process only moves datagrams from the socket into the ring
+    next_log = time.time() + RING_LOG_INTERVAL
+    while True:
+        select.select([sock], [], [], 1.0)
+        for _ in range(RECV_BATCH):
+            try:
+                ring.recv_into(sock, time.time())
+            except (BlockingIOError, InterruptedError):
+                break
+        ring.publish()
+        if RING_LOG_INTERVAL > 0 and time.time() >= next_log:
+            print(f"[{LazyTs(time.time())}] [Ingest] {ring_line(ring)}", flush=True)
+            next_log = time.time() + RING_LOG_INTERVAL
+
+def processor_main(k, sock, ring, chunk_dir):
+    # processor k: its share of the devices (device_id % processors) from the ring,
+    # ACKs go out on the server socket it inherited
+    global RING
+    RING = ring
+    signal.signal(signal.SIGINT, interrupt_once)
+    start_process_state(chunk_dir, f"p{k}", sock, worker_path(STATS_FILE, k) if STATS_FILE else None)
+    send = sock.sendto
+
+    def handle(view, addr, arrival_time):
+        handler_stats["packets"] += 1
+        handle_datagram(send, view, addr, arrival_time)
+
+    tick = tick_interval()
+    next_tick = time.time() + tick
     try:
         while True:
-            raw, addr = sock.recvfrom(65535) 
-            arrival_time = time.time()
-            arrival_ts_str = get_detailed_ts(arrival_time)
+            t0 = time.perf_counter()
+            walked = ring.drain(k, handle, RING_SLOTS)
+            if walked:
+                LOAD.depth(walked / RING_SLOTS)
+                handler_stats["busy_s"] += time.perf_counter() - t0
+                handler_stats["batches"] += 1
+            now = time.time()
+            if now >= next_tick:
+                run_periodic(now, send)
+                next_tick = now + tick
+            if not walked:
+                ring.wait(k, max(0.0, next_tick - time.time()))
+    except KeyboardInterrupt:
+        # whatever the ingest already took in still gets processed and logged
+        while ring.drain(k, handle, RING_SLOTS):
+            pass
+        stop_process_state(os.path.join(chunk_dir, f"p{k}_latency.json"))
+    finally:
+        ring.close()
 
-            # Netem already handled the impairment. Direct processing.
-            out_list = [(raw, addr)]
-            
-            for raw_pkt, pkt_addr in out_list:
-                
-                try:
-                    version, msgtype, device_id, seq, ts = unpack_header(raw_pkt)
-                    payload_len = len(raw_pkt) - HDR_LEN
-                    ts_str = get_detailed_ts(ts)
-                except struct.error:
-                    print(f"[{arrival_ts_str}] [Server] Error unpacking header from {pkt_addr}. discarding.")
-                    continue
-
-                # Session Initialization/Lookup
-                session = sessions[device_id]
-                if session["addr"] is None:
-                    session["addr"] = pkt_addr
-                    print(f"[{arrival_ts_str}] [Server] New session started by device {device_id} at {pkt_addr}")
-
-                # --- MESSAGE TYPE HANDLERS ---
-
-                if msgtype == MSG_INIT:
-                    # Clear state and confirm handshake (ACK)
-                    sessions[device_id]["received_seqs"] = {0} 
-                    sessions[device_id]["last_seq"] = 0
-                    
-                    ack = pack_ack(version, device_id, seq, MSG_ACK)
-                    sock.sendto(ack, pkt_addr)
-                    print(f"[{arrival_ts_str}] [Server] INIT from device {device_id} seq={seq}. ACK sent.")
-                    continue
-
-                if msgtype == MSG_HEARTBEAT:
-                    # just update time and ACK
-                    sessions[device_id]["last_hb"] = arrival_time
-                    
-                    ack = pack_ack(version, device_id, seq, MSG_ACK)
-                    sock.sendto(ack, pkt_addr)
-                    print(f"[{arrival_ts_str}] [Server] HEARTBEAT from device {device_id}. ACK sent.")
-                    continue
-
-                if msgtype == MSG_DATA:
-                    
-                    is_dup = seq in sessions[device_id]["received_seqs"]
-                    packet_gap_flag = False
-                    
-                    # 1. Duplicate check and suppression
-                    if is_dup:
-                        # Log it as a duplicate, then ignore the payload.
-                        row = [device_id, seq, ts, arrival_time, 1, 0, payload_len]
-                        write_packet_log_row(row)
-                        
-                        print(f"[{arrival_ts_str}] [Server] Duplicate DATA from device {device_id} seq={seq}. Ignoring.")
-                        ack = pack_ack(version, device_id, seq, MSG_ACK)
-                        sock.sendto(ack, pkt_addr)
-                        continue 
-                    
-                    # 2. Sequence Gap Detection 
-                    expected_next_seq = sessions[device_id]["last_seq"] + sessions[device_id]["last_batch_size"]
-                    
-                    if seq > expected_next_seq:
-                        packet_gap_flag = True
-                    
-                    # Update state
-                    sessions[device_id]["received_seqs"].add(seq)
-                    
-                    # 3. Payload processing
-                    try:
-                        payload = raw_pkt[HDR_LEN:]
-                        payload_obj = json.loads(payload.decode('utf-8'))
-                        readings = payload_obj.get("batch", [])
-                        batch_size = len(readings)
-                        
-                        # Internal Batch Gap Check 
-                        batch_gap_info = get_batch_gap_info(readings, seq)
-                        
-                        sessions[device_id]["last_seq"] = max(sessions[device_id]["last_seq"], seq)
-                        sessions[device_id]["last_batch_size"] = batch_size if batch_size > 0 else 1
-
-                    except json.JSONDecodeError:
-                        print(f"[{arrival_ts_str}] [Server] JSON decode fail from device {device_id} seq={seq}. Payload ignored.")
-                        batch_size = 0
-                        batch_gap_info = (False, [])
-                        sessions[device_id]["last_batch_size"] = 1 
-
-                    # Log the packet 
-                    row = [device_id, seq, ts, arrival_time, int(is_dup), int(packet_gap_flag), payload_len]
-                    write_packet_log_row(row) 
-
-                    log_output = f"[{arrival_ts_str}] DATA RECEIVED :: DEVICE {device_id} :: SEQ {seq} :: BATCH {batch_size} :: SIZE {payload_len} :: CLIENT TS {ts_str}"
-                    
-                    if packet_gap_flag:
-                        log_output += " :: MISSING PACKET BEFORE THIS"
-                    if batch_gap_info[0]:
-                        log_output += f" :: BATCH MISSING IDS: {', '.join(map(str, batch_gap_info[1]))}"
-                    print(log_output)
-
-                    ack = pack_ack(version, device_id, seq, MSG_ACK)
-                    sock.sendto(ack, pkt_addr)
-                    continue
-
-                print(f"[{arrival_ts_str}] UNKOWN MESSAGE TYPE :: DEVICE {device_id} :: TYPE: {msgtype}")
+def run_ring_server(processors):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((SERVER_IP, SERVER_PORT))
+    ring = ShmRing(processors, RING_SLOTS, RING_SLOT_SIZE)
+    print(f"UDP server listening on {SERVER_IP}:{SERVER_PORT} (ingest process + {processors} processors, "
+          f"{RING_SLOTS} x {RING_SLOT_SIZE} B shared-memory ring)")
+
+    chunk_dir = run_chunk_dir(os.getpid())
+    ctx = multiprocessing.get_context("fork")
+    procs = []
+    for k in range(processors):
+        p = ctx.Process(target=processor_main, args=(k, sock, ring, chunk_dir), daemon=True)
+        p.start()
+        procs.append(p)
 
+    try:
+        ingest_loop(sock, ring)
     except KeyboardInterrupt:
-        print("\nSHUTDOWN REQUESTED. PROCESSING LOGS...")
-        analyze_log_and_sort()
+        # the processors ignore a second Ctrl+C, so does the merge below
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        ring.publish()
+        print("\nSHUTDOWN REQUESTED. WAITING FOR PROCESSORS...")
+        for p in procs:
+            if p.is_alive():
+                # In case only the ingest process got the Ctrl+C, all of them at
+                # once so they drain in parallel
+                os.kill(p.pid, signal.SIGINT)
+        for p in procs:
+            p.join()
+        print(ring_line(ring))
+        print("MERGING PROCESSOR LOGS...")
+        merge_latency(chunk_dir)
+        analyze_log_and_sort(chunk_dir)
     finally:
+        ring.close(unlink=True)
         sock.close()
 
 if __name__ == "__main__":
-    # Check pandas
-    try:
-        import pandas as pd
-        run_server()
-    except ImportError:
-        print("Error: pandas library not found. Please install with 'pip install pandas' to enable analysis.")
+    parser = argparse.ArgumentParser(description="ITP UDP server")
+    parser.add_argument("--port", type=int, default=SERVER_PORT,
+                        help="UDP port to listen on (default 5005)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of SO_REUSEPORT worker processes (default 1 = single process)")
+    parser.add_argument("--ring", type=int, default=0, metavar="PROCESSORS",
+                        help="ingest process + this many processor processes over a shared-memory ring (default 0 = off)")
+    parser.add_argument("--ring-slots", type=int, default=RING_SLOTS,
+                        help="ring mode: datagrams the ring holds (default %(default)s)")
+    parser.add_argument("--ring-slot-size", type=int, default=RING_SLOT_SIZE,
+                        help="ring mode: bytes per slot incl. a 24 byte header, bigger datagrams are dropped (default %(default)s)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="blocking",
+                        help="receive loop: blocking recvfrom drain or asyncio (uses uvloop if installed)")
+    parser.add_argument("--log-level", choices=list(LEVELS), default="INFO",
+                        help="console log level (default INFO)")
+    parser.add_argument("--data-log-interval", type=float, default=DATA_LOG_INTERVAL,
+                        help="seconds between DATA RECEIVED summaries per device, 0 logs every packet (default 1)")
+    parser.add_argument("--latency-log-interval", type=float, default=LATENCY_LOG_INTERVAL,
+                        help="seconds between the live one-way delay/jitter percentile lines, 0 = only at shutdown (default 10)")
+    parser.add_argument("--stats-file", default=STATS_FILE,
+                        help="rewrite a JSON stats snapshot here every --stats-interval seconds, per worker with --workers (default off)")
+    parser.add_argument("--stats-interval", type=float, default=STATS_INTERVAL,
+                        help="seconds between stats snapshots (default 1)")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT,
+                        help="DATA packets/s a device may send before it is shed (token bucket, per process), 0 = no limit (default)")
+    parser.add_argument("--rate-burst", type=float, default=RATE_BURST,
+                        help="per-device bucket size in packets (default one second of --rate-limit)")
+    parser.add_argument("--global-rate", type=float, default=GLOBAL_RATE,
+                        help="datagrams/s the process handles in total before shedding, 0 = no limit (default)")
+    parser.add_argument("--global-burst", type=float, default=GLOBAL_BURST,
+                        help="global bucket size in packets (default one second of --global-rate)")
+    parser.add_argument("--shed-policy", choices=POLICIES, default=SHED_POLICY,
+                        help="DATA over budget: drop it, ACK it without processing, or sample (process 1 in --shed-sample) (default drop)")
+    parser.add_argument("--shed-sample", type=int, default=SHED_SAMPLE,
+                        help="sample policy: process every Nth shed DATA packet of a device (default 10)")
+    parser.add_argument("--auth-key-file", default=AUTH_KEY_FILE,
+                        help="authenticated mode: every datagram must carry an HMAC tag from this shared key (msg_auth.py genkey), default off")
+    parser.add_argument("--init-window", type=float, default=INIT_WINDOW,
+                        help="authenticated mode: max seconds between an INIT's timestamp and the server clock, 0 = no limit (default 60)")
+    parser.add_argument("--ts-dir", default=TS_DIR,
+                        help="keep the readings' time-series store in files here (one subdir per worker), read it with ts_store.py (default in memory)")
+    parser.add_argument("--ts-retention", type=float, default=None,
+                        help=f"keep the readings in a time-series store for this many seconds (default off, "
+                             f"{RAW_RETENTION} with --ts-dir)")
+    parser.add_argument("--ack-mode", choices=["packet", "cumulative"], default=ACK_MODE,
+                        help="one ACK per DATA packet, or cumulative+selective ACKs per device (default packet)")
+    parser.add_argument("--ack-every", type=int, default=ACK_EVERY,
+                        help="cumulative mode: ACK after this many DATA packets (default 8)")
+    parser.add_argument("--ack-delay", type=float, default=ACK_DELAY,
+                        help="cumulative mode: max seconds an ACK is held back (default 0.05)")
+    parser.add_argument("--session-timeout", type=float, default=SESSION_TIMEOUT,
+                        help="seconds without any packet before a session is dropped (default 15)")
+    parser.add_argument("--reorder-hold", type=float, default=REORDER_BUFFER_SECONDS,
+                        help="max seconds out-of-order DATA waits for the gap before it to fill, 0 disables reordering (default 0.3)")
+    args = parser.parse_args()
+    SERVER_PORT = args.port
+    REORDER_BUFFER_SECONDS = args.reorder_hold
+    SESSION_TIMEOUT = args.session_timeout
+    ACK_MODE = args.ack_mode
+    ACK_EVERY = args.ack_every
+    ACK_DELAY = args.ack_delay
+    LOG_LEVEL = LEVELS[args.log_level]
+    DATA_LOG_INTERVAL = args.data_log_interval
+    LATENCY_LOG_INTERVAL = args.latency_log_interval
+    STATS_FILE = args.stats_file
+    STATS_INTERVAL = args.stats_interval
+    RATE_LIMIT = args.rate_limit
+    RATE_BURST = args.rate_burst
+    GLOBAL_RATE = args.global_rate
+    GLOBAL_BURST = args.global_burst
+    SHED_POLICY = args.shed_policy
+    SHED_SAMPLE = args.shed_sample
+    AUTH_KEY_FILE = args.auth_key_file
+    INIT_WINDOW = args.init_window
+    if AUTH_KEY_FILE:
+        KEYS = KeyRing.from_file(AUTH_KEY_FILE)
+    TS_DIR = args.ts_dir
+    TS_RETENTION = args.ts_retention if args.ts_retention is not None else (RAW_RETENTION if args.ts_dir else 0)
+    RING_SLOTS = args.ring_slots
+    RING_SLOT_SIZE = args.ring_slot_size
+
+    if args.ring > 0 and args.workers > 1:
+        parser.error("--ring and --workers are two different ways to use more cores, pick one")
+    if args.ring > 0:
+        run_ring_server(args.ring)
+    elif args.workers > 1:
+        run_worker_pool(args.workers, args.engine)
+    else:
+        run_server(args.engine)